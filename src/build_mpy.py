@@ -0,0 +1,100 @@
+"""
+Andrea Favero
+
+Python code (host only) precompiling the pi_pico modules to .mpy, for a faster boot of the Responders.
+
+This script:
+- compiles every module of the pi_pico folder with mpy-cross, into the output folder (default 'build').
+- keeps as source the scripts executed by MicroPython (main.py).
+- skips the modules not run by the Responders (EXCLUDE): the Controller library and script, used on the host or on
+  a Pico acting as Controller (copied as source), and the allocation check (copied when needed).
+- prints the size of each file, ready to be copied to the Pico (i.e. mpremote cp -r build/* :).
+
+Notes:
+- mpy-cross must match the MicroPython version on the Pico (pip install mpy-cross==<version>).
+- MicroPython imports a .py before a .mpy with the same name: remove the .py modules from the Pico.
+- march (i.e. armv6m for RP2040, armv7emsp for RP2350) is only needed for native code.
+- usage: python3 build_mpy.py [out_dir] [march]
+
+
+
+MIT License
+
+Copyright (c) 2025 Andrea Favero
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+
+import os, shutil, subprocess, sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pi_pico')
+SOURCE_ONLY = ('main.py',)                 # scripts executed as source
+EXCLUDE = ('i2c_controller.py', 'i2c_pico_controller.py', 'alloc_check.py')  # modules not run by the Responders
+
+
+
+def find_mpy_cross():
+    """Returns the mpy-cross command (list), None when not installed."""
+    exe = shutil.which('mpy-cross')
+    if exe:
+        return [exe]
+    try:
+        import mpy_cross                        # pip package, providing the executable
+    except ImportError:
+        return None
+    exe = os.path.join(os.path.dirname(mpy_cross.__file__), 'mpy-cross')
+    return [exe] if os.path.exists(exe) else None
+
+
+
+def build(out_dir='build', march=None, printout=True, exclude=EXCLUDE):
+    """Compiles the pi_pico modules into out_dir, except the exclude ones. Returns the list of (file, bytes)."""
+    cmd = find_mpy_cross()
+    if cmd is None:
+        raise RuntimeError("mpy-cross not found: pip install mpy-cross (same version as the Pico MicroPython)")
+    os.makedirs(out_dir, exist_ok=True)
+    
+    built = []
+    for name in sorted(os.listdir(SRC_DIR)):
+        if not name.endswith('.py') or name in exclude:
+            continue
+        src = os.path.join(SRC_DIR, name)
+        if name in SOURCE_ONLY:                 # case of script, copied as source
+            dst = os.path.join(out_dir, name)
+            shutil.copyfile(src, dst)
+        else:                                   # case of module, compiled
+            dst = os.path.join(out_dir, name[:-3] + '.mpy')
+            args = cmd + ['-o', dst]
+            if march:
+                args.append('-march=' + march)
+            subprocess.run(args + [src], check=True)
+        built.append((os.path.basename(dst), os.path.getsize(dst)))
+    
+    if printout:
+        for name, size in built:
+            print(f"{name:<28} {size:>7} bytes")
+        print(f"{len(built)} files in {out_dir} (not included: {', '.join(exclude)})")
+    return built
+
+
+
+if __name__ == '__main__':
+    build(sys.argv[1] if len(sys.argv) > 1 else 'build', sys.argv[2] if len(sys.argv) > 2 else None)
@@ -0,0 +1,506 @@
+"""
+Andrea Favero
+
+Python code for the host side (PC).
+Fault injection on the I2C transports, and noise benchmark of the dataframe framings.
+
+This module:
+- FaultyTransport wraps any I2CController transport (i.e. the simulator), injecting faults at given rates:
+  bit flips, dropped and duplicated bytes (per byte), truncated transactions, stuck clock stretching
+  and NACKs (per transaction). The faults come from a seeded random generator (reproducible runs).
+- the injected faults are counted, as well as the resync latency: the transactions from the first faulted
+  one to the next dataframe acknowledged (status 1) after a clean transaction.
+- CheckedResponder is a SimResponder recording the dataframes applied with values other than the sent ones
+  (errors not detected by the checksum).
+- benchmark() sends the same random dataframes via I2CController (retries included) for each framing,
+  sequence and FEC setting, reporting goodput, undetected error rate, resync latency and FEC corrections.
+- SlowResponder decodes the received bytes at decode_us per byte on a virtual clock (VirtualBus), its decoder
+  pausing for stall_us at random (i.e. core0 busy elsewhere): a read waits (clock stretched) for the pending bytes
+  up to reply_timeout_us, then it returns 3 (busy), as the CorePipeline does; bytes exceeding rx_buffer are lost.
+- backpressure() sends the same dataframes without flow control (the Responder returns 2 at the reply timeout, as
+  before the busy status: the dataframe is sent again) and with flow control (the status is read again while busy, and the writes wait for
+  the credits), reporting goodput on the virtual clock, lost dataframes, retries and the Responder overflows.
+- credits_check() verifies the Controller doesn't stall on the credits: not enabled when the Responder receive buffer
+  can't hold a dataframe (escape framing, 4 fields), and a device reporting no free slots still gets its queued values.
+- broadcast_check() verifies the broadcast round trip for each framing: the general call command byte doesn't reach the
+  decoders (no length errors), and collect_acks() confirms the dataframes without sending them again.
+
+Notes:
+- the goodput is the payload of the correctly applied dataframes per second of bus time, the bus time
+  being estimated from the bytes on the wire (9 clocks per byte, address bytes included) at the bus speed,
+  plus the Controller timeout of each stuck clock stretching, plus transaction_us per transaction (the host
+  turnaround of each write or read: i.e. 100-200us via smbus2 on Linux, 0 counts the bus bytes only).
+- a truncated write ends with a regular STOP: only the Responder notices it.
+
+Usage:
+- python3 bus_faults.py [frames] [seed] [fault=rate ...] [transaction_us=us]
+  (i.e. python3 bus_faults.py 20000 1 bit_flip=0.005 transaction_us=150)
+- python3 bus_faults.py backpressure [frames] [seed]
+- python3 bus_faults.py credits
+- python3 bus_faults.py broadcast [frames]
+
+
+
+MIT License
+
+Copyright (c) 2025 Andrea Favero
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+
+
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pi_pico'))
+
+import random, time
+from i2c_controller import I2CController, SimTransport, SimResponder
+from frame_codec import ESCAPE_FRAMING, COBS_FRAMING, BUSY, INCOMPLETE, STATUS_MASK
+
+FAULTS = ('bit_flip', 'drop', 'duplicate', 'truncate', 'stretch', 'nack')
+DEFAULT_RATES = {'bit_flip': 0.001, 'drop': 0.0002, 'duplicate': 0.0002, 'truncate': 0.002, 'stretch': 0.0005,
+                 'nack': 0.002}
+MODES = ((ESCAPE_FRAMING, False, False), (ESCAPE_FRAMING, True, False), (COBS_FRAMING, False, False),
+         (COBS_FRAMING, True, False), (ESCAPE_FRAMING, True, True), (COBS_FRAMING, True, True))  # framing, sequence, fec
+
+
+
+class FaultyTransport:
+    """
+    Wraps an I2CController transport, injecting faults: bit_flip, drop and duplicate are rates per byte,
+    truncate, stretch and nack are rates per transaction (writes and reads).
+    """
+
+    def __init__(self, transport, bit_flip=0.0, drop=0.0, duplicate=0.0, truncate=0.0, stretch=0.0, nack=0.0,
+                 seed=None):
+        self.transport = transport
+        self.can_set_speed = transport.can_set_speed
+        self.rates = {'bit_flip': bit_flip, 'drop': drop, 'duplicate': duplicate, 'truncate': truncate,
+                      'stretch': stretch, 'nack': nack}
+        self.rng = random.Random(seed)
+        self.counts = {fault: 0 for fault in FAULTS}
+        self.writes = 0                 # write transactions
+        self.reads = 0                  # read transactions
+        self.wire_bytes = 0             # bytes on the wire, address bytes included
+        self.faulted = False            # True when the last write got a fault
+        self.fault_start = None         # write index of the first faulted write, until the next acknowledged dataframe
+        self.resync = []                # resync latencies, in write transactions
+
+    @property
+    def speed(self):
+        return self.transport.speed
+
+    def set_speed(self, freq):
+        self.transport.set_speed(freq)
+
+    def scan(self):
+        return self.transport.scan()
+
+    def _hit(self, fault):
+        if self.rng.random() < self.rates[fault]:
+            self.counts[fault] += 1
+            return True
+        return False
+
+    def _bytes(self, data):
+        """Returns the data with the per byte faults: bit flips, dropped and duplicated bytes."""
+        rates = self.rates
+        if not (rates['bit_flip'] or rates['drop'] or rates['duplicate']):
+            return bytes(data)
+        out = bytearray()
+        for byte in data:
+            if self._hit('drop'):
+                continue
+            if self._hit('bit_flip'):
+                byte ^= 1 << self.rng.randrange(8)
+            out.append(byte)
+            if self._hit('duplicate'):
+                out.append(byte)
+        return bytes(out)
+
+    def _transaction(self, data):
+        """Applies the per transaction faults: returns (delivered bytes, OSError to raise or None)."""
+        if self._hit('nack'):
+            return b'', OSError(121, "Remote I/O error (injected NACK)")
+        if data and self._hit('stretch'):
+            return data[:self.rng.randrange(len(data))], OSError(110, "Clock stretching timeout (injected)")
+        if data and self._hit('truncate'):
+            return data[:self.rng.randrange(len(data))], None
+        return data, None
+
+    def write(self, adr, data):
+        self.writes += 1
+        counts = sum(self.counts.values())
+        delivered, error = self._transaction(self._bytes(data))
+        self.faulted = sum(self.counts.values()) != counts or len(delivered) != len(data)
+        if self.faulted and self.fault_start is None:
+            self.fault_start = self.writes
+        self.wire_bytes += 1 + len(delivered)
+        if delivered:
+            self.transport.write(adr, delivered)
+        if error is not None:
+            raise error
+
+    def read(self, adr, n=1):
+        self.reads += 1
+        if self._hit('nack'):
+            self.wire_bytes += 1
+            raise OSError(121, "Remote I/O error (injected NACK)")
+        if self._hit('stretch'):
+            self.wire_bytes += 1
+            raise OSError(110, "Clock stretching timeout (injected)")
+        reply = self.transport.read(adr, n)
+        self.wire_bytes += 1 + len(reply)
+        if reply[0] == 1 and not self.faulted and self.fault_start is not None:
+            self.resync.append(self.writes - self.fault_start)   # acknowledged after a clean write
+            self.fault_start = None
+        data = bytearray(reply)
+        if self.rates['bit_flip']:
+            for i in range(len(data)):
+                if self._hit('bit_flip'):
+                    data[i] ^= 1 << self.rng.randrange(8)
+        return bytes(data)
+
+    def close(self):
+        self.transport.close()
+
+
+
+class CheckedResponder(SimResponder):
+    """SimResponder counting the dataframes applied with values other than the expected ones (undetected errors)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.expected = None            # values of the dataframe being sent
+        self.undetected = 0             # dataframes applied with wrong values
+
+    def _frame(self):
+        frames = self.frames
+        super()._frame()
+        if self.frames != frames and self.expected is not None and self.fields != self.expected:
+            self.undetected += 1
+
+
+
+class VirtualBus(SimTransport):
+    """SimTransport with a virtual clock: each transaction takes its bytes on the wire, plus transaction_us."""
+
+    def __init__(self, speed=400000, transaction_us=0):
+        super().__init__(speed)
+        self.transaction_us = transaction_us
+        self.clock_us = 0.0             # virtual time, clock stretching of the Responders included
+
+    def _tick(self, nbytes):
+        self.clock_us += nbytes * 9 * 1000000 / self.speed + self.transaction_us
+
+    def write(self, adr, data):
+        self._tick(1 + len(data))       # address byte and data
+        super().write(adr, data)
+
+    def read(self, adr, n=1):
+        self._tick(1 + n)
+        return super().read(adr, n)
+
+
+
+class SlowResponder(CheckedResponder):
+    """
+    CheckedResponder decoding the received bytes at decode_us per byte on the VirtualBus clock, the decoder pausing
+    for stall_us with probability stall_rate at every write. A read waits for the pending bytes up to reply_timeout_us
+    (clock stretching), then it returns timeout_status (3, busy). Bytes exceeding rx_buffer are lost (counted as
+    overflows).
+    """
+
+    def __init__(self, bus, *args, decode_us=40, stall_rate=0.02, stall_us=20000, reply_timeout_us=5000,
+                 rx_buffer=256, seed=1, timeout_status=BUSY, **kwargs):
+        super().__init__(*args, rx_buffer=rx_buffer, **kwargs)
+        self.bus = bus
+        self.decode_us = decode_us
+        self.stall_rate = stall_rate
+        self.stall_us = stall_us
+        self.reply_timeout_us = reply_timeout_us
+        self.timeout_status = timeout_status   # status at the reply timeout (2 before the busy status)
+        self.rng = random.Random(seed)
+        self.backlog = bytearray()      # received bytes not decoded yet
+        self.ready_us = 0.0             # virtual time the decoder is ready for the next byte
+        self.overflows = 0              # bytes lost, the receive buffer being full
+        self.timeouts = 0               # reads returning busy
+
+    def _free_bytes(self):
+        return self.rx_buffer - len(self.backlog)
+
+    def _run_decoder(self):
+        """Decodes the pending bytes the virtual clock allows."""
+        clock_us = self.bus.clock_us
+        if not self.backlog:
+            self.ready_us = max(self.ready_us, clock_us)
+            return
+        n = min(len(self.backlog), max(0, int((clock_us - self.ready_us) / self.decode_us)))
+        if n:
+            data = bytes(self.backlog[:n])
+            del self.backlog[:n]
+            self.ready_us += n * self.decode_us
+            SimResponder.write(self, data)
+
+    def write(self, data):
+        self._run_decoder()
+        if self.rng.random() < self.stall_rate:     # the decoder is busy elsewhere
+            self.ready_us = max(self.ready_us, self.bus.clock_us) + self.stall_us
+        free = self._free_bytes()
+        if len(data) > free:
+            self.overflows += len(data) - free
+            data = data[:free]
+        self.backlog += data
+
+    def read(self, n=1):
+        self._run_decoder()
+        busy = False
+        if self.backlog:                # clock is stretched while the decoder works on the pending bytes
+            wait_us = self.ready_us + len(self.backlog) * self.decode_us - self.bus.clock_us
+            busy = wait_us > self.reply_timeout_us
+            self.bus.clock_us += self.reply_timeout_us if busy else wait_us
+            self._run_decoder()
+        if not busy:
+            return super().read(n)
+        self.timeouts += 1
+        stats_page = self.stats_page    # a busy reply doesn't consume the statistics page
+        reply = bytearray(super().read(n))
+        self.stats_page = stats_page
+        reply[0] = (reply[0] & ~STATUS_MASK & 0xFF) | self.timeout_status
+        return bytes(reply)
+
+
+
+def run_mode(frames, framing, sequence, rates, seed=1, fields=2, speed=400000, stretch_timeout_us=35000, fec=False,
+             transaction_us=0):
+    """
+    Sends frames dataframes through a FaultyTransport, with the framing, sequence and fec setting.
+    Returns the results.
+    """
+    sim = SimTransport(speed)
+    responder = CheckedResponder(fields, sequence, framing=framing, fec=fec)
+    sim.add_responder(0x41, responder)
+    transport = FaultyTransport(sim, seed=seed, **rates)
+    controller = I2CController(transport, fields, sequence, max_retries=3, backoff_base_s=0, backoff_max_s=0,
+                               breaker_threshold=1 << 30, framing=framing, fec=fec)
+    controller.add_device('A', 0x41)
+    rng = random.Random(seed + 1)       # same dataframes for every mode
+    delivered = 0
+    for _ in range(frames):
+        values = [rng.randrange(0x10000) for _ in range(fields)]
+        responder.expected = values
+        if controller.send(values, 'A') == 1 and responder.fields == values:
+            delivered += 1
+    bus_us = (transport.wire_bytes * 9 * 1000000 / speed + transport.counts['stretch'] * stretch_timeout_us +
+              (transport.writes + transport.reads) * transaction_us)
+    resync = transport.resync
+    return {'framing': framing, 'sequence': sequence, 'fec': fec, 'delivered': delivered, 'lost': frames - delivered,
+            'goodput_Bps': int(delivered * 2 * fields / (bus_us / 1000000)) if bus_us else 0,
+            'undetected_rate': responder.undetected / frames, 'undetected': responder.undetected,
+            'resync_mean': round(sum(resync) / len(resync), 2) if resync else 0,
+            'resync_max': max(resync) if resync else 0,
+            'retries': controller.devices['A'].retries, 'corrections': responder.corrections,
+            'faults': dict(transport.counts)}
+
+
+
+def benchmark(frames=20000, seed=1, rates=None, modes=MODES, printout=True, transaction_us=0):
+    """Runs run_mode() for each (framing, sequence, fec) mode, with the same faults rates and seed."""
+    rates = dict(DEFAULT_RATES if rates is None else rates)
+    results = []
+    if printout:
+        print(f"Noise benchmark: {frames} dataframes per mode, seed {seed}, rates {rates}, "
+              f"transaction overhead {transaction_us} us")
+    for framing, sequence, fec in modes:
+        t_ref = time.time()
+        result = run_mode(frames, framing, sequence, rates, seed, fec=fec, transaction_us=transaction_us)
+        results.append(result)
+        if printout:
+            print(f"{framing:>6}  sequence {str(sequence):<5}  fec {str(fec):<5}  goodput {result['goodput_Bps']:>6} B/s  "
+                  f"lost {result['lost']:>4}  undetected {result['undetected_rate']:.2e}  "
+                  f"resync mean {result['resync_mean']} max {result['resync_max']}  "
+                  f"retries {result['retries']}  corrections {result['corrections']}  ({time.time() - t_ref:.1f} s)")
+    return results
+
+
+
+def backpressure(frames=5000, seed=1, fields=2, sequence=True, speed=400000, transaction_us=50, printout=True,
+                 **slow):
+    """
+    Sends the same dataframes to a SlowResponder without flow control (2 at the reply timeout, handled as an
+    error: the dataframe is sent again) and with flow control (status read again while busy, credits pacing the writes).
+    The slow keyword arguments go to SlowResponder (decode_us, stall_rate, stall_us, reply_timeout_us, rx_buffer).
+    Returns the results of both runs.
+    """
+    results = []
+    if printout:
+        print(f"Backpressure benchmark: {frames} dataframes, seed {seed}, {speed} Hz, {slow or 'default Responder'}")
+    for flow in (False, True):
+        bus = VirtualBus(speed, transaction_us)
+        responder = SlowResponder(bus, fields, sequence, credits=flow, seed=seed,
+                                  timeout_status=BUSY if flow else INCOMPLETE, **slow)
+        bus.add_responder(0x41, responder)
+        controller = I2CController(bus, fields, sequence, max_retries=3, backoff_base_s=0, backoff_max_s=0,
+                                   breaker_threshold=1 << 30, credits=flow, max_busy_polls=8 if flow else 0)
+        controller.add_device('A', 0x41)
+        rng = random.Random(seed + 1)   # same dataframes for both runs
+        delivered = 0
+        pending = 0                     # dataframes left busy (received, decoded after the status polls)
+        for _ in range(frames):
+            values = [rng.randrange(0x10000) for _ in range(fields)]
+            responder.expected = values
+            device_return = controller.send(values, 'A')
+            if device_return == 1 and responder.fields == values:
+                delivered += 1
+            elif device_return == BUSY:
+                pending += 1
+        health = controller.devices['A']
+        clock_s = bus.clock_us / 1000000
+        result = {'flow_control': flow, 'delivered': delivered, 'pending': pending, 'lost': frames - delivered - pending,
+                  'goodput_Bps': int(delivered * 2 * fields / clock_s) if clock_s else 0, 'retries': health.retries,
+                  'busy_polls': health.busy, 'stalls': health.stalls, 'tx_bytes': health.tx_bytes,
+                  'overflows': responder.overflows, 'timeouts': responder.timeouts,
+                  'undetected': responder.undetected}
+        results.append(result)
+        if printout:
+            print(f"flow control {str(flow):<5}  goodput {result['goodput_Bps']:>6} B/s  lost {result['lost']:>4}  "
+                  f"pending {result['pending']:>3}  retries {result['retries']:>5}  busy polls {result['busy_polls']:>5}  stalls {result['stalls']:>4}  "
+                  f"tx bytes {result['tx_bytes']:>7}  overflows {result['overflows']:>5}  timeouts {result['timeouts']}")
+    return results
+
+
+
+class FullResponder(SimResponder):
+    """SimResponder reporting no free slots, whatever the received bytes (i.e. a stuck decoder)."""
+
+    def _free_bytes(self):
+        return 0
+
+
+
+def credits_check(sends=20, max_s=0.5, printout=True):
+    """
+    Checks the credits don't stall the Controller, on the simulator:
+    - escape framing with 4 fields: the dataframe slot (20 bytes) exceeds the 16 bytes receive buffer, the Responder
+      refuses the credits and negotiate() doesn't enable them; sends take no slot waits.
+    - a device reporting no free slots: send() and the sender thread write anyway, after a bounded wait.
+    Returns the results, raising AssertionError on failure.
+    """
+    fields = 4
+    sim = SimTransport(400000)
+    responder = sim.add_responder(0x41, SimResponder(fields, framing=ESCAPE_FRAMING, credits=True))
+    assert not responder.credits, "credits accepted with a receive buffer shorter than a dataframe"
+    controller = I2CController(sim, fields, backoff_base_s=0.002, credits=True)
+    controller.add_device('A', 0x41, credits=False)
+    controller.negotiate(framing=ESCAPE_FRAMING)
+    health = controller.devices['A']
+    assert not health.credits and not responder.credits, "credits negotiated on a 16 bytes receive buffer"
+    t_ref = time.time()
+    for i in range(sends):
+        assert controller.send([i, i + 1, i + 2, i + 3], 'A') == 1
+    negotiated_s = time.time() - t_ref
+    assert negotiated_s < max_s and health.stalls == 0, (negotiated_s, health.stalls)
+    
+    sim = SimTransport(400000)
+    responder = sim.add_responder(0x42, FullResponder(fields, framing=ESCAPE_FRAMING, credits=True, rx_buffer=64))
+    assert responder.credits
+    controller = I2CController(sim, fields, backoff_base_s=0.0001, backoff_max_s=0.001, credits=True)
+    controller.add_device('B', 0x42)
+    health = controller.devices['B']
+    assert controller.send([1, 2, 3, 4], 'B') == 1 and health.slots == 0
+    assert controller.send([5, 6, 7, 8], 'B') == 1, "write not done after the bounded wait"
+    controller.start_sender()
+    for i in range(sends):
+        controller.post([i, 0, 0, i], 'B')
+        time.sleep(0.005)
+    time.sleep(0.1)
+    controller.stop()
+    queue = health.queue.summary()
+    assert queue['sent'] > 0 and responder.fields[3] == sends - 1, (queue, responder.fields)
+    result = {'negotiated_s': round(negotiated_s, 3), 'full_stalls': health.stalls, 'full_queue_sent': queue['sent'],
+              'full_queue_depth': queue['depth']}
+    if printout:
+        print("Credits check:", result)
+    return result
+
+
+
+def broadcast_check(frames=200, seed=1, modes=MODES, printout=True):
+    """
+    Checks the broadcast round trip on the simulator, for each framing, sequence and FEC setting: two Responders
+    accepting the general call apply every dataframe, without length or checksum errors, and collect_acks() finds
+    all of them applied (no dataframe sent again).
+    Returns the results, raising AssertionError on failure.
+    """
+    rng = random.Random(seed)
+    fields = 2
+    results = {}
+    for framing, sequence, fec in modes:
+        sim = SimTransport(400000)
+        responders = [sim.add_responder(adr, SimResponder(fields, sequence, general_call=True, framing=framing, fec=fec))
+                      for adr in (0x41, 0x42)]
+        controller = I2CController(sim, fields, sequence, framing=framing, fec=fec)
+        controller.add_device('A', 0x41)
+        controller.add_device('B', 0x42)
+        for _ in range(frames):
+            values = [rng.randrange(0x10000) for _ in range(fields)]
+            assert controller.broadcast(values)
+            assert controller.collect_acks() == {'A': 1, 'B': 1}
+            for responder in responders:
+                assert responder.fields == values, (responder.fields, values)
+        for responder in responders:
+            assert responder.length_errors == 0 and responder.checksum_errors == 0, \
+                (framing, responder.length_errors, responder.checksum_errors)
+            assert responder.frames == frames, (framing, responder.frames)
+        resent = sum(health.sent for health in controller.devices.values()) - 2 * frames
+        assert resent == 0, (framing, resent)     # the broadcast dataframes have been confirmed, not sent again
+        name = f"{framing}{'+seq' if sequence else ''}{'+fec' if fec else ''}"
+        results[name] = {'frames': frames, 'resent': resent,
+                         'length_errors': sum(responder.length_errors for responder in responders)}
+        if printout:
+            print(f"Broadcast check {name:<14}", results[name])
+    return results
+
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'credits':
+        credits_check()
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == 'broadcast':
+        broadcast_check(int(sys.argv[2]) if len(sys.argv) > 2 else 200)
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == 'backpressure':
+        backpressure(int(sys.argv[2]) if len(sys.argv) > 2 else 5000, int(sys.argv[3]) if len(sys.argv) > 3 else 1)
+        sys.exit(0)
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    rates = dict(DEFAULT_RATES)
+    transaction_us = 0
+    for arg in sys.argv[3:]:
+        name, _, value = arg.partition('=')
+        if name == 'transaction_us':
+            transaction_us = float(value)
+            continue
+        if name not in FAULTS:
+            print(f"Unknown fault {name}, expected one of {FAULTS}")
+            sys.exit(1)
+        rates[name] = float(value)
+    benchmark(frames, seed, rates, transaction_us=transaction_us)
@@ -0,0 +1,286 @@
+"""
+Andrea Favero
+
+Python code for the host side (Raspberry Pi Zero 2, PC).
+Capture and replay of the I2C bus traffic, to reproduce field issues and to load test with real traffic.
+
+This module:
+- BusLogWriter appends every I2C transaction to a compact binary log.
+- each record has timestamp, address, direction (write or read), status (ok or bus error) and bytes.
+- BusLogReader reads the log via mmap, without loading it into memory.
+- RecordingTransport wraps any I2CController transport, recording each transaction.
+- replay() sends the logged writes (and reads) to a transport, at the original or maximum speed,
+  comparing the replies with the logged ones.
+
+Log format (little endian):
+- file header: 8 bytes magic, 8 bytes log start time (us since the epoch).
+- record header: 8 bytes timestamp (us since the log start), address, direction, status, 2 bytes length.
+- record data: length bytes.
+
+Usage:
+- python3 bus_log.py dump <log> [records]
+- python3 bus_log.py replay <log> [fields] [sequence] [max]    (replays to the simulator)
+
+
+
+MIT License
+
+Copyright (c) 2025 Andrea Favero
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+
+
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pi_pico'))
+
+import mmap, struct, threading, time
+
+MAGIC = b'I2CLOG1\n'            # file identifier, with format version
+FILE_HEADER = struct.Struct('<8sQ')
+RECORD_HEADER = struct.Struct('<QBBBH')
+
+WRITE = 0                       # Controller to Responder
+READ = 1                        # Responder to Controller
+STATUS_OK = 0                   # transaction completed
+STATUS_BUS_ERROR = 1            # transaction raised an OSError (i.e. no ACK)
+
+
+
+class BusLogWriter:
+    """Append-only writer of the binary bus log. Thread safe (the Controller re-probe thread shares the bus)."""
+
+    def __init__(self, path, buffering=65536):
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.path = path
+        self.file = open(path, 'ab', buffering=buffering)
+        if new_file:
+            self.t0_us = time.time_ns() // 1000
+            self.file.write(FILE_HEADER.pack(MAGIC, self.t0_us))
+        else:                                            # appending to an existing log keeps its time reference
+            with open(path, 'rb') as f:
+                magic, self.t0_us = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a bus log")
+        self._t0_mono_ns = time.monotonic_ns() - (time.time_ns() // 1000 - self.t0_us) * 1000
+        self._lock = threading.Lock()
+        self.records = 0
+
+    def record(self, adr, direction, data, status=STATUS_OK, t_us=None):
+        """Appends a record; t_us (us since the log start) defaults to now."""
+        if t_us is None:
+            t_us = (time.monotonic_ns() - self._t0_mono_ns) // 1000
+        data = bytes(data)
+        with self._lock:
+            self.file.write(RECORD_HEADER.pack(t_us, adr, direction, status, len(data)))
+            self.file.write(data)
+            self.records += 1
+
+    def flush(self):
+        with self._lock:
+            self.file.flush()
+
+    def close(self):
+        with self._lock:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+
+class BusLogReader:
+    """
+    Memory-mapped reader of the binary bus log.
+    Iterating returns (t_us, adr, direction, status, data) tuples, only the iterated records are read from disk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        if size < FILE_HEADER.size:
+            raise ValueError(f"{path} is not a bus log")
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.t0_us = FILE_HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a bus log")
+
+    def __iter__(self):
+        mm = self.mm
+        size = len(mm)
+        unpack_from = RECORD_HEADER.unpack_from
+        header_size = RECORD_HEADER.size
+        pos = FILE_HEADER.size
+        while pos + header_size <= size:
+            t_us, adr, direction, status, length = unpack_from(mm, pos)
+            pos += header_size
+            if pos + length > size:                      # record truncated (i.e. the Controller was killed)
+                break
+            yield t_us, adr, direction, status, mm[pos:pos + length]
+            pos += length
+
+    def write_stream(self, adr=None):
+        """Returns the concatenated bytes written to adr (or to all addresses), i.e. for frame_batch.decode_stream."""
+        return b''.join(data for t_us, a, direction, status, data in self
+                        if direction == WRITE and status == STATUS_OK and (adr is None or a == adr))
+
+    def summary(self):
+        """Returns a dict with records, bytes, errors and duration, and per address counters."""
+        records = written = errors = 0
+        first = last = None
+        per_adr = {}
+        for t_us, adr, direction, status, data in self:
+            records += 1
+            first = t_us if first is None else first
+            last = t_us
+            counters = per_adr.setdefault(adr, {'writes': 0, 'reads': 0, 'bus_errors': 0, 'bytes': 0})
+            counters['writes' if direction == WRITE else 'reads'] += 1
+            counters['bytes'] += len(data)
+            written += len(data)
+            if status != STATUS_OK:
+                counters['bus_errors'] += 1
+                errors += 1
+        duration_s = 0 if first is None else (last - first) / 1e6
+        return {'records': records, 'bytes': written, 'bus_errors': errors,
+                'duration_s': duration_s, 'addresses': per_adr}
+
+    def close(self):
+        if getattr(self, 'mm', None) is not None:
+            self.mm.close()
+            self.mm = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+
+class RecordingTransport:
+    """Wraps an I2CController transport, recording every write and read to a BusLogWriter."""
+
+    def __init__(self, transport, log):
+        self.transport = transport
+        self.log = log if isinstance(log, BusLogWriter) else BusLogWriter(log)
+        self.can_set_speed = transport.can_set_speed
+
+    @property
+    def speed(self):
+        return self.transport.speed
+
+    def set_speed(self, freq):
+        self.transport.set_speed(freq)
+
+    def scan(self):
+        return self.transport.scan()
+
+    def write(self, adr, data):
+        try:
+            self.transport.write(adr, data)
+        except OSError:
+            self.log.record(adr, WRITE, data, STATUS_BUS_ERROR)
+            raise
+        self.log.record(adr, WRITE, data)
+
+    def read(self, adr, n=1):
+        try:
+            data = self.transport.read(adr, n)
+        except OSError:
+            self.log.record(adr, READ, b'', STATUS_BUS_ERROR)
+            raise
+        self.log.record(adr, READ, data)
+        return data
+
+    def close(self):
+        self.log.close()
+        self.transport.close()
+
+
+
+def replay(path, transport, max_speed=False, printout=False):
+    """
+    Replays the log to the transport: writes are sent, reads are repeated (same length) and compared
+    with the logged replies. Logged bus errors are replayed too (the data is sent anyway).
+    When max_speed is False, the original timing between the transactions is kept.
+    Returns a dict with the counters and the elapsed time.
+    """
+    stats = {'writes': 0, 'reads': 0, 'mismatches': 0, 'bus_errors': 0, 'elapsed_s': 0.0}
+    with BusLogReader(path) as reader:
+        t_ref = time.monotonic()
+        t_first = None
+        for t_us, adr, direction, status, data in reader:
+            if not max_speed:
+                t_first = t_us if t_first is None else t_first
+                delay = (t_us - t_first) / 1e6 - (time.monotonic() - t_ref)
+                if delay > 0:
+                    time.sleep(delay)
+            try:
+                if direction == WRITE:
+                    stats['writes'] += 1
+                    transport.write(adr, data)
+                else:
+                    stats['reads'] += 1
+                    reply = transport.read(adr, max(1, len(data)))
+                    if status == STATUS_OK and bytes(reply) != data:
+                        stats['mismatches'] += 1
+                        if printout:
+                            print(f"Reply mismatch at {t_us} us, address {hex(adr)}: {list(reply)} instead of {list(data)}")
+            except OSError as e:
+                stats['bus_errors'] += 1
+                if printout:
+                    print(f"Bus error at {t_us} us, address {hex(adr)}: {e}")
+        stats['elapsed_s'] = time.monotonic() - t_ref
+    return stats
+
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] not in ('dump', 'replay'):
+        print(__doc__.split('Usage:')[1].split('\n\n')[0])
+        sys.exit(1)
+    
+    if sys.argv[1] == 'dump':
+        limit = int(sys.argv[3]) if len(sys.argv) > 3 else None
+        with BusLogReader(sys.argv[2]) as reader:
+            for i, (t_us, adr, direction, status, data) in enumerate(reader):
+                if limit is not None and i >= limit:
+                    break
+                print(f"{t_us / 1e6:12.6f}  {hex(adr)}  {'W' if direction == WRITE else 'R'}  "
+                      f"{'ok ' if status == STATUS_OK else 'err'}  {data.hex(' ')}")
+            print(reader.summary())
+    
+    else:
+        from i2c_controller import SimTransport, SimResponder
+        fields = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+        sequence = len(sys.argv) > 4 and sys.argv[4].lower() in ('1', 'true', 'sequence')
+        max_speed = len(sys.argv) > 5 and sys.argv[5].lower() in ('1', 'true', 'max')
+        transport = SimTransport()
+        with BusLogReader(sys.argv[2]) as reader:
+            for adr in reader.summary()['addresses']:
+                transport.add_responder(adr, SimResponder(fields, sequence))
+        print(replay(sys.argv[2], transport, max_speed, printout=True))
@@ -0,0 +1,223 @@
+"""
+Andrea Favero
+
+Python code for the host side (Raspberry Pi Zero 2, PC), requiring NumPy.
+Batch version of the dataframe codec (frame_codec), for replays and offline analysis of the bus traffic.
+
+This module:
+- encodes N dataframes at once, from an (N, fields) uint16 array (and optional N sequence bytes).
+- returns a single escaped byte stream, plus the offsets of each dataframe in the stream.
+- decodes a captured byte stream into dataframes, with the status of each one (OK, checksum error, length error).
+- escapes, checksums and dataframe boundaries are all computed with vectorized NumPy operations.
+
+Notes:
+- an escaped byte is detected by the parity of the escape characters run in front of it.
+- the decoder returns the same dataframes and status as the streaming FrameDecoder, for streams made of
+  dataframes and junk bytes without escape characters (i.e. the smbus2 register byte).
+- run this file to check both functions against frame_codec, and to time them.
+
+
+
+MIT License
+
+Copyright (c) 2025 Andrea Favero
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pi_pico'))
+
+import numpy as np
+from frame_codec import STX, ETX, ESC, OK, CHECKSUM_ERROR, INCOMPLETE
+
+
+
+def _payload(values, seq=None):
+    """Returns the (N, payload_len) uint8 array of the payloads: (sequence) + 16bits fields, big endian."""
+    values = np.asarray(values, dtype=np.uint16)
+    if values.ndim == 1:
+        values = values[:, None]
+    n = values.shape[0]
+    fields = values.astype('>u2').view(np.uint8).reshape(n, -1)   # high byte first, as the Controller
+    if seq is None:
+        return fields
+    seq = np.asarray(seq).astype(np.uint8).reshape(n, 1)
+    return np.hstack((seq, fields))
+
+
+
+def encode_batch(values, seq=None):
+    """
+    Encodes N dataframes: STX + (sequence) + 16bits fields + checksum + ETX, with escapes.
+    values is an (N, fields) array of 16bits values, seq is None or an array of N sequence bytes.
+    Returns the stream (uint8 array) and the offsets (N + 1 int64): dataframe i is stream[offsets[i]:offsets[i+1]].
+    """
+    payload = _payload(values, seq)
+    n, payload_len = payload.shape
+    checksum = (payload.sum(axis=1, dtype=np.int64) + STX) & 0xFF
+    
+    # each dataframe as a row: STX, payload, checksum, ETX
+    rows = np.empty((n, payload_len + 3), dtype=np.uint8)
+    rows[:, 0] = STX
+    rows[:, 1:-2] = payload
+    rows[:, -2] = checksum
+    rows[:, -1] = ETX
+    
+    # bytes to be escaped are repeated, and the first copy is then replaced by the escape character
+    body = rows[:, 1:-1]
+    escaped = np.zeros(rows.shape, dtype=bool)
+    escaped[:, 1:-1] = (body == STX) | (body == ETX) | (body == ESC)
+    repeats = 1 + escaped.ravel()
+    stream = np.repeat(rows.ravel(), repeats)
+    starts = np.cumsum(repeats) - repeats                    # position of each byte (or its escape) in the stream
+    stream[starts[escaped.ravel()]] = ESC
+    
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(repeats.reshape(rows.shape).sum(axis=1), out=offsets[1:])
+    return stream, offsets
+
+
+
+def decode_stream(stream, fields, sequence=False):
+    """
+    Decodes a byte stream (i.e. the concatenated Controller writes) into dataframes.
+    Returns a dict with:
+    - 'values': (M, fields) uint16 array (zeros where the dataframe length is wrong).
+    - 'seq': M sequence bytes (None when sequence is False).
+    - 'status': M statuses, as returned by the Responder (1 OK, 0 checksum error, 2 length error).
+    - 'valid': M booleans, True when the status is OK.
+    - 'spans': (M, 2) array with the stream positions of STX and ETX (or of the byte closing a too long dataframe).
+    """
+    b = np.frombuffer(bytes(stream), dtype=np.uint8) if not isinstance(stream, np.ndarray) else stream.astype(np.uint8, copy=False)
+    size = b.size
+    seq_bytes = 1 if sequence else 0
+    payload_len = seq_bytes + 2 * fields
+    idx = np.arange(size)
+    
+    # a byte is escaped when the escape characters run in front of it has odd length
+    is_esc = b == ESC
+    last_non_esc = np.maximum.accumulate(np.where(is_esc, -1, idx))
+    run_before = np.empty(size, dtype=np.int64)
+    if size:
+        run_before[0] = 0
+        run_before[1:] = idx[:-1] - last_non_esc[:-1]
+    escaped = (run_before & 1) == 1
+    marker = is_esc & ~escaped                               # escape characters, not part of the data
+    stx = np.flatnonzero((b == STX) & ~escaped)
+    etx = np.flatnonzero((b == ETX) & ~escaped)
+    data = ~(marker | (((b == STX) | (b == ETX)) & ~escaped))
+    
+    # each STX opens a dataframe, closed by the next STX or ETX: the ETX completes it, while a STX
+    # abandons it (unless already longer than a dataframe, as FrameDecoder returns a length error then)
+    control = np.concatenate((stx, etx))
+    order = np.argsort(control, kind='stable')
+    control, is_stx = control[order], np.arange(control.size)[order] < stx.size
+    opener = np.flatnonzero(is_stx)
+    start = control[opener]
+    closer = opener + 1
+    closed = closer < control.size
+    end = np.full(start.size, size, dtype=np.int64)          # end of stream, for the last open dataframe
+    end[closed] = control[closer[closed]]
+    by_etx = np.zeros(start.size, dtype=bool)
+    by_etx[closed] = ~is_stx[closer[closed]]
+    
+    # data bytes in between STX and ETX
+    data_cs = np.concatenate(([0], np.cumsum(data)))
+    first = data_cs[start + 1]                               # data bytes in front of the dataframe
+    count = data_cs[end] - first
+    keep = by_etx | (count > payload_len + 1)
+    start, etx, first, count = start[keep], end[keep], first[keep], count[keep]
+    length_ok = count == payload_len + 1
+    
+    m = start.size
+    status = np.full(m, INCOMPLETE, dtype=np.uint8)
+    values = np.zeros((m, fields), dtype=np.uint16)
+    seq = np.zeros(m, dtype=np.uint8) if sequence else None
+    if length_ok.any():
+        data_pos = np.flatnonzero(data)
+        frames = b[data_pos[first[length_ok, None] + np.arange(payload_len + 1)]]
+        checksum_ok = ((frames[:, :-1].sum(axis=1, dtype=np.int64) + STX) & 0xFF) == frames[:, -1]
+        status[length_ok] = np.where(checksum_ok, OK, CHECKSUM_ERROR)
+        field_bytes = frames[:, seq_bytes:-1].astype(np.uint16)
+        values[length_ok] = (field_bytes[:, 0::2] << 8) | field_bytes[:, 1::2]
+        if sequence:
+            seq[length_ok] = frames[:, 0]
+    
+    return {'values': values, 'seq': seq, 'status': status, 'valid': status == OK,
+            'spans': np.column_stack((start, etx))}
+
+
+
+def check(n=100000, fields=2, sequence=True, seed=None, printout=True):
+    """
+    Compares the batch functions with frame_codec, on n random escape-heavy dataframes,
+    part of them corrupted and separated by junk bytes. Returns the encode and decode times.
+    """
+    import random, time
+    from frame_codec import encode_frame, FrameDecoder
+    
+    rng = np.random.default_rng(seed)
+    values = rng.choice(np.array([0x0202, 0x0303, 0x5C5C, 0x025C, 0x035C, 0], dtype=np.uint16), (n, fields))
+    values ^= rng.integers(0, 0x10000, (n, fields), dtype=np.uint16) * (rng.random((n, fields)) < 0.5)
+    seq = rng.integers(0, 256, n, dtype=np.uint8) if sequence else None
+    
+    t_ref = time.perf_counter()
+    stream, offsets = encode_batch(values, seq)
+    t_encode = time.perf_counter() - t_ref
+    for i in range(0, n, max(1, n // 1000)):                 # sampled comparison with the single dataframe encoder
+        frame = encode_frame(values[i].tolist(), None if seq is None else int(seq[i]))
+        assert bytes(stream[offsets[i]:offsets[i + 1]]) == bytes(frame), i
+    
+    # captured stream: bit flips and junk (register byte, without STX and escape characters)
+    captured = bytearray()
+    for i in range(n):
+        frame = bytearray(stream[offsets[i]:offsets[i + 1]])
+        if random.random() < 0.05:
+            frame[random.randrange(len(frame))] ^= 1 << random.randrange(8)
+        if random.random() < 0.2:
+            captured.append(random.choice((0x00, 0x01, 0x41, 0xFF)))
+        captured += frame
+    
+    t_ref = time.perf_counter()
+    result = decode_stream(captured, fields, sequence)
+    t_decode = time.perf_counter() - t_ref
+    
+    decoder = FrameDecoder((1 if sequence else 0) + 2 * fields)
+    ref_status, ref_values = [], []
+    for byte in captured:
+        status = decoder.feed(byte)
+        if status is not None:
+            ref_status.append(status)
+            ref_values.append(decoder.fields([0] * fields, 1 if sequence else 0, fields) if status == OK else None)
+    assert result['status'].tolist() == ref_status, "status differs from FrameDecoder"
+    for i in np.flatnonzero(result['valid']):
+        assert result['values'][i].tolist() == ref_values[i], i
+    
+    if printout:
+        print(f"Batch codec: {n} dataframes, encode {t_encode * 1000:.1f} ms, decode {t_decode * 1000:.1f} ms, "
+              f"valid {int(result['valid'].sum())} of {result['status'].size}")
+    return t_encode, t_decode
+
+
+
+if __name__ == '__main__':
+    check(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
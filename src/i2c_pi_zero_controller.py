@@ -9,10 +9,21 @@ This Class:
 - it sends datafarames to each device.
 - dataframes are based on a (manually) defined number of 16bits fields.
 - each dataframe includes STX, 16bits field(s), escape characters, checksum and ETX.
+- optionally, each dataframe includes a sequence byte, allowing safe retries after an I2C timeout.
 - the 16bits field(s) is a randome 16bits integer.
 - after sendig a dataframe, it inquires the device if dataframe is correctly received.
+- a dataframe not correctly received is sent again, with exponential backoff, for a limited number of retries.
+- a device failing too many times in a row is skipped (circuit breaker) and re-probed in background.
+- optionally, it measures the bus reliability at the current speed and recommends the /boot/config.txt speed.
+- optionally, it broadcasts the dataframes to all the devices at once (general call), collecting the acks afterwards.
+- optionally, it negotiates the protocol (fields, framing, delta, fec, credits) with the Responders, after reading their capabilities.
+- optionally, it records the bus traffic to a binary log (bus_log), to be replayed later.
 - it sends a predefined number of dataframes and stops.
 
+Notes:
+- the dataframe handling is done by the i2c_controller library, at the pi_pico folder
+  (copy it next to this script when not running it from the repository).
+
 
 
 MIT License
@@ -39,123 +50,83 @@ SOFTWARE.
 """
 
 
-from smbus2 import SMBus
-import time, random, subprocess
+
+import os, sys
+# library modules from the repository folder (src/pi_pico), when not installed via pip install .
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pi_pico'))
+
+from i2c_controller import I2CController, SMBusTransport
+import time, random
 
 # variable to manually set
 df_fields = 2                  # number of 16-bit fields in dataframe, max 4
 runs = 200                     # limits the test to a number of runs
 timeout_mins = 3               # timeout in minutes
-
-
-def scan_i2c_devices():
-    """Scans the I2C bus via the bash command 'i2cdetect -y -1' """
-    try:
-        result = subprocess.run(["i2cdetect", "-y", "1"], capture_output=True, text=True, check=True)
-        output_lines = result.stdout.splitlines()  # split output into lines
-
-        detected_devices = []
-
-        for line in output_lines[1:]:         # skip the header line
-            parts = line.split()              # split line into columns
-            if not parts:
-                continue
-
-            row_prefix = parts[0].strip(":")  # remove colon from row descriptor
-
-            for col_index, value in enumerate(parts[1:]):  # skip row label
-                if value != "--":
-                    # convert row/column index to I2C address
-                    detected_devices.append(int(row_prefix, 16) + col_index)
-
-        devices = {}
-        device_labels = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
-        print()
-        for i, addr in enumerate(detected_devices):
-            devices[device_labels[i]] = addr
-            print(f"Device found {device_labels[i]}:", hex(addr))
-        print()
-        return devices
-
-    except subprocess.CalledProcessError as e:
-        print("Error running i2cdetect:", e)
-        return {}
-
-
-def calculate_checksum(dataframe):
-    return sum(dataframe) & 0xFF
-
-
-def escape_data(dataframe):
-    escaped_data = []
-    for byte in dataframe:
-        if byte in [0x02, 0x03, 0x5C]:  # STX, ETX, and backslash
-            escaped_data.append(0x5C)   # escape character
-        escaped_data.append(byte)
-    return escaped_data
-
-
-def send_data(dataframe, dev, adr):
-    data_frame = [stx]                                       # data_frame list with the STX
-    for value in dataframe:                                  # iterating over the values in data
-        field_bytes = value.to_bytes(2, byteorder='big')     # convert value to bytes
-        data_frame.extend(field_bytes)                       # bytes of value are added to the data_frame
-
-    checksum = calculate_checksum(data_frame)                # calculate checksum (including STX, excluding ETX)
-    data_frame.append(checksum)                              # append checksum and ETX to the data frame
-    escaped_data_frame = escape_data(data_frame)[1:] + [etx] # add escapes characters
-
-    try:
-        bus.write_i2c_block_data(adr, 0, escaped_data_frame) # send data frame over I2C)
-    except TimeoutError as e:
-        print(f"I2C Timeout Error on device {dev}: {e}")
-    except Exception as e:
-        print(f"I2C Error on device {dev}: {e}")
-        escaped_data_frame = []
-
-    return escaped_data_frame
-
-
-
-def read_data(dev, adr):
-    try:
-        return bus.read_byte(adr)
-    except TimeoutError as e:
-        print(f"I2C Timeout Error on device {dev}: {e}")
-    except Exception as e:
-        print(f"I2C Error on device {dev}: {e}") 
-    return None 
-
-
-def stop_code():
-    if bus:
-        try:
-            bus.close()            # close the I2C bus
-        except Exception as e:
-            print(f"Error closing I2C bus: {e}")
+use_sequence = False           # flag to add a sequence byte to the dataframes (set same value at the Responders)
+framing = 'escape'             # dataframe framing: 'escape' (STX/ETX) or 'cobs' (set same value at the Responders)
+use_delta = False              # flag to send only the fields changed since the last acknowledged dataframe (set delta at the Responders)
+use_fec = False                # flag to append the Reed-Solomon parity bytes, the Responders correcting a corrupted byte (set fec at the Responders)
+use_credits = False            # flag for the free dataframe slots in the status byte, pacing the writes (set credits at the Responders)
+negotiate = False              # flag to read the Responders capabilities, and configure them (fields, framing, delta, fec, credits) at runtime
+max_retries = 3                # re-sending attempts of a dataframe not correctly received
+backoff_base_s = 0.002         # wait time before the first retry, doubled at every further retry
+backoff_max_s = 0.1            # max wait time between retries
+breaker_threshold = 5          # consecutive failed dataframes before a device is skipped
+breaker_cooldown_s = 1.0       # time a device is skipped before being re-probed (doubled when re-probe fails)
+breaker_cooldown_max_s = 30.0  # max time a device is skipped
+reprobe_interval_s = 0.25      # period of the background re-probe of the skipped devices
+calibrate = False              # flag to measure the bus reliability, at the current speed, before the test
+calib_frames = 200             # dataframes per device sent by the bus measurement
+calib_max_error_rate = 0.01    # max error rate for the bus speed to be considered reliable
+bus_speeds = (100000, 400000, 1000000)  # bus speeds considered by the recommendation
+bus_log_path = None            # binary log recording the bus traffic (i.e. 'bus.log'), None to disable it
+use_broadcast = False          # flag to send each dataframe once to all devices via general call (set general_call at the Responders)
 
 
 
 # other variables
-stx = 0x02                         # STX (Start of Text)
-etx = 0x03                         # ETX (End of Text)
 ok_runs = 0                        # counter for positive dataframe transmissions
 errors = 0                         # counter for the errors occurrence
+busy_returns = 0                   # counter for the devices still busy after the status polls (not errors)
 stop_test = False                  # flag to stop the code after number or runs
+controller = None                  # I2C controller
     
 try:                               # tentative approach
-    bus = SMBus(1)                 # I2C bus is initialized
-    devices = scan_i2c_devices()   # scans for devices in I2C bus
+    transport = SMBusTransport(1)  # I2C bus is initialized
+    if bus_log_path:               # case the bus traffic has to be recorded
+        from bus_log import RecordingTransport
+        transport = RecordingTransport(transport, bus_log_path)  # every transaction is appended to the log
+    controller = I2CController(transport, fields=df_fields, sequence=use_sequence, max_retries=max_retries,
+                               backoff_base_s=backoff_base_s, backoff_max_s=backoff_max_s,
+                               breaker_threshold=breaker_threshold, breaker_cooldown_s=breaker_cooldown_s,
+                               breaker_cooldown_max_s=breaker_cooldown_max_s, printout=True, framing=framing, delta=use_delta,
+                               fec=use_fec, credits=use_credits)
+    print()
+    devices = controller.scan()    # scans for devices in I2C bus
+    print()
 
     # manually restricting devices
-#     devices = {'A': 0x41}
+#     controller.devices = {}
+#     controller.add_device('A', 0x41)
+#     controller.add_device('B', 0x42, framing='cobs')  # framing can differ per device
+
+    if negotiate:                  # case the Responders are configured by the Controller
+        controller.negotiate()     # fields and sequence as set here, fastest framing and delta supported by each device
 
-    number_of_devs = len(devices)  # number of devices
+    number_of_devs = len(controller.devices)  # number of devices
     if number_of_devs == 0:
         print("Quiting the code as no devices found in the I2C bus")
-        stop_code()
+        controller.stop()
         exit(0)
 
+    controller.start_reprobe(reprobe_interval_s)  # skipped devices are re-probed in background
+
+    if calibrate:                              # case the bus speed has to be measured
+        speed = transport.speed
+        recommended, results = controller.calibrate(bus_speeds, calib_frames, calib_max_error_rate)
+        if recommended != speed:
+            print(f"Recommended: dtparam=i2c_arm_baudrate={recommended} (set bus_speed={recommended} at the Responders)")
+
     print(f"Sending {runs} dataframes (of {df_fields} fields each) to the devices ...")
 
     timeout_s = 60 * timeout_mins              # timeout in seconds
@@ -170,29 +141,48 @@ try:                               # tentative approach
 
         device_reply = 0                       # device_reply is zeroed at every run
         print()
-        for device, address in devices.items():           # iterates over the devices in dict
-            print(f"Send data to device {device}: {data}")
-            data_sent = send_data(data, device, address)  # call the data sending function
-            device_return = read_data(device, address)    # devive is inquired to get (8bit) return
+        print(f"Send data to devices: {data}")
+        if use_broadcast:                      # case of broadcast dataframes
+            controller.broadcast(data)         # data is sent once, to all the devices
+            device_returns = controller.collect_acks()  # devices are inquired, data sent again to the ones that missed it
+        else:                                  # case of dataframes sent to each device
+            device_returns = controller.send(data) # data is sent, until received, to the devices not skipped
+        available_devs = len(device_returns)   # devices not skipped by the circuit breaker
+        for device, device_return in device_returns.items():
 
             if device_return == 1:             # case device returns 1 (all ok)
                 device_reply += 1              # device_reply counter is increased
             elif device_return == 0:           # case device returns 0 (checksum error)
                 errors += 1                    # errors counter is increase
-                print(device, "error")         # feedback is printed to terminal
+                print(device, "checksum error")  # feedback is printed to terminal
             elif device_return == 2:           # case device returns 2 (dataframe lenght error)
                 errors += 1                    # errors counter is increase
-                print(device, "checksum error")  # feedback is printed to terminal
+                print(device, "dataframe length error")  # feedback is printed to terminal
+            elif device_return == 3:           # case device returns 3 (busy: dataframe not decoded yet)
+                busy_returns += 1              # busy counter is increased (not an error)
+                print(device, "busy, dataframe not decoded yet")  # feedback is printed to terminal
             else:                              # other cases
-                val = device_return            # returned value is assigned to local variable (just as example)
+                errors += 1                    # errors counter is increase
+                print(device, "I2C error")     # feedback is printed to terminal
 
-        if device_reply == number_of_devs:     # case all devices replied positively
+        if available_devs == 0:                # case all devices are skipped
+            time.sleep(reprobe_interval_s)     # waits for the re-probe thread
+        elif device_reply == available_devs:   # case all the available devices replied positively
             ok_runs += 1                       # ok_runs counter is increased
 
         if ok_runs >= runs or errors >= runs:  # case one of the counters equals the runs value
             elapsed_time = round(time.time() - t_start, 3)
             print(f"\nTotal of {ok_runs} positive datasets sent in {elapsed_time} secs")
-            print(f"Total errors: {errors}\n")
+            print(f"Total errors: {errors}")
+            print(f"Busy returns: {busy_returns}\n")
+            for device, stats in controller.stats().items():
+                print(f"Device {device} stats: {stats}")
+            if use_sequence:                   # case of dataframes with sequence byte
+                for device in controller.devices:
+                    print(f"Device {device} counters: {controller.read_stats(device)}")
+            if negotiate:                      # case the Responders support the commands (protocol version 2)
+                for device in controller.devices:
+                    print(f"Device {device} Responder statistics: {controller.read_counters(device)}")
             stop_test = True
 
 
@@ -203,5 +193,5 @@ except Exception as e:
     print(f"\nAn errorsor occured: {e}")
 
 finally:
-    stop_code()
-
+    if controller:
+        controller.stop()
@@ -0,0 +1,389 @@
+"""
+Andrea Favero
+
+Allocation check of the Responder receive, decode and publish path (GC-pressure regression check).
+
+On the Pico (MicroPython):
+- I2CHandler.run() is fed by a simulated Responder (SimSource), serving pre-encoded dataframes byte by
+  byte, and issuing a read request (status byte) after each dataframe.
+- the garbage collector is disabled, and gc.mem_free() is sampled after a warm-up and at the last
+  dataframe: any drift means the steady state allocates (many allocations raise MemoryError earlier).
+- usage, with main.py not running: import alloc_check; alloc_check.run(100000)
+- the bus watchdog of the I2C block Responder (I2CResponder.check_bus, called in the core1 idle loop) is
+  checked the same way: import alloc_check; alloc_check.check_watchdog(100000)
+
+On a PC (Python):
+- I2CHandler.run() runs on the same dataframes, with stand-ins for the Pico only modules (shared_variables, led),
+  and the heap drift is measured via tracemalloc, for both framings (and with FEC): python3 alloc_check.py 100000
+- I2CResponder.check_bus runs on a fake mem32, failing at any register address computed at the call instead
+  of precomputed at init (the I2C base is above the MicroPython small int range: a long int per access).
+
+
+
+MIT License
+
+Copyright (c) 2025 Andrea Favero
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+
+from frame_codec import encode_frame, encode_delta_frame, OK, ESCAPE_FRAMING, COBS_FRAMING
+from array import array
+import gc, sys, time
+
+
+class _Flag:
+    """Halt flag for the PC check (the Pico uses shared_variables.halt)."""
+    def __init__(self):
+        self.value = 0
+    def read(self):
+        return self.value
+    def write(self, value):
+        self.value = value
+
+
+
+class SimSource:
+    """
+    Simulated Responder, with the methods used by I2CHandler.
+    It serves in a loop 256 pre-encoded dataframes (sequence 0 to 255, escape-heavy values), byte by byte,
+    with the escape or COBS framing, optionally as changed-fields dataframes (keyframe at sequence 0).
+    With fec, the dataframes carry the parity bytes, and one byte every 8 dataframes is corrupted (corrected).
+    After each dataframe a read request is pending, followed by a few idle polls (bus watchdog path).
+    mem_free() is sampled at the read request of the warm-up and of the last dataframe, then halt is set.
+    """
+    
+    IDLE_POLLS = 4                              # idle polls after each read
+    
+    def __init__(self, frames, fields=2, sequence=True, warmup=1000, mem_free=None, halt=None,
+                 framing=ESCAPE_FRAMING, delta=False, fec=False):
+        self.target = frames                    # dataframes to be served
+        self.warmup = min(warmup, frames)       # dataframes served before the first mem_free sample
+        self.mem_free = mem_free
+        self.halt = halt
+        
+        # pre-encoded stream, and the index following each dataframe (ETX or delimiter)
+        stream = bytearray()
+        ends = array('H')
+        special = (0x02, 0x03, 0x5C)
+        base = None
+        for seq in range(256):
+            values = [(special[(seq + i) % 3] << 8) | ((seq * 37 + i * 101) & 0xFF) for i in range(fields)]
+            start = len(stream)
+            if delta:
+                values[seq % fields] = base[seq % fields] if base else values[0]  # one field unchanged
+                encode_delta_frame(values, base, seq if sequence else None, stream, framing, fec)
+                base = values
+            else:
+                encode_frame(values, seq if sequence else None, stream, framing, fec)
+            if fec and seq % 8 == 7:            # case of dataframe with a corrupted byte
+                for i in range(start + 2, len(stream) - 1):
+                    if stream[i] not in special and stream[i] ^ 0x10 not in special and stream[i] and stream[i] != 0x10:
+                        stream[i] ^= 0x10       # a data byte, not becoming a framing byte
+                        break
+            ends.append(len(stream))
+        self.stream = stream
+        self.ends = ends
+        self.pos = 0                            # stream index of the next byte
+        self.frame_idx = 0                      # index of the dataframe being served
+        
+        self.frames = 0                         # dataframes served
+        self.statuses_ok = 0                    # status bytes equal to OK
+        self.read_request = False               # True after a dataframe, until the status is read
+        self.idle = 0                           # idle polls left
+        self.recoveries = 0                     # as for the Responders
+        self.free = array('l', (0, 0))          # mem_free() after the warm-up and at the last dataframe (slots)
+        self.sampled = 0                        # samples taken
+    
+    
+    def get_write_byte(self):
+        if self.read_request or self.idle:
+            if self.idle:
+                self.idle -= 1
+            return -1
+        pos = self.pos
+        byte = self.stream[pos]
+        pos += 1
+        if pos == self.ends[self.frame_idx]:    # case the dataframe has been served
+            self.frame_idx += 1
+            if self.frame_idx == 256:
+                self.frame_idx = 0
+                pos = 0
+            self.frames += 1
+            self.read_request = True
+        self.pos = pos
+        return byte
+    
+    def write_data_is_available(self):
+        return not (self.read_request or self.idle)
+    
+    def get_write_data(self, max_size=1):
+        byte = self.get_write_byte()
+        return [] if byte < 0 else [byte]
+    
+    def read_is_pending(self):
+        if self.read_request:
+            if self.frames == self.warmup and not self.sampled:
+                self.free[0] = self.mem_free()  # sampled before the warm-up reply, as the last one
+                self.sampled = 1
+            if self.frames == self.target:
+                self.free[1] = self.mem_free()  # sampled before the last reply
+                self.sampled = 2
+                self.halt.write(1)
+        return self.read_request
+    
+    def read_is_done(self):
+        return True                             # each read is a new transfer
+    
+    def put_read_data(self, data):
+        if data == OK:
+            self.statuses_ok += 1
+        self.read_request = False
+        self.idle = self.IDLE_POLLS
+    
+    def check_bus(self):
+        return False
+    
+    
+    def result(self):
+        drift = None if self.sampled < 2 else self.free[0] - self.free[1]
+        return {'frames': self.frames, 'ok': self.statuses_ok, 'drift_bytes': drift}
+
+
+
+def run(frames=100000, fields=2, sequence=True, warmup=1000, framing=ESCAPE_FRAMING, delta=False, fec=False):
+    """Pico check: runs I2CHandler.run() on SimSource, with the garbage collector disabled."""
+    from shared_variables import shared_variables
+    from i2c_handler import I2CHandler
+    
+    halt = shared_variables.halt
+    source = SimSource(frames, fields, sequence, warmup, gc.mem_free, halt, framing, delta, fec)
+    handler = I2CHandler(rp=shared_variables.rp, fields=fields, sequence=sequence, framing=framing, delta=delta,
+                         fec=fec, responder=source)
+    halt.write(0)
+    gc.collect()
+    gc.disable()
+    t_start = time.ticks_ms()
+    try:
+        handler.run()
+    except MemoryError:
+        print("MemoryError after", source.frames, "dataframes: the path allocates")
+    finally:
+        gc.enable()
+        halt.write(0)
+    elapsed_ms = time.ticks_diff(time.ticks_ms(), t_start)
+    result = source.result()
+    result['elapsed_ms'] = elapsed_ms
+    print("Allocation check:", result)
+    assert result['drift_bytes'] == 0, result
+    assert result['ok'] >= frames - 1, result   # the last status is not read
+    return result
+
+
+
+class _Mem32:
+    """
+    Fake machine.mem32 for the PC check: once the precomputed addresses are set (allowed), an access to any
+    other address object fails, as the address has been computed at the call (a long int on the Pico).
+    """
+    def __init__(self):
+        self.regs = {}
+        self.allowed = None
+    def _check(self, adr):
+        if self.allowed is not None and not any(adr is allowed for allowed in self.allowed):
+            raise AssertionError(f"register address {hex(adr)} computed at the call")
+    def __getitem__(self, adr):
+        self._check(adr)
+        return self.regs.get(adr, 0)
+    def __setitem__(self, adr, value):
+        self._check(adr)
+        self.regs[adr] = value
+
+
+
+def check_watchdog(calls=100000, printout=True):
+    """
+    Bus watchdog check of the I2C block Responder: check_bus() is called with the START, STOP and general call
+    flags raised in turn, plus an Rx FIFO overflow (recover) at every 1000 calls.
+    On the Pico the heap drift is measured (the I2C block is re-initialized: main.py not running), on a PC the
+    register addresses are checked against the precomputed ones (fake mem32).
+    """
+    micropython = sys.implementation.name == 'micropython'
+    if micropython:
+        from machine import mem32
+    else:
+        import types
+        mem32 = _Mem32()
+        machine = types.ModuleType('machine')
+        machine.mem32 = mem32
+        machine.Pin = type('Pin', (), {'IN': 0, 'PULL_UP': 1, '__init__': lambda self, *args: None,
+                                       'value': lambda self: 1})
+        machine.freq = lambda: 125000000
+        sys.modules['machine'] = machine
+        if not hasattr(time, 'ticks_ms'):
+            time.ticks_ms = lambda: int(time.monotonic() * 1000)
+            time.ticks_diff = lambda new, old: new - old
+    from i2c_responder import I2CResponder
+    
+    responder = I2CResponder()
+    raw_adr = responder.raw_intr_stat_adr
+    flags = (responder.IC_RAW_INTR_STAT__START_DET, responder.IC_RAW_INTR_STAT__STOP_DET,
+             responder.IC_RAW_INTR_STAT__GEN_CALL | responder.IC_RAW_INTR_STAT__STOP_DET, 0)
+    if not micropython:
+        mem32.allowed = [value for name, value in responder.__dict__.items() if name.endswith('_adr')]
+    free_start = free_end = 0
+    recoveries = 0
+    gc.collect()
+    gc.disable()
+    try:
+        for i in range(calls):
+            if i == 1000:                   # warm-up done
+                free_start = gc.mem_free() if micropython else 0
+            if not micropython:
+                mem32.regs[raw_adr] = flags[i & 3] | (responder.IC_RAW_INTR_STAT__RX_OVER if i % 1000 == 999 else 0)
+            if responder.check_bus():
+                recoveries += 1
+        if micropython:
+            free_end = gc.mem_free()
+    finally:
+        gc.enable()
+    result = {'calls': calls, 'recoveries': recoveries, 'general_calls': responder.general_calls,
+              'drift_bytes': free_start - free_end}
+    if printout:
+        print("Allocation check (bus watchdog):", result)
+    assert result['drift_bytes'] == 0, result
+    return result
+
+
+
+class _SeqLock:
+    """fields_lock stand-in for the PC check: the slots are written in turn (SeqLock.write without the counter)."""
+    def write(self, slots, values, count=None):
+        for i in range(len(slots) if count is None else count):
+            slots[i].write(values[i])
+
+
+
+class _SharedVariables:
+    """shared_variables stand-in for the PC check: the slots are _Flag objects instead of the SRAM arena."""
+    def __init__(self):
+        self.rp = 'RP2040'
+        self.I2C0_SDA_PIN = 0
+        self.I2C0_SCL_PIN = 1
+        self.halt = _Flag()
+        self.df_fields = _Flag()
+        self.mode = _Flag()
+        self.duplicates = _Flag()
+        self.gaps = _Flag()
+        self.reorders = _Flag()
+        self.recoveries = _Flag()
+        self.fields = [_Flag() for _ in range(4)]
+        self.fields_lock = _SeqLock()
+        self.bulk = (0, b'')
+    def write_bulk(self, stream, payload):
+        self.bulk = (stream, bytes(payload))
+
+
+
+class _Led:
+    """led stand-in for the PC check."""
+    def fast_flash_blue(self, ticks=10):
+        pass
+    def fast_flash_red(self, ticks=20):
+        pass
+
+
+
+def _host_modules():
+    """
+    PC check: the Pico only modules imported by I2CHandler (shared_variables, led) are replaced by stand-ins,
+    and the MicroPython time functions are added. Returns the shared_variables stand-in.
+    """
+    import types
+    module = sys.modules.get('shared_variables')
+    if module is None or not isinstance(module.shared_variables, _SharedVariables):
+        module = types.ModuleType('shared_variables')
+        module.shared_variables = _SharedVariables()
+        sys.modules['shared_variables'] = module
+        led = types.ModuleType('led')
+        led.led = _Led()
+        sys.modules['led'] = led
+    if not hasattr(time, 'ticks_us'):
+        time.ticks_ms = lambda: int(time.monotonic() * 1000)
+        time.ticks_us = lambda: int(time.monotonic() * 1000000)
+        time.ticks_diff = lambda new, old: new - old
+    return module.shared_variables
+
+
+
+def check_handler(frames=100000, fields=2, sequence=True, warmup=4000, printout=True, framing=ESCAPE_FRAMING,
+                  delta=False, fec=False):
+    """
+    PC check: I2CHandler.run() on SimSource, as run() on the Pico, with stand-ins for shared_variables and led
+    (decoder, reply page, debug log, fields update and core0 notifications included). The heap is measured by
+    tracemalloc: the warm-up takes the counters past 256, as the larger ints are heap objects on CPython (not on
+    MicroPython, up to 2**30), and it ends at the same dataframe of the stream as the last one (same live ints).
+    """
+    import tracemalloc
+    shared = _host_modules()
+    from i2c_handler import I2CHandler
+    from core_fifo import SimFifo
+    
+    halt = shared.halt
+    warmup = frames - max((frames - warmup) // 256, 1) * 256   # same dataframe (stream position) as the last one
+    source = SimSource(frames, fields, sequence, warmup, lambda: -tracemalloc.get_traced_memory()[0], halt,
+                       framing, delta, fec)
+    handler = I2CHandler(fields=fields, sequence=sequence, framing=framing, delta=delta, fec=fec, responder=source)
+    handler.fifo = SimFifo()                # descriptors are pushed (dropped once full, as core0 doesn't pop them)
+    halt.write(0)
+    tracemalloc.start()
+    try:
+        handler.run()
+    finally:
+        tracemalloc.stop()
+        halt.write(0)
+    
+    tracker = handler.seq_tracker
+    result = source.result()
+    result['applied'] = handler.frames
+    result['duplicates'] = tracker.duplicates
+    result['gaps'] = tracker.gaps
+    result['reorders'] = tracker.reorders
+    result['corrections'] = handler.corrections
+    if printout:
+        print(f"Allocation check (handler, {framing}{', delta' if delta else ''}{', fec' if fec else ''}):", result)
+    assert result['drift_bytes'] == 0, result
+    assert result['ok'] >= frames - 1 and handler.frames == frames, result   # the last status is not read
+    assert tracker.duplicates == tracker.gaps == tracker.reorders == 0, result
+    assert [slot.read() for slot in shared.fields[:fields]] == handler.data, result
+    return result
+
+
+if __name__ == '__main__':
+    if sys.implementation.name == 'micropython':
+        run()
+        check_watchdog()
+    else:
+        check_watchdog(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
+        for framing in (ESCAPE_FRAMING, COBS_FRAMING):
+            for delta in (False, True):
+                check_handler(int(sys.argv[1]) if len(sys.argv) > 1 else 100000, framing=framing, delta=delta)
+            check_handler(int(sys.argv[1]) if len(sys.argv) > 1 else 100000, framing=framing, fec=True)
@@ -0,0 +1,157 @@
+"""
+Andrea Favero
+
+Micropython Class for Raspberry Pi Pico (RP2040 and RP2350).
+Frame-ready notifications from core1 to core0, via the SIO inter-core FIFO.
+
+This Class:
+- core1 pushes a 32bits descriptor into the hardware FIFO after each validated dataframe.
+- the descriptor holds the event type, number of fields, sequence byte and a frame counter.
+- the push never blocks core1: when the FIFO is full, the descriptor is dropped (counted), as the
+  fields are anyway available at the shared variables.
+- core0 pops the descriptors, or waits for one (with timeout), reacting within microseconds.
+- SimFifo is a drop-in replacement for the host (simulator, tests), with the same methods.
+
+Notes:
+- the SIO block is at the same address on RP2040 and RP2350; each core reads its own RX FIFO and
+  writes into the RX FIFO of the other core, at the same register addresses.
+- FIFO depth is 8 words on RP2040, 4 words on RP2350.
+- MicroPython doesn't expose the SIO FIFO interrupt, therefore core0 waits by polling the FIFO status.
+- the FIFO from core0 to core1 isn't used: MicroPython relies on it to pause core1 during flash writes.
+
+
+
+MIT License
+
+Copyright (c) 2025 Andrea Favero
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+
+try:
+    from machine import mem32
+except ImportError:                             # case of host side (only SimFifo can be used)
+    mem32 = None
+import time
+
+SIO_BASE = 0xD0000000
+FIFO_ST = 0x50                                  # FIFO status register
+FIFO_WR = 0x54                                  # write to the other core RX FIFO
+FIFO_RD = 0x58                                  # read from this core RX FIFO
+FIFO_ST__VLD = 0x01                             # RX FIFO not empty
+FIFO_ST__RDY = 0x02                             # TX FIFO not full
+FIFO_ST__WOF = 0x04                             # TX FIFO written while full (sticky, write to clear)
+FIFO_ST__ROE = 0x08                             # RX FIFO read while empty (sticky, write to clear)
+
+FIFO_DEPTH = {'RP2040': 8, 'RP2350': 4}
+
+EV_FRAME = 1                                    # descriptor of a validated dataframe
+EV_BULK = 2                                     # descriptor of a bulk command: fields = bytes, seq = stream
+
+
+
+def make_descriptor(event, fields, seq, count):
+    """Returns the 30bits descriptor: event (6 bits), fields, sequence and counter (8 bits each)."""
+    return ((event & 0x3F) << 24) | ((fields & 0xFF) << 16) | ((seq & 0xFF) << 8) | (count & 0xFF)
+
+
+def parse_descriptor(descriptor):
+    """Returns the (event, fields, seq, count) tuple of a descriptor."""
+    return (descriptor >> 24) & 0x3F, (descriptor >> 16) & 0xFF, (descriptor >> 8) & 0xFF, descriptor & 0xFF
+
+
+
+class CoreFifo:
+    
+    def __init__(self):
+        self.st = SIO_BASE + FIFO_ST            # FIFO status address
+        self.wr = SIO_BASE + FIFO_WR            # FIFO write address
+        self.rd = SIO_BASE + FIFO_RD            # FIFO read address
+        self.dropped = 0                        # descriptors dropped as the FIFO was full (core1 side)
+    
+    
+    def drain(self):
+        """Empties this core RX FIFO and clears the sticky error flags. Returns the discarded words."""
+        n = 0
+        while mem32[self.st] & FIFO_ST__VLD:
+            mem32[self.rd]
+            n += 1
+        mem32[self.st] = 0                      # any write clears WOF and ROE
+        return n
+    
+    
+    def push(self, descriptor):
+        """Pushes a descriptor to the other core, without blocking. Returns False when dropped."""
+        if mem32[self.st] & FIFO_ST__RDY:       # case the FIFO has room
+            mem32[self.wr] = descriptor
+            return True
+        self.dropped += 1                       # descriptor is dropped, core1 doesn't wait
+        return False
+    
+    
+    def pop(self):
+        """Returns the next descriptor from the other core, None when the FIFO is empty."""
+        if mem32[self.st] & FIFO_ST__VLD:
+            return mem32[self.rd] & 0x3FFFFFFF
+        return None
+    
+    
+    def wait(self, timeout_ms=100):
+        """Waits for the next descriptor, up to timeout_ms. Returns the descriptor, or None at timeout."""
+        st = self.st
+        t_ref = time.ticks_ms()
+        while not mem32[st] & FIFO_ST__VLD:
+            if time.ticks_diff(time.ticks_ms(), t_ref) >= timeout_ms:
+                return None
+        return mem32[self.rd] & 0x3FFFFFFF
+
+
+
+class SimFifo:
+    """In-memory FIFO with the CoreFifo methods, for the host side."""
+    
+    def __init__(self, depth=8):
+        self.depth = depth
+        self.words = []
+        self.dropped = 0
+    
+    def drain(self):
+        n = len(self.words)
+        self.words = []
+        return n
+    
+    def push(self, descriptor):
+        if len(self.words) < self.depth:
+            self.words.append(descriptor)
+            return True
+        self.dropped += 1
+        return False
+    
+    def pop(self):
+        return self.words.pop(0) if self.words else None
+    
+    def wait(self, timeout_ms=100):
+        t_ref = time.time()
+        while not self.words:
+            if (time.time() - t_ref) * 1000 >= timeout_ms:
+                return None
+            time.sleep(0)
+        return self.words.pop(0)
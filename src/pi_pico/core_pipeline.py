@@ -0,0 +1,278 @@
+"""
+Andrea Favero
+
+Micropython Class for Raspberry Pi Pico (RP2040 and RP2350).
+Two stages Responder pipeline: core1 drains the I2C into a ring, core0 decodes and validates.
+
+This Class:
+- core1 runs drain(): it only moves the received bytes from the Rx FIFO (or DMA ring) into a single
+  producer single consumer ring, and pushes a read request entry when the Controller reads.
+- the read request waits (clock stretched) for core0 to return the reply byte via a mailbox, tagged with
+  the token of the request; without reply within reply_timeout_us, 3 (busy) is returned (counted): the Controller
+  reads the status again, instead of sending the dataframe again.
+- the bus watchdog (and the DMA re-arming) runs on core1 while idle: a recovery entry tells core0 to reset the decoder.
+- core0 runs I2CHandler.run() on this object, offering the Responder methods (get_write_byte, read_is_pending,
+  read_is_done, put_read_data, check_bus): the decode, validate and publish path is the same as on core1.
+- check_bus() calls the optional idle hook on core0 (i.e. the debug log flush), when the ring is empty.
+- LocalFifo replaces CoreFifo on core0: the frame descriptors are handed to a callback.
+
+Notes:
+- ring entries are 16 bits: received byte (< 0x100), or event flags with a 5 bits token (read requests).
+- the producer only moves the head index, the consumer only moves the tail index (as debug_log).
+- when the ring is full core1 waits for core0 (counted), as a received byte can't be dropped.
+- each reply byte is a round trip between the cores: multi-byte reads take longer than on core1 only.
+- printing from the idle hook delays the replies: keep printout off when the Controller timing matters.
+- on a PC, python3 core_pipeline.py 2000 runs the pipeline with two threads on simulated dataframes
+  (slow on a single CPU, as the two spinning threads share it).
+
+
+
+MIT License
+
+Copyright (c) 2025 Andrea Favero
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+
+
+from array import array
+import time
+
+# time functions, with the CPython fallbacks for the MicroPython ones
+try:
+    ticks_us, ticks_diff = time.ticks_us, time.ticks_diff
+except AttributeError:
+    def ticks_us():
+        return int(time.monotonic() * 1000000)
+    def ticks_diff(new, old):
+        return new - old
+
+# ring entries, other than the received bytes
+RD_REQ = 0x100                  # read request: a reply byte is expected
+RD_NEW = 0x200                  # read request flag: first byte of a new read transfer
+RECOVERY = 0x400                # the I2C block (or PIO) has been re-initialized by core1
+TOKEN_SHIFT = 11                # read request token, in the upper 5 bits
+TOKEN_MASK = 0x1F
+BUSY = 3                        # reply when core0 doesn't answer in time (as frame_codec.BUSY)
+
+
+
+class CorePipeline:
+    
+    WATCHDOG_LOOPS = 256                            # idle loops in between two bus watchdog checks (core1)
+    
+    def __init__(self, responder, rx=None, rx_dma=None, size=256, reply_timeout_us=5000, idle=None):
+        if size & (size - 1):
+            raise ValueError("The ring size must be a power of 2")
+        self.responder = responder                  # I2C block or PIO Responder (core1 only)
+        self.rx = responder if rx is None else rx   # source of the received bytes: Rx FIFO or DMA ring (core1 only)
+        self.rx_dma = rx_dma                        # DMA capture, re-armed by core1 while idle (None when not used)
+        self.ring = array('H', bytes(2 * size))     # preallocated ring of 16 bits entries
+        self.mask = size - 1                        # index mask (size is a power of 2)
+        self.rx_buffer_size = size                  # received bytes held by the ring (capabilities)
+        self.head = 0                               # next entry to be written (moved by core1 only)
+        self.tail = 0                               # next entry to be read (moved by core0 only)
+        self.reply = -1                             # mailbox: (token << 8) | reply byte, written by core0
+        self.reply_timeout_us = reply_timeout_us    # max time core1 waits for a reply byte
+        self.idle = idle                            # optional hook called by core0 while idle (i.e. debug log flush)
+        self.recoveries = getattr(responder, 'recoveries', 0)  # bus recoveries counter (mirrored by core1)
+        self.full_waits = 0                         # times core1 waited for room in the ring
+        self.timeouts = 0                           # reply bytes not returned by core0 in time
+        self.pending = 0                            # read request being served by core0, 0 when none
+        self.recovered = False                      # True when core0 has to reset the decoder
+    
+    
+    # core1 side ---------------------------------------------------------------------------------------------
+    
+    def _push(self, entry):
+        """Writes an entry to the ring (core1), waiting for core0 when the ring is full."""
+        head = self.head
+        nxt = (head + 1) & self.mask
+        if nxt == self.tail:                        # case the ring is full
+            self.full_waits += 1
+            while nxt == self.tail:                 # core0 frees one entry at the time
+                pass
+        self.ring[head] = entry
+        self.head = nxt                             # entry is published after being written
+    
+    
+    def drain(self, halt):
+        """
+        Core1 loop: moves the received bytes into the ring, and serves the read requests with the reply
+        bytes of core0. While idle, the DMA channel is re-armed and the bus watchdog is called.
+        The loop ends when halt.read() returns a value other than 0 (i.e. shared_variables.halt).
+        """
+        responder = self.responder                  # local variables from instance variables
+        rx = self.rx
+        rx_dma = self.rx_dma
+        push = self._push
+        timeout_us = self.reply_timeout_us
+        token = 0                                   # token of the last read request
+        idle_loops = 0                              # loops without data arrival or request
+        while not halt.read():
+            byte = rx.get_write_byte()              # received byte, -1 when none
+            if byte >= 0:                           # case of received byte
+                push(byte)                          # byte is handed to core0
+            elif responder.read_is_pending():       # case the Controller reads (clock is stretched)
+                token = (token + 1) & TOKEN_MASK    # token of this request
+                entry = RD_REQ | (token << TOKEN_SHIFT)
+                if responder.read_is_done():        # case of a new read transfer
+                    entry |= RD_NEW
+                push(entry)                         # read request is handed to core0
+                t_ref = ticks_us()
+                reply = self.reply
+                while reply >> 8 != token:          # waits for the reply byte of this request
+                    if ticks_diff(ticks_us(), t_ref) > timeout_us:
+                        self.timeouts += 1          # core0 didn't reply in time
+                        reply = BUSY
+                        break
+                    reply = self.reply
+                responder.put_read_data(reply & 0xFF)
+            else:                                   # case the bus is idle
+                idle_loops += 1
+                if idle_loops >= self.WATCHDOG_LOOPS:
+                    idle_loops = 0
+                    if rx_dma is not None:          # case of DMA capture
+                        rx_dma.check()              # DMA channel is re-armed, when needed
+                    if responder.check_bus():       # case the I2C block (or PIO) has been re-initialized
+                        if rx_dma is not None:
+                            rx_dma.flush()          # bytes in the ring belong to the interrupted transfer
+                        self.recoveries = responder.recoveries
+                        push(RECOVERY)              # core0 resets the decoder
+    
+    
+    # core0 side: Responder methods used by I2CHandler.run() ---------------------------------------------
+    
+    def get_write_byte(self):
+        """Returns the next received byte, -1 when none (a read request or a recovery entry stops the bytes)."""
+        if self.pending:                            # case of read request not served yet
+            return -1
+        tail = self.tail
+        if tail == self.head:                       # case the ring is empty
+            return -1
+        entry = self.ring[tail]
+        self.tail = (tail + 1) & self.mask          # entry slot is released to core1
+        if entry < RD_REQ:                          # case of received byte
+            return entry
+        if entry & RECOVERY:                        # case of bus recovery
+            self.recovered = True
+        else:                                       # case of read request
+            self.pending = entry
+        return -1
+    
+    
+    def write_data_is_available(self):
+        return not self.pending and self.tail != self.head
+    
+    
+    def rx_free(self):
+        """Returns the free entries of the ring (credits reported to the Controller)."""
+        return self.mask - ((self.head - self.tail) & self.mask)
+    
+    
+    def read_is_pending(self):
+        return self.pending != 0
+    
+    
+    def read_is_done(self):
+        """Returns True when the pending read request is the first byte of a new read transfer."""
+        return self.pending & RD_NEW != 0
+    
+    
+    def put_read_data(self, data):
+        """Returns the reply byte to core1, tagged with the token of the pending read request."""
+        self.reply = (((self.pending >> TOKEN_SHIFT) & TOKEN_MASK) << 8) | (data & 0xFF)
+        self.pending = 0
+    
+    
+    def check_bus(self):
+        """Returns True once after a bus recovery at core1 (the decoder has to be reset), calling the idle hook."""
+        if self.idle is not None and self.tail == self.head:
+            self.idle()
+        if self.recovered:
+            self.recovered = False
+            return True
+        return False
+    
+    
+    def summary(self):
+        return {'fill': (self.head - self.tail) & self.mask, 'full_waits': self.full_waits,
+                'timeouts': self.timeouts, 'recoveries': self.recoveries}
+
+
+
+class LocalFifo:
+    """Replaces CoreFifo when the dataframes are published by core0: descriptors are handed to a callback."""
+    
+    def __init__(self, callback):
+        self.callback = callback
+        self.dropped = 0
+    
+    def push(self, descriptor):
+        self.callback(descriptor)
+        return True
+
+
+
+def simulate(frames=2000, fields=2, sequence=True):
+    """
+    PC check: core1 (drain) and core0 (decoder) run as two threads on simulated dataframes (alloc_check.SimSource).
+    Returns the counters; every dataframe status has to reach the simulated Responder as 1.
+    """
+    import _thread
+    from alloc_check import SimSource, _Flag
+    from frame_codec import make_decoder, INCOMPLETE
+    
+    halt = _Flag()
+    source = SimSource(frames, fields, sequence, 1, lambda: 0, halt)
+    pipeline = CorePipeline(source, reply_timeout_us=200000)
+    done = _thread.allocate_lock()
+    done.acquire()
+    def core1():
+        pipeline.drain(halt)
+        done.release()
+    _thread.start_new_thread(core1, ())
+    
+    decoder = make_decoder((1 if sequence else 0) + 2 * fields)
+    status = INCOMPLETE
+    t_start = time.time()
+    while not halt.read():                          # core0: decoder
+        byte = pipeline.get_write_byte()
+        if byte >= 0:
+            result = decoder.feed(byte)
+            status = INCOMPLETE if result is None else result
+        elif pipeline.read_is_pending():
+            pipeline.put_read_data(status)
+    done.acquire()
+    result = source.result()
+    result.update(pipeline.summary())
+    result['elapsed_s'] = round(time.time() - t_start, 3)
+    del result['drift_bytes']
+    print("Core pipeline:", result)
+    assert result['ok'] >= frames - 1, result       # the last status is not read
+    assert result['timeouts'] <= 1, result          # the last read request is not served (core0 stopped)
+    return result
+
+
+
+if __name__ == '__main__':
+    import sys
+    simulate(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
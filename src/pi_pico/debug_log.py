@@ -0,0 +1,180 @@
+"""
+Andrea Favero
+
+Micropython Class for Raspberry Pi Pico (RP2040 and RP2350).
+Deferred debug log: core1 stores fixed size binary records, core0 formats and prints (or saves) them.
+
+This Class:
+- preallocates a ring of fixed size records (16 bytes), when imported.
+- log() is called by core1 in the I2C loop: it only writes a few bytes, without prints nor heap allocation.
+- each record has ticks_us, event id, one 8bits argument and up to five 16bits arguments.
+- flush() is called by core0: records are formatted and printed to the Shell (USB), or appended to a file.
+- when the ring is full, new records are dropped (counted), so that core1 never waits for core0.
+
+Notes:
+- single producer (core1) and single consumer (core0): the producer only moves the head index,
+  the consumer only moves the tail index; the record is written before moving the head.
+- writing to the flash pauses core1 for a while: prefer the Shell when timing matters.
+- the log() method should be assigned to a local variable in the hot loop (no bound method allocation).
+
+
+
+MIT License
+
+Copyright (c) 2025 Andrea Favero
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+
+import time
+
+# event ids, with the related text printed by flush()
+EV_DATA = 1                     # dataframe applied: a = fields, args = field values
+EV_CHECKSUM_ERROR = 2           # dataframe with wrong checksum
+EV_INCOMPLETE = 3               # dataframe with wrong length: a = received bytes
+EV_DROPPED_SEQ = 4              # duplicated or late dataframe: a = sequence
+EV_NO_DATA = 5                  # status requested before a complete dataframe
+EV_RECOVERY = 6                 # I2C block re-initialized: b = recoveries counter
+EV_BOOT = 7                     # first received byte: b = Responder ready, c = first byte (ms since reset)
+EV_CONFIG = 8                   # protocol configuration command: a = status, b = fields, c = mode bits
+EV_COMMAND = 9                  # other command: a = status, b = opcode
+EV_FEC = 10                     # corrupted byte corrected by the Reed-Solomon parity: a = byte index
+
+EVENTS = {
+    EV_DATA: "Received data:",
+    EV_CHECKSUM_ERROR: "Checksum error",
+    EV_INCOMPLETE: "Incomplete message, bytes:",
+    EV_DROPPED_SEQ: "Dropped sequence:",
+    EV_NO_DATA: "Uncomplete data",
+    EV_RECOVERY: "I2C bus recovery:",
+    EV_BOOT: "Boot (ms since reset), Responder ready and first byte ACKed:",
+    EV_CONFIG: "Protocol configuration (status, fields, mode):",
+    EV_COMMAND: "Command (status, opcode):",
+    EV_FEC: "Corrected byte (FEC), index:",
+}
+
+
+class DebugLog:
+    
+    RECORD_SIZE = 16            # bytes per record: ticks (4), event (1), a (1), five 16bits args (10)
+    
+    def __init__(self, records=256):
+        self.records = records                          # ring capacity, in records
+        self.ring = bytearray(records * self.RECORD_SIZE)  # preallocated ring
+        self.head = 0                                   # next record to be written (moved by core1 only)
+        self.tail = 0                                   # next record to be read (moved by core0 only)
+        self.dropped = 0                                # records dropped as the ring was full (core1 only)
+        self.reported = 0                               # dropped records already reported (core0 only)
+    
+    
+    def log(self, event, a=0, b=0, c=0, d=0, e=0, f=0):
+        """Stores a record (core1): event id, one 8bits and up to five 16bits arguments."""
+        head = self.head
+        nxt = head + 1
+        if nxt == self.records:
+            nxt = 0
+        if nxt == self.tail:                            # case the ring is full
+            self.dropped += 1                           # record is dropped, core1 doesn't wait
+            return
+        ring = self.ring
+        i = head * 16                                   # RECORD_SIZE, as literal for speed
+        ticks = time.ticks_us()
+        ring[i] = ticks & 0xFF
+        ring[i + 1] = (ticks >> 8) & 0xFF
+        ring[i + 2] = (ticks >> 16) & 0xFF
+        ring[i + 3] = (ticks >> 24) & 0xFF
+        ring[i + 4] = event
+        ring[i + 5] = a & 0xFF
+        ring[i + 6] = b & 0xFF
+        ring[i + 7] = (b >> 8) & 0xFF
+        ring[i + 8] = c & 0xFF
+        ring[i + 9] = (c >> 8) & 0xFF
+        ring[i + 10] = d & 0xFF
+        ring[i + 11] = (d >> 8) & 0xFF
+        ring[i + 12] = e & 0xFF
+        ring[i + 13] = (e >> 8) & 0xFF
+        ring[i + 14] = f & 0xFF
+        ring[i + 15] = (f >> 8) & 0xFF
+        self.head = nxt                                 # record is published after being written
+    
+    
+    def pending(self):
+        """Returns the number of records not flushed yet."""
+        return (self.head - self.tail) % self.records
+    
+    
+    def _format(self, i):
+        """Returns the text of the record at index i of the ring."""
+        ring = self.ring
+        ticks = ring[i] | (ring[i + 1] << 8) | (ring[i + 2] << 16) | (ring[i + 3] << 24)
+        event, a = ring[i + 4], ring[i + 5]
+        args = [ring[j] | (ring[j + 1] << 8) for j in range(i + 6, i + 16, 2)]
+        text = EVENTS.get(event, "Event {}:".format(event))
+        if event == EV_DATA:
+            text = "{} {}".format(text, args[:a])
+        elif event in (EV_INCOMPLETE, EV_DROPPED_SEQ, EV_FEC):
+            text = "{} {}".format(text, a)
+        elif event == EV_RECOVERY:
+            text = "{} {}".format(text, args[0])
+        elif event == EV_BOOT:
+            text = "{} {} {}".format(text, args[0], args[1])
+        elif event == EV_CONFIG:
+            text = "{} {} {} {}".format(text, a, args[0], args[1])
+        elif event == EV_COMMAND:
+            text = "{} {} {}".format(text, a, hex(args[0]))
+        elif event not in EVENTS:
+            text = "{} {} {}".format(text, a, args)
+        return "[{:>12.3f} ms] {}".format(ticks / 1000, text)
+    
+    
+    def flush(self, path=None, max_records=64):
+        """
+        Formats the pending records (core0), printing them or appending them to the file at path.
+        At most max_records are handled per call, keeping core0 responsive.
+        Returns the number of handled records.
+        """
+        lines = []
+        tail = self.tail
+        head = self.head
+        while tail != head and len(lines) < max_records:
+            lines.append(self._format(tail * 16))
+            tail += 1
+            if tail == self.records:
+                tail = 0
+            self.tail = tail                            # record slot is released to core1
+        dropped = self.dropped
+        if dropped != self.reported:
+            lines.append("[debug_log] {} records dropped".format(dropped - self.reported))
+            self.reported = dropped
+        if not lines:
+            return 0
+        if path is None:
+            for line in lines:
+                print(line)
+        else:
+            with open(path, 'a') as f:
+                for line in lines:
+                    f.write(line + '\n')
+        return len(lines)
+
+
+
+debug_log = DebugLog()
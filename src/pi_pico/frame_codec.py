@@ -0,0 +1,806 @@
+"""
+Andrea Favero
+
+Python / Micropython module with the dataframe codec, shared by the Controller and the Responder.
+
+This module:
+- encodes the dataframes: STX, payload (optional sequence byte and 16bits fields), checksum and ETX.
+- adds escape characters in front of STX, ETX and escape bytes, when these are part of the data.
+- decodes the dataframes via a streaming state machine, fed one byte at the time (no lookback).
+- alternatively, frames the dataframes via Consistent Overhead Byte Stuffing (COBS), with 0x00 as delimiter:
+  fixed overhead (3 bytes, whatever the data) and resync at the next delimiter.
+- optionally, encodes only the changed fields (field bitmask), with full dataframes as keyframes.
+- encodes the command dataframes (protocol reconfiguration), and the capabilities reported by the Responder.
+- optionally, appends two Reed-Solomon parity bytes (FEC), correcting a single corrupted byte without a retransmit.
+- defines the status byte returned by the Responder: status, and optionally the free dataframe slots (credits).
+- tracks the dataframe sequence (duplicates, gaps and reorders).
+- includes a randomized round-trip and fuzz harness, to be run on the host: python3 frame_codec.py [runs] [seed]
+- includes a throughput benchmark of the two framings: python3 frame_codec.py bench [frames]
+
+
+
+MIT License
+
+Copyright (c) 2025 Andrea Favero
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+
+STX = 0x02                      # start of Text
+ETX = 0x03                      # end of Text
+ESC = 0x5C                      # escape character
+DELIMITER = 0x00                # COBS framing delimiter
+
+# framings
+ESCAPE_FRAMING = 'escape'       # STX + escaped payload + checksum + ETX
+COBS_FRAMING = 'cobs'           # delimiter + COBS encoded payload and checksum + delimiter
+FRAMINGS = (ESCAPE_FRAMING, COBS_FRAMING)
+
+# changed-fields (delta) payload: bitmask byte, then the fields having the bit set
+KEYFRAME = 0x80                 # bitmask flag of a dataframe carrying all the fields
+
+# status returned by the decoder (and by the Responder, when inquired)
+CHECKSUM_ERROR = 0              # dataframe complete, with wrong checksum
+OK = 1                          # dataframe complete, with correct checksum
+INCOMPLETE = 2                  # no dataframe yet, or dataframe with wrong length
+BUSY = 3                        # Responder still decoding (no reply in time): read the status again, don't resend
+COMMAND = 4                     # command dataframe, with correct checksum (decoder only, not returned to the Controller)
+
+# credits (flow control): with MODE_CREDITS, the status byte carries the free dataframe slots in the upper nibble
+STATUS_MASK = 0x0F              # status bits of the status byte
+CREDITS_SHIFT = 4               # free dataframe slots, in the Responder receive buffer
+MAX_CREDITS = 0x0F              # the slots are reported up to 15
+
+# forward error correction (FEC): Reed-Solomon parity bytes after the checksum, over GF(256)
+FEC_LEN = 2                     # parity bytes: a single corrupted byte is located and corrected
+GF_POLY = 0x11D                 # GF(256) primitive polynomial, with generator element 2
+
+# capability handshake
+PROTOCOL_VERSION = 4            # version of the dataframes and of the reply page (2: command opcodes, 3: FEC, 4: credits)
+MAX_FIELDS = 4                  # max 16bits fields per dataframe
+COMMAND_LEN = 12                # command payload bytes: longer than any dataframe payload, so never mistaken for one
+COMMAND_MARK = 0xC3             # first byte of the command payload
+OP_CONFIG = 0x01                # command: set fields and mode (args: fields, mode bits)
+OP_SET_FIELDS = 0x02            # command: set some fields (args: first field, count, 16bits values)
+OP_READ_STATS = 0x03            # command: the next read returns the statistics page instead of the capabilities
+OP_RESET = 0x04                 # command: sequence tracking and counters restart (no args)
+OP_BULK = 0x05                  # command: bytes of a logical stream, for core0 (args: stream, count, bytes)
+BULK_LEN = 8                    # max bytes of an OP_BULK command
+COMMAND_ARGS = {OP_CONFIG: 2, OP_SET_FIELDS: 2 + 2 * MAX_FIELDS, OP_READ_STATS: 0, OP_RESET: 0,
+                OP_BULK: 2 + BULK_LEN}  # argument bytes per opcode: the following payload bytes are zeros
+STATS_MARK = 0x5A               # reply page byte at CAPS_IDX, when the statistics follow (after OP_READ_STATS)
+CAPS_MARK = 0xCA                # reply page byte at CAPS_IDX, when the capabilities follow (never a status value)
+CAPS_IDX = 6                    # reply page index of the capabilities (after status and counters)
+REPLY_LEN = 18                  # reply page bytes
+
+# mode bits (capabilities and OP_CONFIG)
+MODE_SEQUENCE = 0x01            # sequence byte after STX
+MODE_COBS = 0x02                # COBS framing (escape framing otherwise)
+MODE_DELTA = 0x04               # changed-fields dataframes
+MODE_FEC = 0x08                 # Reed-Solomon parity bytes after the checksum
+MODE_CREDITS = 0x10             # status byte with the free dataframe slots (credits)
+
+
+
+def calculate_checksum(data):
+    """Returns the checksum of data, as module of 256."""
+    return sum(data) & 0xFF
+
+
+
+def _gf_tables():
+    """
+    Returns the exponential and logarithm tables of GF(256): the exponential one is doubled (510 entries used),
+    so that the product of two elements is GF_EXP[GF_LOG[a] + GF_LOG[b]], without the modulo.
+    """
+    gf_exp = bytearray(512)
+    gf_log = bytearray(256)
+    x = 1
+    for i in range(255):
+        gf_exp[i] = x
+        gf_log[x] = i
+        x <<= 1
+        if x & 0x100:
+            x ^= GF_POLY
+    for i in range(255, 512):
+        gf_exp[i] = gf_exp[i - 255]
+    return gf_exp, gf_log
+
+
+
+GF_EXP, GF_LOG = _gf_tables()
+FEC_LOG_G1 = GF_LOG[3]          # generator polynomial (x - 1)(x - 2) = x^2 + 3x + 2: logarithms of its coefficients
+FEC_LOG_G0 = GF_LOG[2]
+
+
+
+def _fec_step(parity, byte):
+    """Returns the parity (16 bits, high byte first) after one more byte: LFSR division by the generator polynomial."""
+    feedback = byte ^ (parity >> 8)
+    if not feedback:
+        return (parity & 0xFF) << 8
+    log_fb = GF_LOG[feedback]
+    return (((parity & 0xFF) ^ GF_EXP[log_fb + FEC_LOG_G1]) << 8) | GF_EXP[log_fb + FEC_LOG_G0]
+
+
+
+def fec_parity(payload, checksum):
+    """
+    Returns the FEC_LEN Reed-Solomon parity bytes (as 16 bits value, high byte first) of payload + checksum:
+    the dataframe becomes a RS(n + 2, n) codeword, with roots 1 and 2, so that the receiver locates and
+    corrects one corrupted byte (parity bytes included). Two or more corrupted bytes are detected, or
+    miscorrected into a dataframe that the checksum still rejects (most of the times).
+    """
+    parity = 0
+    for byte in payload:
+        parity = _fec_step(parity, byte)
+    return _fec_step(parity, checksum)
+
+
+
+def encode(payload, out=None, fec=False):
+    """
+    Returns the escaped dataframe of payload: STX + payload + checksum + ETX.
+    The checksum includes STX and payload (escapes excluded).
+    With fec, the two Reed-Solomon parity bytes follow the checksum (see fec_parity).
+    STX, ETX and escape bytes, when part of the payload, checksum or parity, get an escape in front.
+    When out (bytearray) is provided, the dataframe is appended to it.
+    """
+    frame = bytearray() if out is None else out
+    frame.append(STX)
+    checksum = STX
+    for byte in payload:
+        checksum += byte
+        if byte == STX or byte == ETX or byte == ESC:
+            frame.append(ESC)
+        frame.append(byte)
+    checksum &= 0xFF
+    if fec:
+        parity = fec_parity(payload, checksum)
+        tail = (checksum, parity >> 8, parity & 0xFF)
+    else:
+        tail = (checksum,)
+    for byte in tail:
+        if byte == STX or byte == ETX or byte == ESC:
+            frame.append(ESC)
+        frame.append(byte)
+    frame.append(ETX)
+    return frame
+
+
+
+def encode_cobs(payload, out=None, fec=False):
+    """
+    Returns the COBS dataframe of payload: delimiter + COBS(payload + checksum) + delimiter.
+    The checksum includes STX and payload, as for the escaped dataframe (a run of zeros is never valid).
+    With fec, the two Reed-Solomon parity bytes follow the checksum (see fec_parity).
+    Payloads up to 253 bytes take a single COBS block: the overhead is 3 bytes, whatever the data.
+    The leading delimiter ends any partial dataframe at the receiver (the smbus2 register byte does the same).
+    When out (bytearray) is provided, the dataframe is appended to it.
+    """
+    frame = bytearray() if out is None else out
+    frame.append(DELIMITER)
+    code_idx = len(frame)                                    # position of the current code byte
+    frame.append(1)
+    checksum = STX
+    for byte in payload:
+        checksum += byte
+        code_idx = _cobs_append(frame, code_idx, byte)
+    checksum &= 0xFF
+    code_idx = _cobs_append(frame, code_idx, checksum)
+    if fec:
+        parity = fec_parity(payload, checksum)
+        code_idx = _cobs_append(frame, code_idx, parity >> 8)
+        _cobs_append(frame, code_idx, parity & 0xFF)
+    frame.append(DELIMITER)
+    return frame
+
+
+
+def _cobs_append(frame, code_idx, byte):
+    """Appends byte to the COBS block at code_idx, returning the position of the (new) current code byte."""
+    if byte == DELIMITER:                                    # zero: the block ends, a new one starts
+        code_idx = len(frame)
+        frame.append(1)
+        return code_idx
+    frame.append(byte)
+    frame[code_idx] += 1
+    if frame[code_idx] == 0xFF:                              # full block (254 data bytes), without zero
+        code_idx = len(frame)
+        frame.append(1)
+    return code_idx
+
+
+
+def encode_frame(values, seq=None, out=None, framing=ESCAPE_FRAMING, fec=False):
+    """
+    Returns the dataframe with (sequence) + 16bits fields as payload:
+    STX + payload + checksum + ETX (escaped), or delimiter + COBS(payload + checksum) + delimiter.
+    With fec, the Reed-Solomon parity bytes follow the checksum.
+    """
+    payload = bytearray()
+    if seq is not None:
+        payload.append(seq & 0xFF)
+    for value in values:
+        payload.append((value >> 8) & 0xFF)
+        payload.append(value & 0xFF)
+    if framing == COBS_FRAMING:
+        return encode_cobs(payload, out, fec)
+    return encode(payload, out, fec)
+
+
+
+def encode_delta_frame(values, base=None, seq=None, out=None, framing=ESCAPE_FRAMING, fec=False):
+    """
+    Returns the changed-fields dataframe: (sequence) + bitmask + the fields differing from base.
+    The fields carry the new values (not differences), so that a retry applies the same result.
+    When base is None (i.e. the last dataframe wasn't acknowledged), all the fields are sent as keyframe.
+    """
+    payload = bytearray()
+    if seq is not None:
+        payload.append(seq & 0xFF)
+    payload.append(0)
+    mask = 0 if base is not None else KEYFRAME
+    for i, value in enumerate(values):
+        if base is None or base[i] != value:
+            mask |= 1 << i
+            payload.append((value >> 8) & 0xFF)
+            payload.append(value & 0xFF)
+    payload[0 if seq is None else 1] = mask
+    if framing == COBS_FRAMING:
+        return encode_cobs(payload, out, fec)
+    return encode(payload, out, fec)
+
+
+
+def delta_payload_len(fields, sequence=False):
+    """Returns the min and max payload lengths of the changed-fields dataframes."""
+    seq_bytes = 1 if sequence else 0
+    return seq_bytes + 1, seq_bytes + 1 + 2 * fields
+
+
+
+def encode_command(opcode, args=b'', framing=ESCAPE_FRAMING, fec=False):
+    """Returns the command dataframe: COMMAND_MARK + opcode + args, padded with zeros to COMMAND_LEN bytes."""
+    payload = bytearray(COMMAND_LEN)
+    payload[0] = COMMAND_MARK
+    payload[1] = opcode
+    payload[2:2 + len(args)] = bytes(args)
+    if framing == COBS_FRAMING:
+        return encode_cobs(payload, fec=fec)
+    return encode(payload, fec=fec)
+
+
+
+def mode_bits(sequence=False, framing=ESCAPE_FRAMING, delta=False, fec=False, credits=False):
+    """Returns the mode bits of a protocol configuration."""
+    return ((MODE_SEQUENCE if sequence else 0) | (MODE_COBS if framing == COBS_FRAMING else 0) |
+            (MODE_DELTA if delta else 0) | (MODE_FEC if fec else 0) | (MODE_CREDITS if credits else 0))
+
+
+
+def parse_mode(mode):
+    """Returns the (sequence, framing, delta, fec, credits) tuple of the mode bits."""
+    return (bool(mode & MODE_SEQUENCE), COBS_FRAMING if mode & MODE_COBS else ESCAPE_FRAMING, bool(mode & MODE_DELTA),
+            bool(mode & MODE_FEC), bool(mode & MODE_CREDITS))
+
+
+
+def max_frame_len(payload_len, framing=ESCAPE_FRAMING, fec=False):
+    """
+    Returns the max bytes of a dataframe on the wire, for payload_len bytes (sequence and fields):
+    every byte escaped for the escape framing, the 3 bytes overhead for COBS (payloads up to 253 bytes).
+    """
+    data_len = payload_len + 1 + (FEC_LEN if fec else 0)    # payload, checksum and parity
+    if framing == COBS_FRAMING:
+        return data_len + 3
+    return 2 * data_len + 2
+
+
+
+def slot_len(fields, sequence=False, framing=ESCAPE_FRAMING, delta=False, fec=False):
+    """
+    Returns the bytes of a dataframe slot (credits): the longest dataframe on the wire of the configuration.
+    A receive buffer shorter than a slot can't report credits (it would report no free slots, forever).
+    """
+    payload_len = (1 if sequence else 0) + (1 if delta else 0) + 2 * fields   # delta: bitmask and all the fields
+    return max_frame_len(payload_len, framing, fec)
+
+
+
+def parse_caps(reply):
+    """
+    Returns a dict with the capabilities in the reply page (REPLY_LEN bytes read from the Responder),
+    or None when the Responder doesn't report them (older Responders repeat the 6 bytes of status and counters).
+    """
+    if len(reply) < REPLY_LEN or reply[CAPS_IDX] != CAPS_MARK:
+        return None
+    i = CAPS_IDX + 1
+    return {'version': reply[i], 'max_fields': reply[i + 1], 'modes': reply[i + 2], 'fields': reply[i + 3],
+            'mode': reply[i + 4], 'rx_buffer': (reply[i + 5] << 8) | reply[i + 6], 'max_payload': reply[i + 7]}
+
+
+
+def parse_stats(reply):
+    """
+    Returns a dict with the statistics in the reply page (REPLY_LEN bytes read after OP_READ_STATS),
+    or None when the page carries something else (i.e. the capabilities).
+    """
+    if len(reply) < REPLY_LEN or reply[CAPS_IDX] != STATS_MARK:
+        return None
+    i = CAPS_IDX + 1
+    return {'frames': (reply[i] << 24) | (reply[i + 1] << 16) | (reply[i + 2] << 8) | reply[i + 3],
+            'checksum_errors': (reply[i + 4] << 8) | reply[i + 5], 'length_errors': (reply[i + 6] << 8) | reply[i + 7],
+            'commands': reply[i + 8], 'corrections': (reply[i + 9] << 8) | reply[i + 10]}
+
+
+
+def make_decoder(payload_len, framing=ESCAPE_FRAMING, max_payload=None, min_payload=None, command_len=None, fec=False):
+    """
+    Returns the streaming decoder for the framing (FrameDecoder or CobsDecoder).
+    With min_payload, payloads from min_payload to payload_len bytes are accepted (changed-fields dataframes).
+    With command_len, payloads of command_len bytes are returned as COMMAND (command dataframes).
+    With fec, the dataframes (commands included) carry the Reed-Solomon parity bytes after the checksum.
+    """
+    if framing == COBS_FRAMING:
+        return CobsDecoder(payload_len, max_payload, min_payload, command_len, fec)
+    if framing != ESCAPE_FRAMING:
+        raise ValueError(f"unknown framing {framing}")
+    return FrameDecoder(payload_len, max_payload, min_payload, command_len, fec)
+
+
+
+class FrameDecoder:
+    """
+    Streaming decoder of the escaped dataframes, fed one byte at the time.
+    The payload (escapes removed, STX and checksum excluded) is stored in a preallocated buffer.
+
+    Framing rules:
+    - an unescaped STX starts a dataframe (also when a dataframe is in progress: this one is abandoned).
+    - an unescaped ETX completes the dataframe in progress.
+    - the byte following an escape is taken as data (outside a dataframe, an escaped STX doesn't start one).
+    - outside a dataframe, bytes are ignored (i.e. the register byte sent by smbus2).
+    With fec, the parity bytes are checked at the dataframe end, before the length and the checksum:
+    a single corrupted byte is corrected in place (corrected is its index), then the parity bytes are dropped.
+    """
+
+    def __init__(self, payload_len, max_payload=None, min_payload=None, command_len=None, fec=False):
+        self.payload_len = payload_len                       # expected payload bytes (sequence and fields)
+        self.max_payload = max(max_payload or payload_len, command_len or 0)  # payload bytes that fit the buffer
+        self.min_len = (payload_len if min_payload is None else min_payload) + 1  # min payload plus checksum
+        self.max_len = payload_len + 1                       # max payload plus checksum
+        self.command_n = -1 if command_len is None else command_len + 1  # command payload plus checksum
+        self.fec = fec                                       # flag for the Reed-Solomon parity bytes
+        self.max_n = self.max_payload + (FEC_LEN if fec else 0)  # max bytes before the checksum, parity included
+        self.buf = bytearray(self.max_n + 1)                 # payload plus checksum (plus parity)
+        self.n = 0                                           # bytes in buf
+        self.corrected = -1                                  # index of the byte corrected in the last dataframe, -1 if none
+        self.checksum = 0                                    # running sum of STX and bytes in buf
+        self.in_frame = False                                # True after STX, until ETX
+        self.escape = False                                  # True when the next byte is escaped
+
+
+    def reset(self):
+        """Abandons the dataframe in progress."""
+        self.in_frame = False
+        self.escape = False
+        self.n = 0
+
+
+    def feed(self, byte):
+        """
+        Feeds one byte. Returns None while no dataframe is completed, otherwise the status:
+        OK, CHECKSUM_ERROR or INCOMPLETE (wrong payload length).
+        """
+        if not self.in_frame:
+            if self.escape:                                  # escaped byte, never a dataframe start
+                self.escape = False
+            elif byte == ESC:
+                self.escape = True
+            elif byte == STX:
+                self.in_frame = True
+                self.escape = False
+                self.n = 0
+                self.checksum = STX
+            return None
+
+        if self.escape:
+            self.escape = False
+        elif byte == ESC:
+            self.escape = True
+            return None
+        elif byte == STX:
+            self.n = 0                                       # dataframe restarts
+            self.checksum = STX
+            return None
+        elif byte == ETX:
+            self.in_frame = False
+            n = self.n
+            if self.fec:                                     # case of parity bytes after the checksum
+                n = self._fec_decode(n)
+                if n < 0:                                    # case of more than one corrupted byte
+                    return CHECKSUM_ERROR
+            if n == self.command_n:                          # case of command dataframe
+                return self._command_status()
+            if n < self.min_len or n > self.max_len:
+                return INCOMPLETE
+            checksum = self.buf[n - 1]
+            if (self.checksum - checksum) & 0xFF != checksum:
+                return CHECKSUM_ERROR
+            return OK
+
+        n = self.n
+        if n > self.max_n:                                   # case dataframe longer than the buffer
+            self.in_frame = False
+            return INCOMPLETE
+        self.buf[n] = byte
+        self.n = n + 1
+        self.checksum += byte
+        return None
+
+
+    def _fec_decode(self, n):
+        """
+        Checks the n bytes in buf as Reed-Solomon codeword (payload, checksum and parity bytes): the two syndromes
+        are the codeword evaluated at the roots 1 and 2 (Horner), both zero when there is no error.
+        A single corrupted byte at index i gives syndromes e and e * 2^(n - 1 - i): the error value and its position.
+        The byte is corrected in place, and the running checksum is updated; the parity bytes are then dropped.
+        Returns the bytes left (payload and checksum), or -1 when the errors can't be corrected.
+        """
+        self.corrected = -1
+        if n <= FEC_LEN:                                     # case too short for the parity bytes
+            self.n = 0
+            return 0
+        buf = self.buf
+        gf_exp = GF_EXP
+        gf_log = GF_LOG
+        s0 = 0                                               # syndrome at root 1: xor of the bytes
+        s1 = 0                                               # syndrome at root 2
+        for i in range(n):
+            byte = buf[i]
+            s0 ^= byte
+            s1 = (gf_exp[gf_log[s1] + 1] ^ byte) if s1 else byte
+        if s0 or s1:                                         # case of corrupted byte(s)
+            if not s0 or not s1:                             # case of more than one corrupted byte
+                return -1
+            k = gf_log[s1] - gf_log[s0]                      # error position, as power of the root 2
+            if k < 0:
+                k += 255
+            if k >= n:                                       # case the position is out of the dataframe
+                return -1
+            i = n - 1 - k
+            byte = buf[i]
+            buf[i] = byte ^ s0                               # byte is corrected
+            self.checksum += buf[i] - byte
+            self.corrected = i
+        n -= FEC_LEN
+        self.checksum -= buf[n] + buf[n + 1]                 # parity bytes out of the running sum
+        self.n = n
+        return n
+
+
+    def _command_status(self):
+        """Returns COMMAND for a command dataframe with correct checksum and mark, CHECKSUM_ERROR otherwise."""
+        n = self.n
+        checksum = self.buf[n - 1]
+        if (self.checksum - checksum) & 0xFF != checksum:
+            return CHECKSUM_ERROR
+        return COMMAND if self.buf[0] == COMMAND_MARK else INCOMPLETE
+
+
+    def feed_bytes(self, data):
+        """Feeds many bytes, returning the status of the last completed dataframe (None if none)."""
+        status = None
+        feed = self.feed
+        for byte in data:
+            result = feed(byte)
+            if result is not None:
+                status = result
+        return status
+
+
+    def fields(self, out, first=0, count=None):
+        """Fills out (list or array) with the 16bits fields of the payload, starting at byte first."""
+        buf = self.buf
+        if count is None:
+            count = (self.n - 1 - first) // 2
+        for i in range(count):
+            idx = first + 2 * i
+            out[i] = (buf[idx] << 8) | buf[idx + 1]
+        return out
+
+
+    def delta_mask(self, first, count):
+        """
+        Returns the bitmask of a changed-fields payload (bitmask byte at first, then the changed fields),
+        or -1 when the payload length doesn't match the bitmask, or a keyframe misses some fields.
+        """
+        mask = self.buf[first]
+        all_fields = (1 << count) - 1
+        if mask & ~(KEYFRAME | all_fields) or (mask & KEYFRAME and mask & all_fields != all_fields):
+            return -1
+        n = first + 2                                        # bitmask and checksum
+        for i in range(count):
+            if mask & (1 << i):
+                n += 2
+        return mask if n == self.n else -1
+
+
+    def delta_fields(self, out, first, mask, count):
+        """Updates out (list or array) with the changed fields of the payload, as per the bitmask (see delta_mask)."""
+        buf = self.buf
+        idx = first + 1
+        for i in range(count):
+            if mask & (1 << i):
+                out[i] = (buf[idx] << 8) | buf[idx + 1]
+                idx += 2
+        return out
+
+
+
+class CobsDecoder(FrameDecoder):
+    """
+    Streaming decoder of the COBS dataframes, fed one byte at the time, with the FrameDecoder interface.
+
+    Framing rules:
+    - a delimiter (0x00) completes the dataframe in progress, if any (consecutive delimiters are ignored).
+    - a corrupted dataframe is dropped at the next delimiter: there is no state to recover from.
+    - the first byte after a delimiter is a code byte: the number of data bytes that follow plus one,
+      with an implicit zero after them (unless the code is 0xFF, or the dataframe ends).
+    """
+
+    def __init__(self, payload_len, max_payload=None, min_payload=None, command_len=None, fec=False):
+        super().__init__(payload_len, max_payload, min_payload, command_len, fec)
+        self.code_left = 0                                   # data bytes left in the current COBS block
+        self.zero_pending = False                            # True when the current block ends with a zero
+        self.skip = False                                    # True when the dataframe is dropped, until the delimiter
+
+
+    def reset(self):
+        """Abandons the dataframe in progress."""
+        self.in_frame = False
+        self.escape = False
+        self.skip = False
+        self.code_left = 0
+        self.zero_pending = False
+        self.n = 0
+
+
+    def feed(self, byte):
+        """
+        Feeds one byte. Returns None while no dataframe is completed, otherwise the status:
+        OK, CHECKSUM_ERROR or INCOMPLETE (wrong payload length, or a COBS block cut by the delimiter).
+        """
+        if byte == DELIMITER:
+            if not self.in_frame:                            # case of leading or consecutive delimiters
+                self.skip = False
+                return None
+            self.in_frame = False
+            n = self.n
+            if self.fec and not self.code_left:              # case of parity bytes after the checksum
+                n = self._fec_decode(n)
+                if n < 0:                                    # case of more than one corrupted byte
+                    return CHECKSUM_ERROR
+            if n == self.command_n and not self.code_left:   # case of command dataframe
+                return self._command_status()
+            if self.code_left or n < self.min_len or n > self.max_len:
+                return INCOMPLETE
+            checksum = self.buf[n - 1]
+            if (self.checksum - checksum) & 0xFF != checksum:
+                return CHECKSUM_ERROR
+            return OK
+
+        if self.skip:                                        # case the dataframe is dropped
+            return None
+        if not self.in_frame:                                # first byte after a delimiter (a code byte)
+            self.in_frame = True
+            self.n = 0
+            self.checksum = STX
+            self.code_left = 0
+            self.zero_pending = False
+
+        if self.code_left:                                   # case of data byte
+            self.code_left -= 1
+        else:                                                # case of code byte
+            self.code_left = byte - 1
+            zero = self.zero_pending                         # the previous block ended with a zero
+            self.zero_pending = byte != 0xFF
+            if not zero:
+                return None
+            byte = 0
+
+        n = self.n
+        if n > self.max_n:                                   # case dataframe longer than the buffer
+            self.in_frame = False
+            self.skip = True
+            return INCOMPLETE
+        self.buf[n] = byte
+        self.n = n + 1
+        self.checksum += byte
+        return None
+
+
+
+class SequenceTracker:
+    """
+    Tracks the sequence byte of the validated dataframes.
+    check() returns True when the dataframe has to be applied, False when it has to be dropped:
+    - same sequence: it's a Controller retry of an already applied dataframe (duplicate).
+    - sequence slightly behind: the dataframe arrived late (reorder).
+    - sequence ahead by more than one: dataframes have been lost in between (gap).
+    A large jump (i.e. Controller restart) is accepted as a resync, without counting gaps.
+    """
+
+    REORDER_WINDOW = 16                                      # sequence values this far behind the last one are late
+
+    def __init__(self):
+        self.last_seq = None                                 # sequence of the last applied dataframe
+        self.duplicates = 0
+        self.gaps = 0
+        self.reorders = 0
+
+    def check(self, seq):
+        last_seq = self.last_seq
+        if last_seq is None:
+            self.last_seq = seq
+            return True
+        diff = (seq - last_seq) & 0xFF
+        if diff == 0:
+            self.duplicates += 1
+            return False
+        if diff > 0x100 - self.REORDER_WINDOW:
+            self.reorders += 1
+            return False
+        if 1 < diff < 0x80:
+            self.gaps += diff - 1
+        self.last_seq = seq
+        return True
+
+
+
+def fuzz(runs=100000, seed=None, printout=True, framing=ESCAPE_FRAMING, fec=False):
+    """
+    Randomized round-trip and fuzz harness, to be run on the host (also works on MicroPython, slowly).
+    The framing (ESCAPE_FRAMING or COBS_FRAMING) sets the encoder and decoder under test, with fec the
+    dataframes carry the Reed-Solomon parity bytes.
+    - round trip: escape-heavy dataframes, with junk in between, are decoded to the same values.
+    - single bit flips: counts how many corrupted dataframes are detected (INCOMPLETE, CHECKSUM_ERROR,
+      or lost), corrected (fec) and how many are accepted with wrong values (undetected).
+    - noise: random streams are decoded without exceptions.
+    Raises AssertionError when a round trip fails; returns a dict with the counters.
+    """
+    import random
+    if seed is not None:
+        random.seed(seed)
+    heavy = (STX, ETX, ESC)
+    counters = {'frames': 0, 'flips': 0, 'flips_detected': 0, 'flips_corrected': 0, 'flips_undetected': 0,
+                'noise_frames': 0}
+
+    def random_byte():
+        return random.choice(heavy) if random.getrandbits(1) else random.getrandbits(8)
+
+    decoders = {}
+    for run in range(runs):
+        n_fields = 1 + run % 4
+        sequence = bool(run & 4)
+        payload_len = (1 if sequence else 0) + 2 * n_fields
+        decoder = decoders.get(payload_len)
+        if decoder is None:
+            decoder = decoders[payload_len] = make_decoder(payload_len, framing, fec=fec)
+        values = [(random_byte() << 8) | random_byte() for _ in range(n_fields)]
+        seq = random_byte() if sequence else None
+        frame = encode_frame(values, seq, framing=framing, fec=fec)
+
+        # round trip, after junk not containing STX and escapes (smbus2 register byte, previous partial dataframes)
+        junk = bytes(b for b in (random.getrandbits(8) for _ in range(random.getrandbits(2))) if b != STX and b != ESC)
+        decoder.reset()
+        status = decoder.feed_bytes(junk + frame)
+        first = 1 if sequence else 0
+        decoded = decoder.fields([0] * n_fields, first, n_fields)
+        assert status == OK and decoded == values, (values, seq, list(frame), status, decoded)
+        assert not sequence or decoder.buf[0] == seq, (seq, decoder.buf[0])
+        counters['frames'] += 1
+
+        # single bit flip
+        corrupted = bytearray(frame)
+        idx = random.getrandbits(16) % len(corrupted)
+        corrupted[idx] ^= 1 << random.getrandbits(3)
+        decoder.reset()
+        status = decoder.feed_bytes(corrupted)
+        counters['flips'] += 1
+        if status == OK and decoder.fields([0] * n_fields, first, n_fields) != values:
+            counters['flips_undetected'] += 1
+        elif status == OK and decoder.corrected >= 0:
+            counters['flips_corrected'] += 1
+        elif status != OK:
+            counters['flips_detected'] += 1
+
+        # noise
+        if run % 16 == 0:
+            decoder.reset()
+            noise = bytes(random_byte() for _ in range(32))
+            if decoder.feed_bytes(noise) == OK:
+                counters['noise_frames'] += 1
+            decoder.reset()
+
+    if printout:
+        print(f"Codec fuzz ({framing}{', fec' if fec else ''}):", counters)
+    return counters
+
+
+
+def benchmark(frames=20000, fields=2, sequence=True, speed=400000, printout=True):
+    """
+    Throughput of the escape and COBS framings, to be run on the host: encode and decode time per dataframe,
+    and dataframe size, for random values and for escape-heavy values (every byte is STX, ETX or escape).
+    The bus rate is the dataframes per second fitting the bus at speed (9 clocks per byte, plus the address byte).
+    Returns a dict (framing, data) -> dict with the results.
+    """
+    import random, time
+    payload_len = (1 if sequence else 0) + 2 * fields
+    data_sets = {'random': [[random.getrandbits(16) for _ in range(fields)] for _ in range(256)],
+                 'escape-heavy': [[random.choice((0x0203, 0x0302, 0x5C5C, 0x025C, 0x5C03)) for _ in range(fields)]
+                                  for _ in range(256)]}
+    results = {}
+    for framing in FRAMINGS:
+        decoder = make_decoder(payload_len, framing)
+        for data_name, values_set in data_sets.items():
+            stream = bytearray()
+            sizes = []
+            t_ref = time.perf_counter()
+            for i in range(frames):
+                size = len(stream)
+                encode_frame(values_set[i & 0xFF], (i & 0xFF) if sequence else None, stream, framing)
+                sizes.append(len(stream) - size)
+            encode_s = time.perf_counter() - t_ref
+
+            decoder.reset()
+            ok = 0
+            feed = decoder.feed
+            t_ref = time.perf_counter()
+            for byte in stream:
+                if feed(byte) == OK:
+                    ok += 1
+            decode_s = time.perf_counter() - t_ref
+            assert ok == frames, (framing, data_name, ok)
+
+            avg_bytes = sum(sizes) / frames
+            results[(framing, data_name)] = {'avg_bytes': round(avg_bytes, 2), 'max_bytes': max(sizes),
+                                             'encode_us': round(1e6 * encode_s / frames, 2),
+                                             'decode_us': round(1e6 * decode_s / frames, 2),
+                                             'bus_frames_s': int(speed / (9 * (avg_bytes + 1)))}
+    if printout:
+        print(f"Framing benchmark: {frames} dataframes, {fields} fields, sequence {sequence}, bus at {speed} Hz")
+        for (framing, data_name), result in results.items():
+            print(f"  {framing:6} {data_name:12} {result}")
+    return results
+
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 20000)
+    else:
+        for fec in (False, True):
+            for framing in FRAMINGS:
+                fuzz(int(sys.argv[1]) if len(sys.argv) > 1 else 100000, int(sys.argv[2]) if len(sys.argv) > 2 else None,
+                     framing=framing, fec=fec)
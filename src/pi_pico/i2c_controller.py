@@ -0,0 +1,1173 @@
+"""
+Andrea Favero
+
+Python / Micropython library for the I2C Controller (Raspberry Pi Zero 2, Raspberry Pi Pico).
+It replaces the dataframe handling, previously repeated in each Controller script.
+
+This library:
+- encodes the dataframes (frame_codec, shared with the Responder): STX, optional sequence byte, 16bits field(s), escape characters, checksum and ETX.
+- alternatively, per device, encodes the dataframes with the COBS framing (0x00 delimiter, fixed overhead).
+- optionally, sends only the fields changed since the last acknowledged dataframe (keyframe otherwise).
+- optionally, per device, appends the Reed-Solomon parity bytes (FEC): the Responder corrects a corrupted byte.
+- reads the Responder capabilities, and configures each Responder to the best mode both sides support.
+- sends command dataframes: set fields, statistics page, counters reset and bulk bytes of logical streams.
+- accesses the I2C bus via pluggable transports: smbus2 (Linux), machine.I2C (MicroPython), in-memory simulator.
+- sends a dataframe again, with exponential backoff, when the device does not return 1.
+- reads the status again (no resend) while the device returns busy, and paces each device by its credits
+  (free dataframe slots reported in the status byte).
+- skips a device failing too many times in a row (circuit breaker), and re-probes it in background.
+- keeps per-device statistics, and calibrates the bus speed.
+- optionally, broadcasts a dataframe to all the Responders at once (general call), collecting the acks later.
+- optionally, queues the values per device (latest value wins for states, FIFO for events) for a sender thread.
+
+
+
+MIT License
+
+Copyright (c) 2025 Andrea Favero
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+
+import time, random
+import _thread
+
+from frame_codec import (encode_frame, encode_delta_frame, delta_payload_len, make_decoder, SequenceTracker,
+                         ESCAPE_FRAMING, COBS_FRAMING, KEYFRAME, COMMAND, COMMAND_LEN, COMMAND_ARGS, OP_CONFIG,
+                         OP_SET_FIELDS, OP_READ_STATS, OP_RESET, OP_BULK, BULK_LEN, PROTOCOL_VERSION, MAX_FIELDS,
+                         CAPS_MARK, STATS_MARK, REPLY_LEN, MODE_SEQUENCE, MODE_COBS, MODE_DELTA, MODE_FEC,
+                         MODE_CREDITS, BUSY, STATUS_MASK, CREDITS_SHIFT, MAX_CREDITS, encode_command, mode_bits,
+                         parse_mode, parse_caps, parse_stats, slot_len)
+from core_fifo import make_descriptor, EV_FRAME, EV_BULK
+
+DEVICE_LABELS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+GENERAL_CALL_ADDRESS = 0x00     # I2C general call address, for the broadcast dataframes
+BROADCAST_COMMAND = 0x10        # general call second byte: not 0x00 (not allowed), 0x04 or 0x06 (address programming), nor a framing byte
+
+# time functions, with the CPython fallbacks for the MicroPython ones
+try:
+    ticks_ms, ticks_us, ticks_diff = time.ticks_ms, time.ticks_us, time.ticks_diff
+except AttributeError:
+    def ticks_ms():
+        return int(time.monotonic() * 1000)
+    def ticks_us():
+        return int(time.monotonic() * 1000000)
+    def ticks_diff(new, old):
+        return new - old
+
+
+
+class SMBusTransport:
+    """I2C transport based on smbus2 (Linux, i.e. Raspberry Pi Zero 2)."""
+
+    can_set_speed = False        # the bus speed is set at /boot/config.txt
+
+    def __init__(self, bus_id=1):
+        from smbus2 import SMBus, i2c_msg
+        self.bus_id = bus_id
+        self.bus = SMBus(bus_id)
+        self.i2c_msg = i2c_msg
+
+    @property
+    def speed(self):
+        """I2C bus speed (set via dtparam=i2c_arm_baudrate) read from the device tree, None if unknown."""
+        try:
+            with open(f"/sys/class/i2c-adapter/i2c-{self.bus_id}/of_node/clock-frequency", "rb") as f:
+                return int.from_bytes(f.read(4), 'big')
+        except OSError:
+            return None
+
+    def scan(self):
+        """Scans the I2C bus via the bash command 'i2cdetect -y <bus_id>'."""
+        import subprocess
+        result = subprocess.run(["i2cdetect", "-y", str(self.bus_id)], capture_output=True, text=True, check=True)
+        addresses = []
+        for line in result.stdout.splitlines()[1:]:   # skip the header line
+            parts = line.split()
+            if not parts:
+                continue
+            row_prefix = parts[0].strip(":")         # remove colon from row descriptor
+            for col_index, value in enumerate(parts[1:]):
+                if value != "--":
+                    addresses.append(int(row_prefix, 16) + col_index)
+        return addresses
+
+    def write(self, adr, data):
+        if adr == GENERAL_CALL_ADDRESS:
+            # the broadcast command takes the register place, as 0x00 isn't allowed after a general call
+            self.bus.write_i2c_block_data(adr, data[0], list(data[1:]))
+            return
+        # the first byte (register 0) is ignored by the Responder, as it precedes the STX
+        self.bus.write_i2c_block_data(adr, 0, list(data))
+
+    def read(self, adr, n=1):
+        if n == 1:
+            return bytes((self.bus.read_byte(adr),))
+        # plain read transfer: read_i2c_block_data would write a register byte first, received as data
+        msg = self.i2c_msg.read(adr, n)
+        self.bus.i2c_rdwr(msg)
+        return bytes(list(msg))
+
+    def close(self):
+        self.bus.close()
+
+
+
+class MachineI2CTransport:
+    """I2C transport based on machine.I2C (MicroPython, i.e. Raspberry Pi Pico)."""
+
+    can_set_speed = True
+
+    def __init__(self, i2c_id=0, scl=1, sda=0, freq=100000):
+        self.i2c_id = i2c_id
+        self.scl = scl
+        self.sda = sda
+        self.set_speed(freq)
+
+    def set_speed(self, freq):
+        from machine import I2C, Pin
+        self.i2c = I2C(self.i2c_id, scl=Pin(self.scl), sda=Pin(self.sda), freq=freq)
+        self.speed = freq
+
+    def scan(self):
+        return self.i2c.scan()
+
+    def write(self, adr, data):
+        self.i2c.writeto(adr, data)
+
+    def read(self, adr, n=1):
+        return self.i2c.readfrom(adr, n)
+
+    def close(self):
+        pass
+
+
+
+class SimResponder:
+    """
+    In-memory Responder, behaving as the Pico I2CHandler: it decodes the dataframes,
+    applies the sequence rules and replies with the status and counters bytes, followed by the capabilities.
+    When fifo (i.e. core_fifo.SimFifo) is provided, a descriptor is pushed after each applied dataframe.
+    With general_call, the dataframes written to the general call address (broadcast) are accepted too,
+    without the general call command byte (see write_general_call).
+    With delta, the dataframes carry the changed fields only (keyframes carry all of them).
+    With fec, the dataframes carry the Reed-Solomon parity bytes (a corrupted byte is corrected, and counted).
+    With credits, the status byte carries the free dataframe slots of the rx_buffer bytes (see _free_bytes):
+    as at the Responder, the credits are refused when rx_buffer doesn't hold a dataframe slot.
+    With caps False, it behaves as a Responder without the capability handshake (6 bytes reply, no commands).
+    Command dataframes are executed as at the Responder (dispatch by opcode, expected argument bytes).
+    """
+
+    SUPPORTED_MODES = MODE_SEQUENCE | MODE_COBS | MODE_DELTA | MODE_FEC | MODE_CREDITS
+
+    def __init__(self, fields=2, sequence=False, fifo=None, general_call=False, framing=ESCAPE_FRAMING, delta=False,
+                 caps=True, fec=False, credits=False, rx_buffer=16):
+        self.general_call = general_call
+        self.caps = caps
+        self.rx_buffer = rx_buffer      # received bytes held by the receive buffer
+        credits = credits and rx_buffer >= slot_len(fields, sequence, framing, delta, fec)
+        self._set_protocol(fields, sequence, framing, delta, fec, credits)
+        self.frames = 0                 # dataframes applied
+        self.status = 2
+        self.rx_seq = 0
+        self.recoveries = 0
+        self.checksum_errors = 0
+        self.length_errors = 0
+        self.executed = 0               # commands applied
+        self.corrections = 0            # bytes corrected via the FEC parity bytes
+        self.stats_page = False         # True after OP_READ_STATS, until the next read
+        self.bulk = (0, b'')            # (stream, bytes) of the last OP_BULK command
+        self.fifo = fifo
+        self.commands = {OP_CONFIG: self._op_config, OP_SET_FIELDS: self._op_set_fields,
+                         OP_READ_STATS: self._op_read_stats, OP_RESET: self._op_reset, OP_BULK: self._op_bulk}
+
+    def _set_protocol(self, fields, sequence, framing, delta, fec=False, credits=False):
+        self.df_fields = fields
+        self.sequence = sequence
+        self.framing = framing
+        self.delta = delta
+        self.fec = fec
+        self.credits = credits
+        self.keyed = False              # True once a keyframe has been applied
+        self.seq_bytes = 1 if sequence else 0
+        payload_len, min_payload = self.seq_bytes + 2 * fields, None
+        if delta:
+            min_payload, payload_len = delta_payload_len(fields, sequence)
+        self.decoder = make_decoder(payload_len, framing, min_payload=min_payload,
+                                    command_len=COMMAND_LEN if self.caps else None, fec=fec)
+        self.frame_bytes = slot_len(fields, sequence, framing, delta, fec)   # bytes of a dataframe slot
+        self.tracker = SequenceTracker()
+        self.fields = [0] * fields
+
+    def _free_bytes(self):
+        # the dataframes are decoded as written: the receive buffer is empty at every read
+        return self.rx_buffer
+
+    def _status_byte(self):
+        if not self.credits:
+            return self.status
+        return self.status | (min(self._free_bytes() // self.frame_bytes, MAX_CREDITS) << CREDITS_SHIFT)
+
+    def write(self, data):
+        feed = self.decoder.feed
+        for byte in data:
+            status = feed(byte)
+            if (status == 1 or status == COMMAND) and self.decoder.corrected >= 0:
+                self.corrections += 1
+            if status == COMMAND:
+                self.status = self._command()
+                feed = self.decoder.feed
+                continue
+            if status == 1 and self.delta:
+                mask = self.decoder.delta_mask(self.seq_bytes, self.df_fields)
+                if mask < 0 or not (mask & KEYFRAME or self.keyed):   # a keyframe is needed
+                    status = 2
+            self.status = 2 if status is None else status
+            if status == 0:
+                self.checksum_errors += 1
+            elif status == 2:
+                self.length_errors += 1
+            elif status == 1:
+                self._frame()
+
+    def write_general_call(self, data):
+        # as at the Responder, the general call command byte isn't fed to the decoder (with COBS, a code byte)
+        self.write(data[1:])
+
+    def read(self, n=1):
+        tracker = self.tracker
+        reply = bytes((self._status_byte(), self.rx_seq, tracker.duplicates & 0xFF, tracker.gaps & 0xFF,
+                       tracker.reorders & 0xFF, self.recoveries & 0xFF))
+        if self.stats_page:
+            reply += bytes((STATS_MARK,)) + self.frames.to_bytes(4, 'big') + bytes((
+                (self.checksum_errors >> 8) & 0xFF, self.checksum_errors & 0xFF,
+                (self.length_errors >> 8) & 0xFF, self.length_errors & 0xFF, self.executed & 0xFF,
+                (self.corrections >> 8) & 0xFF, self.corrections & 0xFF))
+        elif self.caps:
+            reply += bytes((CAPS_MARK, PROTOCOL_VERSION, MAX_FIELDS, self.SUPPORTED_MODES, self.df_fields,
+                            mode_bits(self.sequence, self.framing, self.delta, self.fec, self.credits),
+                            (self.rx_buffer >> 8) & 0xFF, self.rx_buffer & 0xFF, self.decoder.max_payload, 0, 0, 0))
+        self.stats_page = False
+        return (reply * (n // len(reply) + 1))[:n]
+
+    def _command(self):
+        buf = self.decoder.buf
+        method = self.commands.get(buf[1])
+        if method is None or any(buf[2 + COMMAND_ARGS[buf[1]]:COMMAND_LEN]):
+            return 2
+        status = method(buf)
+        if status == 1:
+            self.executed += 1
+        return status
+
+    def _op_config(self, buf):
+        fields, mode = buf[2], buf[3]
+        if not 1 <= fields <= MAX_FIELDS or mode & ~self.SUPPORTED_MODES:
+            return 2
+        sequence, framing, delta, fec, credits = parse_mode(mode)
+        if credits and self.rx_buffer < slot_len(fields, sequence, framing, delta, fec):
+            return 2
+        self._set_protocol(fields, sequence, framing, delta, fec, credits)
+        return 1
+
+    def _op_set_fields(self, buf):
+        first, count = buf[2], buf[3]
+        if count < 1 or first + count > self.df_fields:
+            return 2
+        for i in range(count):
+            self.fields[first + i] = (buf[4 + 2 * i] << 8) | buf[5 + 2 * i]
+        self.frames += 1
+        if self.fifo is not None:
+            self.fifo.push(make_descriptor(EV_FRAME, self.df_fields, self.rx_seq, self.frames))
+        return 1
+
+    def _op_read_stats(self, buf):
+        self.stats_page = True
+        return 1
+
+    def _op_reset(self, buf):
+        self.tracker = SequenceTracker()
+        self.rx_seq = 0
+        self.recoveries = self.frames = self.checksum_errors = self.length_errors = self.executed = 0
+        self.corrections = 0
+        return 1
+
+    def _op_bulk(self, buf):
+        stream, count = buf[2], buf[3]
+        if count > BULK_LEN:
+            return 2
+        self.bulk = (stream, bytes(buf[4:4 + count]))
+        if self.fifo is not None:
+            self.fifo.push(make_descriptor(EV_BULK, count, stream, self.executed))
+        return 1
+
+    def _frame(self):
+        if self.sequence:
+            self.rx_seq = self.decoder.buf[0]
+            if not self.tracker.check(self.rx_seq):
+                return
+        if self.delta:
+            mask = self.decoder.delta_mask(self.seq_bytes, self.df_fields)
+            self.decoder.delta_fields(self.fields, self.seq_bytes, mask, self.df_fields)
+            self.keyed = True
+        else:
+            self.decoder.fields(self.fields, self.seq_bytes, self.df_fields)
+        self.frames += 1
+        if self.fifo is not None:
+            self.fifo.push(make_descriptor(EV_FRAME, self.df_fields, self.rx_seq, self.frames))
+
+
+
+class SimTransport:
+    """In-memory I2C bus, hosting SimResponder (or alike) objects at their addresses."""
+
+    can_set_speed = True
+
+    def __init__(self, speed=100000):
+        self.responders = {}
+        self.speed = speed
+
+    def add_responder(self, adr, responder):
+        self.responders[adr] = responder
+        return responder
+
+    def set_speed(self, freq):
+        self.speed = freq
+
+    def scan(self):
+        return sorted(self.responders)
+
+    def write(self, adr, data):
+        if adr == GENERAL_CALL_ADDRESS:
+            # every Responder accepting the general call receives the same bytes
+            targets = [r for r in self.responders.values() if getattr(r, 'general_call', False)]
+            if not targets:
+                raise OSError("general call not acknowledged")
+            for responder in targets:
+                responder.write_general_call(data)
+            return
+        if adr not in self.responders:
+            raise OSError(f"no device at address {hex(adr)}")
+        self.responders[adr].write(data)
+
+    def read(self, adr, n=1):
+        if adr not in self.responders:
+            raise OSError(f"no device at address {hex(adr)}")
+        return self.responders[adr].read(n)
+
+    def close(self):
+        pass
+
+
+
+class DeviceHealth:
+    """
+    Health state and statistics of a device, acting as circuit breaker:
+    - 'closed': the device is healthy, and dataframes are sent to it.
+    - 'open': the device failed too many times in a row, and it's skipped.
+    - 'half-open': the device replied to a re-probe, and the next dataframe is a trial.
+    """
+
+    def __init__(self, dev, adr, threshold=5, cooldown_s=1.0, cooldown_max_s=30.0, framing=ESCAPE_FRAMING,
+                 delta=False, fec=False, credits=False):
+        self.dev = dev
+        self.adr = adr
+        self.framing = framing          # dataframe framing of the device ('escape' or 'cobs')
+        self.delta = delta              # flag for changed-fields dataframes to the device
+        self.fec = fec                  # flag for the Reed-Solomon parity bytes in the dataframes to the device
+        self.credits = credits          # flag for the free dataframe slots in the status byte of the device
+        self.slots = None               # free dataframe slots last reported by the device, None when unknown
+        self.slot_rounds = 0            # sender rounds the device has been skipped, for lack of free slots
+        self.caps = None                # capabilities reported by the device (read_caps)
+        self.threshold = threshold
+        self.cooldown_min_s = cooldown_s
+        self.cooldown_max_s = cooldown_max_s
+        self.state = 'closed'
+        self.seq = 0                    # sequence byte of the next dataframe
+        self.broadcast = None           # (values, seq) of the last broadcast dataframe, until its ack is collected
+        self.base = None                # values of the last acknowledged dataframe (changed-fields dataframes)
+        self.failures = 0               # consecutive failed dataframes
+        self.cooldown_s = cooldown_s    # current time the device is skipped when 'open'
+        self.reprobe_ms = 0             # ticks_ms of the next re-probe, when 'open'
+        self.sent = 0                   # dataframes sent (retries excluded)
+        self.ok = 0                     # dataframes correctly received
+        self.checksum_errors = 0        # device returns 0
+        self.length_errors = 0          # device returns 2
+        self.bus_errors = 0             # I2C errors
+        self.retries = 0                # dataframes sent again
+        self.trips = 0                  # times the device has been skipped
+        self.tx_bytes = 0               # dataframe bytes written (retries included)
+        self.busy = 0                   # status reads repeated as the device returned busy
+        self.stalls = 0                 # status reads waiting for a free slot (credits)
+        self.queue = SendQueue()        # outbound queue, emptied by the sender thread (post)
+        self._lock = _thread.allocate_lock()
+
+    def available(self):
+        return self.state != 'open'
+
+    def record_return(self, device_return):
+        if device_return == 0:
+            self.checksum_errors += 1
+        elif device_return == 2:
+            self.length_errors += 1
+        elif device_return is None:
+            self.bus_errors += 1
+
+    def record_success(self):
+        with self._lock:
+            self.ok += 1
+            self.failures = 0
+            self.state = 'closed'
+            self.cooldown_s = self.cooldown_min_s
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half-open':      # failed trial: skipped again, for longer
+                self._trip(min(2 * self.cooldown_s, self.cooldown_max_s))
+            elif self.failures >= self.threshold:
+                self._trip(self.cooldown_min_s)
+
+    def record_probe(self, replied):
+        with self._lock:
+            if self.state != 'open':
+                return
+            if replied:
+                self.state = 'half-open'
+            else:
+                self._trip(min(2 * self.cooldown_s, self.cooldown_max_s))
+
+    def reprobe_due(self):
+        return self.state == 'open' and ticks_diff(ticks_ms(), self.reprobe_ms) >= 0
+
+    def _trip(self, cooldown_s):
+        if self.state != 'open':
+            self.trips += 1
+            print(f"Device {self.dev} skipped for {cooldown_s} secs")
+        self.state = 'open'
+        self.cooldown_s = cooldown_s
+        self.reprobe_ms = ticks_ms() + int(1000 * cooldown_s)
+
+    def summary(self):
+        return {'state': self.state, 'sent': self.sent, 'ok': self.ok, 'retries': self.retries,
+                'checksum_errors': self.checksum_errors, 'length_errors': self.length_errors,
+                'bus_errors': self.bus_errors, 'trips': self.trips, 'tx_bytes': self.tx_bytes, 'busy': self.busy,
+                'stalls': self.stalls}
+
+
+
+class SendQueue:
+    """
+    Outbound queue of a device, filled by the application threads and emptied by the sender thread:
+    - state values (i.e. setpoints): latest value wins, a value not sent yet is replaced by the newer one.
+    - event values: FIFO, each one is sent; when max_events are waiting, the oldest one is dropped.
+    Events are sent before the state value, which is sent again when not delivered and not superseded.
+    """
+
+    def __init__(self, max_events=16):
+        self.max_events = max_events
+        self.state = None               # latest state values, not sent yet
+        self.state_ms = 0               # ticks_ms when the state values were posted
+        self.events = []                # event values, not sent yet (oldest first)
+        self.posted = 0                 # values posted (state and events)
+        self.coalesced = 0              # state values replaced by a newer one before being sent
+        self.dropped = 0                # event values dropped, as the FIFO was full
+        self.sent = 0                   # values taken by the sender
+        self.failed = 0                 # values not acknowledged by the device
+        self.max_depth = 0              # max values waiting at once
+        self.age_ms = 0                 # time the last sent state values have been waiting
+        self._lock = _thread.allocate_lock()
+
+    def put(self, values, event=False):
+        with self._lock:
+            self.posted += 1
+            if event:
+                if len(self.events) >= self.max_events:
+                    self.events.pop(0)
+                    self.dropped += 1
+                self.events.append(values)
+            else:
+                if self.state is not None:
+                    self.coalesced += 1
+                self.state = values
+                self.state_ms = ticks_ms()
+            depth = self.depth()
+            if depth > self.max_depth:
+                self.max_depth = depth
+
+    def get(self):
+        """Returns (values, event flag) of the next values to be sent, None when empty."""
+        with self._lock:
+            if self.events:
+                self.sent += 1
+                return self.events.pop(0), True
+            if self.state is None:
+                return None
+            values, self.state = self.state, None
+            self.sent += 1
+            self.age_ms = ticks_diff(ticks_ms(), self.state_ms)
+            return values, False
+
+    def restore(self, values):
+        """Puts back state values not delivered, unless newer ones have been posted meanwhile."""
+        with self._lock:
+            if self.state is None:
+                self.state = values
+
+    def depth(self):
+        return len(self.events) + (self.state is not None)
+
+    def summary(self):
+        return {'depth': self.depth(), 'max_depth': self.max_depth, 'posted': self.posted,
+                'coalesced': self.coalesced, 'dropped': self.dropped, 'sent': self.sent, 'failed': self.failed,
+                'age_ms': self.age_ms}
+
+
+
+class I2CController:
+    """
+    I2C Controller sending dataframes of 16bits fields to the Pico Responders.
+    The I2C bus is accessed via a transport object (SMBusTransport, MachineI2CTransport or SimTransport).
+    A dataframe not correctly received is sent again, with exponential backoff, up to max_retries times.
+    A device failing breaker_threshold dataframes in a row is skipped, until it replies to a re-probe.
+    A dataframe can be broadcast to all the devices in one transaction (general call, enabled at the
+    Responders), and the acks collected later: devices not confirming it get the dataframe individually.
+    The framing ('escape' or 'cobs') is the default one of the devices; add_device() can set it per device.
+    With delta, a dataframe carries only the fields changed since the last one acknowledged by the device;
+    after a dataframe not acknowledged, a keyframe (all the fields) is sent.
+    With fec, the dataframes carry two Reed-Solomon parity bytes: the device corrects a corrupted byte, without retry.
+    A device returning 3 (busy) has not decoded the dataframe yet: the status is read again, up to max_busy_polls
+    times, instead of sending the dataframe again.
+    With credits, the status byte carries the free dataframe slots of the device: the Controller waits for a free slot
+    before writing to a device reporting none.
+    negotiate() reads the capabilities of the devices, and configures them (fields, sequence, framing, delta, fec,
+    credits).
+    post() queues the values of a device for the sender thread (start_sender), not blocking the application:
+    state values are coalesced (latest value wins), event values are sent in order.
+    """
+
+    def __init__(self, transport, fields=2, sequence=False, max_retries=3, backoff_base_s=0.002,
+                 backoff_max_s=0.1, breaker_threshold=5, breaker_cooldown_s=1.0, breaker_cooldown_max_s=30.0,
+                 printout=False, framing=ESCAPE_FRAMING, delta=False, fec=False, credits=False, max_busy_polls=8):
+        self.transport = transport
+        self.df_fields = fields                 # number of 16-bit fields in dataframe
+        self.sequence = sequence                # flag to add a sequence byte to the dataframes
+        self.framing = framing                  # default dataframe framing of the devices
+        self.delta = delta                      # default flag to send the changed fields only
+        self.fec = fec                          # default flag to append the Reed-Solomon parity bytes
+        self.credits = credits                  # default flag for the free dataframe slots in the status byte
+        self.max_busy_polls = max_busy_polls    # status reads while a device is busy (or without free slots)
+        self.max_retries = max_retries
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown_s = breaker_cooldown_s
+        self.breaker_cooldown_max_s = breaker_cooldown_max_s
+        self.printout = printout
+        self.devices = {}                       # device label -> DeviceHealth
+        self._bus_lock = _thread.allocate_lock()
+        self._reprobe_run = False
+        self._sender_run = False
+        self.broadcasts = 0                     # broadcast dataframes written
+        self.broadcast_errors = 0               # broadcast dataframes not acknowledged by any device
+
+
+    def add_device(self, dev, adr, framing=None, delta=None, fec=None, credits=None):
+        """Adds a device, with its own framing, delta, fec and credits flags (None for the Controller default ones)."""
+        self.devices[dev] = DeviceHealth(dev, adr, self.breaker_threshold, self.breaker_cooldown_s,
+                                         self.breaker_cooldown_max_s, framing or self.framing,
+                                         self.delta if delta is None else delta, self.fec if fec is None else fec,
+                                         self.credits if credits is None else credits)
+        return self.devices[dev]
+
+
+    def set_framing(self, dev, framing):
+        """Sets the framing of a device (the same has to be set at the Responder)."""
+        self.devices[dev].framing = framing
+
+
+    def scan(self):
+        """Scans the bus, and adds the found devices with labels A, B, C ..."""
+        with self._bus_lock:
+            addresses = self.transport.scan()
+        for i, adr in enumerate(addresses):
+            self.add_device(DEVICE_LABELS[i], adr)
+            print(f"Device found {DEVICE_LABELS[i]}:", hex(adr))
+        return {dev: health.adr for dev, health in self.devices.items()}
+
+
+    def _encode(self, health, values, seq, base=None):
+        """Encodes the dataframe for the device: all the fields, or the fields changed from base (delta)."""
+        if health.delta:
+            return encode_delta_frame(values, base, seq, framing=health.framing, fec=health.fec)
+        return encode_frame(values, seq, framing=health.framing, fec=health.fec)
+
+
+    def _transfer(self, adr, frame):
+        """Writes the dataframe and reads the device return; None in case of I2C error."""
+        try:
+            with self._bus_lock:
+                self.transport.write(adr, frame)
+                return self.transport.read(adr, 1)[0]
+        except OSError as e:
+            if self.printout:
+                print(f"I2C error on address {hex(adr)}: {e}")
+            return None
+
+
+    def _backoff_s(self, attempt):
+        # exponential backoff, with some jitter to not retry in lockstep with other traffic
+        wait_s = min(self.backoff_base_s * (2 ** (attempt - 1)), self.backoff_max_s)
+        return wait_s * random.uniform(0.5, 1.0)
+
+
+    def _status(self, health, reply):
+        """Returns the status out of the status byte: with credits, the free slots are stored in health.slots."""
+        if reply is None or not health.credits:
+            return reply
+        health.slots = reply >> CREDITS_SHIFT
+        return reply & STATUS_MASK
+
+
+    def _read(self, health, n=1):
+        """Reads the first n bytes of the reply page, the status byte without credits; None in case of I2C error."""
+        try:
+            with self._bus_lock:
+                reply = bytearray(self.transport.read(health.adr, n))
+        except OSError as e:
+            if self.printout:
+                print(f"I2C error on address {hex(health.adr)}: {e}")
+            return None
+        reply[0] = self._status(health, reply[0])
+        return reply
+
+
+    def _poll_busy(self, health, n=1):
+        """
+        Reads the reply page again (the dataframe is not sent again) while the device returns 3 (busy),
+        up to max_busy_polls times. Returns the last reply, None in case of I2C error or without polls.
+        """
+        reply = None
+        for poll in range(1, self.max_busy_polls + 1):
+            health.busy += 1
+            time.sleep(self._backoff_s(poll))
+            reply = self._read(health, n)
+            if reply is None or reply[0] != BUSY:
+                break
+        return reply
+
+
+    def _exchange(self, health, frame):
+        """Writes the dataframe and returns the device status, reading it again while the device is busy."""
+        device_return = self._status(health, self._transfer(health.adr, frame))
+        if device_return == BUSY and self.max_busy_polls:
+            reply = self._poll_busy(health)
+            device_return = None if reply is None else reply[0]
+        return device_return
+
+
+    def _wait_slots(self, health):
+        """
+        With credits, reads the status of a device reporting no free slots, until it reports one (up to
+        max_busy_polls times). Returns True when the device has a free slot.
+        """
+        for poll in range(1, self.max_busy_polls + 1):
+            if health.slots != 0:
+                return True
+            health.stalls += 1
+            time.sleep(self._backoff_s(poll))
+            if self._read(health) is None:
+                return False
+        return health.slots != 0
+
+
+    def _send_device(self, health, values, frame=None):
+        """
+        Sends the dataframe, and inquires the device, until the device returns 1 or the retries are exhausted.
+        Without the sequence byte, a retry might apply the same dataframe twice at the Responder: this is
+        harmless for fields carrying values, but not for fields carrying commands.
+        Returns the last device return (1 = ok, 0 = checksum error, 2 = dataframe length error, 3 = busy,
+        None = I2C error).
+        """
+        seq = health.seq if self.sequence else None
+        keyframe = None
+        if frame is None:
+            frame = self._encode(health, values, seq, health.base)
+            if health.delta and health.base is not None:
+                keyframe = self._encode(health, values, seq)   # retries send all the fields
+        health.seq = (health.seq + 1) & 0xFF
+        health.sent += 1
+        health.broadcast = None                 # a later dataframe supersedes the broadcast one
+        return self._deliver(health, frame, values, keyframe=keyframe)
+
+
+    def _deliver(self, health, frame, values, resend=False, keyframe=None):
+        """
+        Writes the dataframe to the device, until the device returns 1 or the retries are exhausted.
+        With resend, the dataframe has already been sent once (broadcast), and every attempt is a retry.
+        With keyframe, the retries send the keyframe instead (the device might miss the base values).
+        The values become the base of the changed-fields dataframes when acknowledged.
+        A device still busy after max_busy_polls status reads has the dataframe, not decoded yet: it's not written
+        again (it would be a duplicate), and it's not a failure (a slow device doesn't trip the circuit breaker).
+        """
+        health.base = None                      # no base until the dataframe is acknowledged
+        device_return = None
+        for attempt in range(1 + self.max_retries):
+            if attempt or resend:               # case of retry
+                health.retries += 1
+            if attempt:
+                time.sleep(self._backoff_s(attempt))
+            if health.slots == 0 and not self._wait_slots(health):  # case the device has no free slot (credits)
+                health.slots = None             # after max_busy_polls the dataframe is written anyway
+            health.tx_bytes += len(frame)
+            device_return = self._exchange(health, frame)
+            if device_return == 1:
+                health.record_success()
+                health.base = list(values)
+                return device_return
+            if device_return == BUSY:           # case of dataframe not decoded yet: not delivered, not failed
+                return device_return
+            health.record_return(device_return)
+            if keyframe is not None:
+                frame = keyframe
+            if health.state == 'half-open':     # a trial dataframe is not retried
+                break
+        health.record_failure()
+        return device_return
+
+
+    def send(self, values, dev=None):
+        """
+        Sends a dataframe with the values (16bits fields) to the device dev.
+        When dev is None, the dataframe is sent to all the devices not skipped, and
+        a dict with the device returns is returned; otherwise the device return.
+        """
+        if dev is not None:
+            return self._send_device(self.devices[dev], values)
+        # without sequence byte, the same dataframe is encoded once per framing (and fec) for all the devices
+        frames = {}
+        device_returns = {}
+        for dev, health in self.devices.items():
+            if not health.available():
+                continue
+            frame = None
+            if not self.sequence and not health.delta:
+                frame = frames.get((health.framing, health.fec))
+                if frame is None:
+                    frame = frames[(health.framing, health.fec)] = encode_frame(values, framing=health.framing,
+                                                                               fec=health.fec)
+            device_returns[dev] = self._send_device(health, values, frame)
+        return device_returns
+
+
+    def _broadcast_seq(self, healths):
+        """Sequence byte ahead of (or equal to) the next one of every device, so that no device drops it."""
+        seq = healths[0].seq
+        for health in healths[1:]:
+            if (health.seq - seq) & 0xFF < 0x80:  # case this device is ahead
+                seq = health.seq
+        return seq
+
+
+    def broadcast(self, values):
+        """
+        Sends a dataframe with the values (16bits fields) to all the devices in one transaction, via
+        the general call address: the bus time doesn't grow with the number of devices.
+        The devices are not inquired: collect_acks() confirms the dataframe later, and sends it again to
+        the devices that missed it. With the sequence byte, all the devices get the same sequence (the
+        ones behind count a gap); without it, a device that missed the whole dataframe can't be detected.
+        The dataframe has the Controller framing and fec: devices with other ones get it at collect_acks().
+        Returns True when the dataframe has been acknowledged (by at least one device), False otherwise.
+        """
+        healths = [health for health in self.devices.values() if health.available()]
+        if not healths:
+            return False
+        seq = self._broadcast_seq(healths) if self.sequence else None
+        if self.delta:                          # the devices have different base values: keyframe
+            frame = encode_delta_frame(values, None, seq, framing=self.framing, fec=self.fec)
+        else:
+            frame = encode_frame(values, seq, framing=self.framing, fec=self.fec)
+        self.broadcasts += 1
+        for health in healths:
+            if health.slots == 0 and not self._wait_slots(health):  # case the device has no free slot (credits)
+                health.slots = None             # after max_busy_polls the dataframe is written anyway
+        try:
+            with self._bus_lock:
+                self.transport.write(GENERAL_CALL_ADDRESS, bytes((BROADCAST_COMMAND,)) + frame)
+            acked = True
+        except OSError as e:
+            if self.printout:
+                print(f"I2C error on the general call: {e}")
+            self.broadcast_errors += 1
+            acked = False
+        for health in healths:
+            health.seq = ((seq if self.sequence else health.seq) + 1) & 0xFF
+            health.sent += 1
+            health.tx_bytes += len(frame)
+            health.broadcast = (values, seq)
+            health.base = None                  # until the broadcast is confirmed
+        return acked
+
+
+    def collect_acks(self):
+        """
+        Inquires the devices with a pending broadcast dataframe (only the last one is kept, as it
+        supersedes the previous ones): a device that didn't apply it gets the dataframe individually.
+        Returns a dict with the device returns, as send().
+        """
+        device_returns = {}
+        for dev, health in self.devices.items():
+            if health.broadcast is None or not health.available():
+                continue
+            values, seq = health.broadcast
+            health.broadcast = None
+            n = 2 if self.sequence else 1
+            reply = self._read(health, n)
+            if reply is not None and reply[0] == BUSY and self.max_busy_polls:
+                reply = self._poll_busy(health, n)
+            if reply is not None and reply[0] == 1 and (seq is None or reply[1] == seq):
+                health.record_success()
+                health.base = list(values)
+                device_returns[dev] = 1
+            else:                               # the broadcast dataframe is sent again to this device only
+                if reply is not None:
+                    health.record_return(reply[0])
+                frame = self._encode(health, values, seq)
+                device_returns[dev] = self._deliver(health, frame, values, resend=True)
+        return device_returns
+
+
+    def read_caps(self, dev):
+        """
+        Reads the reply page of the device, and returns its capabilities (see frame_codec.parse_caps):
+        None when the device doesn't report them, or in case of I2C error.
+        """
+        health = self.devices[dev]
+        try:
+            with self._bus_lock:
+                reply = self.transport.read(health.adr, REPLY_LEN)
+        except OSError as e:
+            print(f"I2C error on device {dev}: {e}")
+            return None
+        health.caps = parse_caps(reply)
+        return health.caps
+
+
+    def command(self, dev, opcode, args=b''):
+        """
+        Sends a command dataframe (opcode and arguments) to the device, with its current framing and fec.
+        Returns the device return (1 when applied, 2 when not supported, None in case of I2C error).
+        """
+        health = self.devices[dev]
+        return self._exchange(health, encode_command(opcode, args, health.framing, health.fec))
+
+
+    def set_fields(self, dev, values, first=0):
+        """Sets the fields of the device from the first one (OP_SET_FIELDS), keeping the others."""
+        args = bytearray((first, len(values)))
+        for value in values:
+            args.append((value >> 8) & 0xFF)
+            args.append(value & 0xFF)
+        device_return = self.command(dev, OP_SET_FIELDS, args)
+        self.devices[dev].base = None           # changed-fields dataframes restart from a keyframe
+        return device_return
+
+
+    def send_bulk(self, dev, stream, data):
+        """Sends up to BULK_LEN bytes of a logical stream to the device (OP_BULK), for its core0."""
+        if len(data) > BULK_LEN:
+            raise ValueError(f"Max {BULK_LEN} bytes per bulk command")
+        return self.command(dev, OP_BULK, bytes((stream, len(data))) + bytes(data))
+
+
+    def read_counters(self, dev):
+        """
+        Reads the statistics page of the device (OP_READ_STATS, then the reply page), see frame_codec.parse_stats:
+        applied dataframes, checksum and length errors, commands, FEC corrections. None when not supported, or in case of
+        I2C error.
+        The statistics page is returned by the read following the command only (the status byte is part of it).
+        """
+        health = self.devices[dev]
+        try:
+            with self._bus_lock:
+                self.transport.write(health.adr, encode_command(OP_READ_STATS, framing=health.framing, fec=health.fec))
+                reply = self.transport.read(health.adr, REPLY_LEN)
+        except OSError as e:
+            print(f"I2C error on device {dev}: {e}")
+            return None
+        return parse_stats(reply) if self._status(health, reply[0]) == 1 else None
+
+
+    def reset_counters(self, dev):
+        """Restarts the sequence tracking and the counters of the device (OP_RESET)."""
+        return self.command(dev, OP_RESET)
+
+
+    def configure(self, dev, framing=None, delta=None, fec=None, credits=None):
+        """
+        Configures the device to the Controller fields and sequence usage, with the framing, delta, fec and credits
+        flags (None keeps the current ones): the command dataframe is sent with the current framing and fec of the
+        device, while its status byte already follows the new credits flag.
+        Returns the device return (1 when applied, 2 when not supported, None in case of I2C error).
+        """
+        health = self.devices[dev]
+        framing = framing or health.framing
+        delta = health.delta if delta is None else delta
+        fec = health.fec if fec is None else fec
+        credits = health.credits if credits is None else credits
+        mode = mode_bits(self.sequence, framing, delta, fec, credits)
+        was_credits = health.credits
+        health.credits = credits                # the reply to the command is in the new mode
+        health.slots = None
+        device_return = self.command(dev, OP_CONFIG, (self.df_fields, mode))
+        if device_return != 1:
+            health.credits = was_credits        # the device kept its mode
+            health.slots = None
+        else:
+            health.framing = framing
+            health.delta = delta
+            health.fec = fec
+            health.base = None                  # the device starts from a keyframe
+            if health.caps is not None:
+                health.caps['fields'] = self.df_fields
+                health.caps['mode'] = mode
+        return device_return
+
+
+    def negotiate(self, framing=None, delta=None, fec=None, credits=None):
+        """
+        Reads the capabilities of the devices, and configures each one to the Controller fields and sequence
+        usage, with the best framing and delta flag both sides support. When framing or delta is None, the
+        smallest dataframes are preferred: COBS (bounded size) and changed-fields dataframes.
+        The parity bytes (fec) cost two bytes per dataframe: when fec is None, the Controller flag is used.
+        The credits (when credits is None, the Controller flag is used) are enabled only for the devices
+        reporting them, with a receive buffer holding at least one dataframe.
+        Devices without capabilities keep their manual configuration.
+        Returns a dict device -> capabilities (None when not reported).
+        """
+        results = {}
+        for dev, health in self.devices.items():
+            caps = self.read_caps(dev)
+            results[dev] = caps
+            if caps is None:
+                print(f"Device {dev}: no capabilities, manual configuration kept")
+                continue
+            if self.df_fields > caps['max_fields'] or (self.sequence and not caps['modes'] & MODE_SEQUENCE):
+                print(f"Device {dev}: {self.df_fields} fields, sequence {self.sequence} not supported")
+                continue
+            cobs = caps['modes'] & MODE_COBS and (framing is None or framing == COBS_FRAMING)
+            want_framing = COBS_FRAMING if cobs else ESCAPE_FRAMING
+            want_delta = bool(caps['modes'] & MODE_DELTA) and delta is not False
+            want_fec = bool(caps['modes'] & MODE_FEC) and (self.fec if fec is None else fec)
+            # credits only when the receive buffer of the device holds a dataframe slot (0 slots forever otherwise)
+            want_credits = (bool(caps['modes'] & MODE_CREDITS) and (self.credits if credits is None else credits) and
+                            caps['rx_buffer'] >= slot_len(self.df_fields, self.sequence, want_framing, want_delta,
+                                                          want_fec))
+            # current framing of the device, for the command dataframe
+            _, health.framing, health.delta, health.fec, health.credits = parse_mode(caps['mode'])
+            mode = mode_bits(self.sequence, want_framing, want_delta, want_fec, want_credits)
+            if caps['fields'] == self.df_fields and caps['mode'] == mode:
+                device_return = 1               # already configured
+            else:
+                device_return = self.configure(dev, want_framing, want_delta, want_fec, want_credits)
+            if self.printout or device_return != 1:
+                print(f"Device {dev}: protocol v{caps['version']}, {self.df_fields} fields, framing {health.framing}, "
+                      f"delta {health.delta}, fec {health.fec}, credits {health.credits}" +
+                      ("" if device_return == 1 else f" (configuration failed: {device_return})"))
+        return results
+
+
+    def send_many(self, frames, dev=None):
+        """Sends a list of dataframes (lists of values), returning the list of send() results."""
+        return [self.send(values, dev) for values in frames]
+
+
+    def read_stats(self, dev):
+        """Reads the status byte followed by the Responder sequence and bus recoveries counters."""
+        health = self.devices[dev]
+        try:
+            with self._bus_lock:
+                reply = bytearray(self.transport.read(health.adr, 6))
+        except OSError as e:
+            print(f"I2C error on device {dev}: {e}")
+            return None
+        reply[0] = self._status(health, reply[0])   # with credits, the free slots are in health.slots
+        keys = ('status', 'last_seq', 'duplicates', 'gaps', 'reorders', 'recoveries')
+        return dict(zip(keys, reply))
+
+
+    def stats(self):
+        """Returns the statistics of each device."""
+        return {dev: health.summary() for dev, health in self.devices.items()}
+
+
+    def broadcast_stats(self):
+        """Returns the broadcast counters."""
+        return {'broadcasts': self.broadcasts, 'broadcast_errors': self.broadcast_errors}
+
+
+    def reprobe(self):
+        """Re-probes the skipped devices, once their cooldown time has elapsed."""
+        for health in self.devices.values():
+            if not health.reprobe_due():
+                continue
+            try:
+                with self._bus_lock:
+                    self.transport.read(health.adr, 1)  # any reply means the device is back on the bus
+                replied = True
+            except OSError:
+                replied = False
+            health.record_probe(replied)
+            if replied:
+                print(f"Device {health.dev} replied to re-probe")
+
+
+    def _reprobe_loop(self, interval_s):
+        while self._reprobe_run:
+            time.sleep(interval_s)
+            self.reprobe()
+
+
+    def start_reprobe(self, interval_s=0.25):
+        """Starts the background thread re-probing the skipped devices."""
+        if not self._reprobe_run:
+            self._reprobe_run = True
+            _thread.start_new_thread(self._reprobe_loop, (interval_s,))
+
+
+    def post(self, values, dev=None, event=False):
+        """
+        Queues the values (16bits fields) for the device dev, or for all the devices when dev is None.
+        State values replace the ones not sent yet, event values (event=True) are queued in order.
+        It doesn't wait for the bus: the sender thread (start_sender) sends the queued values.
+        """
+        healths = self.devices.values() if dev is None else (self.devices[dev],)
+        for health in healths:
+            health.queue.put(values, event)
+
+
+    def _sender_loop(self, idle_s):
+        while self._sender_run:
+            busy = False
+            for health in list(self.devices.values()):
+                if not health.available():      # values wait for the device to be back
+                    continue
+                if health.slots == 0 and health.queue.depth():  # case the device had no free slot (credits)
+                    self._read(health)          # the status is read once per round, the other devices are not held
+                    if health.slots == 0 and health.slot_rounds < self.max_busy_polls:
+                        health.slot_rounds += 1
+                        health.stalls += 1      # values wait for the next round
+                        continue
+                    if health.slots == 0:       # after max_busy_polls rounds, the values are written anyway
+                        health.slots = None
+                health.slot_rounds = 0
+                item = health.queue.get()
+                if item is None:
+                    continue
+                busy = True
+                values, event = item
+                device_return = self._send_device(health, values)
+                if device_return != 1 and device_return != BUSY:   # busy: the device has the values
+                    health.queue.failed += 1
+                    if not event:
+                        health.queue.restore(values)
+            if not busy:
+                time.sleep(idle_s)
+
+
+    def start_sender(self, idle_s=0.001):
+        """Starts the background thread sending the values queued via post(), one per device in turn."""
+        if not self._sender_run:
+            self._sender_run = True
+            _thread.start_new_thread(self._sender_loop, (idle_s,))
+
+
+    def queue_stats(self):
+        """Returns the outbound queue metrics of each device (depth, coalesced and dropped values, ...)."""
+        return {dev: health.queue.summary() for dev, health in self.devices.items()}
+
+
+    def stop(self):
+        """Stops the re-probe and sender threads, and closes the transport."""
+        self._reprobe_run = False
+        self._sender_run = False
+        self.transport.close()
+
+
+    def measure(self, frames=200):
+        """
+        Sends a burst of escape-heavy dataframes (no retries) to each available device, measuring the error
+        rate and the time per transaction exceeding the bits on the wire (clock stretching and software overhead).
+        Returns (error_rate, overhead_us).
+        """
+        speed = self.transport.speed or 100000
+        sent = 0
+        errors = 0
+        wire_bytes = 0
+        busy_us = 0
+        for _ in range(frames):
+            # fields made of STX, ETX and escape bytes: every byte in the dataframe gets escaped
+            values = [random.choice((0x0203, 0x0302, 0x5C5C, 0x025C, 0x5C03)) for _ in range(self.df_fields)]
+            for health in self.devices.values():
+                if not health.available():
+                    continue
+                frame = self._encode(health, values, health.seq if self.sequence else None)
+                health.seq = (health.seq + 1) & 0xFF
+                health.base = None              # the measurement keyframes don't update the base
+                t_ref = ticks_us()
+                device_return = self._exchange(health, frame)
+                busy_us += ticks_diff(ticks_us(), t_ref)
+                sent += 1
+                if device_return != 1:
+                    errors += 1
+                wire_bytes += len(frame) + 3    # dataframe, plus write address, read address and reply
+        if not sent:
+            return 1, 0
+        wire_us = wire_bytes * 9 * 1000000 // speed   # 9 clocks per byte (8 bits and ack)
+        return errors / sent, max(0, busy_us - wire_us) // sent
+
+
+    def calibrate(self, speeds=(100000, 400000, 1000000), frames=200, max_error_rate=0.01):
+        """
+        Measures each bus speed, and applies the fastest one with error rate within max_error_rate.
+        When the transport can't change the speed (i.e. Raspberry Pi), only the current speed is measured,
+        and the recommended speed is returned.
+        Returns (recommended speed, dict speed -> (error_rate, overhead_us)).
+        """
+        results = {}
+        if not self.transport.can_set_speed:
+            speed = self.transport.speed or speeds[0]
+            results[speed] = self.measure(frames)
+            print(f"  {speed} Hz: error rate {results[speed][0]:.4f}, overhead {results[speed][1]} us per transaction")
+            faster = [s for s in speeds if s > speed]
+            slower = [s for s in speeds if s < speed]
+            if results[speed][0] <= max_error_rate:
+                return (faster[0] if faster else speed), results
+            return (slower[-1] if slower else speed), results
+
+        for speed in speeds:
+            self.transport.set_speed(speed)
+            results[speed] = self.measure(frames)
+            print(f"  {speed} Hz: error rate {results[speed][0]:.4f}, overhead {results[speed][1]} us per transaction")
+        reliable = [speed for speed, (error_rate, _) in results.items() if error_rate <= max_error_rate]
+        best = max(reliable) if reliable else min(speeds)
+        self.transport.set_speed(best)
+        return best, results
@@ -5,11 +5,28 @@ Micropython code for Raspberry Pi Pico (RP2040 and RP2350).
 
 This Class:
 - gets instantiated in core1 of the Pico.
-- it uses mem16 DMA for inter-cores communication.
+- it uses mem16 DMA for inter-cores communication (shared_variables registry).
 - it keeps checking for I2C arrival.
-- every new 8bits received are added to previous and checked if completing a dataframe.
-- dataframe is analyzed for STX, 16bits field(s), escape characters, checksum and ETX.
-- when data is requested, 8 bits are returned: 1 (ok) or 0 (checksum error) or 2 (dataframe uncomplete).
+- every new 8bits received are fed to the dataframe decoder (frame_codec), completing a dataframe at ETX (or delimiter).
+- the receive, decode and publish path runs on preallocated buffers, without heap allocations (alloc_check).
+- dataframe is analyzed for STX, 16bits field(s), escape characters, checksum and ETX (shared codec with the Controller).
+- alternatively, the dataframes are COBS framed (0x00 delimiter, fixed overhead), as set at the Controller.
+- optionally, the dataframes carry only the changed fields (bitmask), applied to the last values (keyframes carry all).
+- optionally, the dataframes carry two Reed-Solomon parity bytes (FEC): a corrupted byte is corrected in place (counted).
+- command dataframes (fixed length) carry an opcode, executed via a dispatch table: protocol configuration,
+  set fields, statistics page, counters reset and bulk bytes of logical streams (for core0).
+- when data is requested, 8 bits are returned: 1 (ok) or 0 (checksum error) or 2 (dataframe uncomplete),
+  or 3 (busy) when the core pipeline doesn't reply in time.
+- optionally, the status byte carries the free dataframe slots of the receive buffer (credits), pacing the Controller.
+- optionally, the dataframe carries a sequence byte: duplicates are dropped, gaps and reorders are counted.
+- further requested bytes (multi-byte read) return the last sequence and the sequence counters.
+- while idle, a bus watchdog re-initializes the I2C block when the bus is stuck (recoveries are counted).
+- the Responder backend is the I2C block (i2c_responder), or two PIO state machines (pio_responder).
+- optionally, the dataframes written to the general call address (broadcast) are accepted too.
+- optionally, the received bytes are streamed by a DMA channel into a ring buffer (i2c_rx_dma).
+- optionally, core0 is notified via the SIO FIFO after each applied dataframe (core_fifo).
+- optionally, core1 only drains the I2C into a ring, and run() decodes and publishes on core0 (core_pipeline).
+- events are stored in the deferred debug log (debug_log), printed by core0 without slowing down core1.
 
 
 
@@ -38,11 +55,22 @@ SOFTWARE.
 
 
 from shared_variables import shared_variables
-from i2c_responder import I2CResponder
+from frame_codec import (make_decoder, delta_payload_len, mode_bits, parse_mode, SequenceTracker, OK, INCOMPLETE, KEYFRAME,
+                         COMMAND, COMMAND_LEN, COMMAND_ARGS, OP_CONFIG, OP_SET_FIELDS, OP_READ_STATS, OP_RESET, OP_BULK,
+                         BULK_LEN, PROTOCOL_VERSION, MAX_FIELDS, CAPS_MARK, STATS_MARK, CAPS_IDX, REPLY_LEN,
+                         MODE_SEQUENCE, MODE_COBS, MODE_DELTA, MODE_FEC, MODE_CREDITS, STATUS_MASK, CREDITS_SHIFT,
+                         MAX_CREDITS, slot_len)
+from core_fifo import CoreFifo, make_descriptor, EV_FRAME, EV_BULK
+from debug_log import (debug_log, EV_DATA, EV_CHECKSUM_ERROR, EV_INCOMPLETE, EV_DROPPED_SEQ, EV_NO_DATA, EV_RECOVERY,
+                       EV_BOOT, EV_CONFIG, EV_COMMAND, EV_FEC)
+import time
 
 class I2CHandler:
     
-    def __init__(self,  rp='RP2040', i2c_id=0x41, fields=1, led_type='led', printout=False):
+    WATCHDOG_LOOPS = 256                               # idle loops in between two bus watchdog checks
+    SUPPORTED_MODES = MODE_SEQUENCE | MODE_COBS | MODE_DELTA | MODE_FEC | MODE_CREDITS  # mode bits reported as capabilities
+    
+    def __init__(self,  rp='RP2040', i2c_id=0x41, fields=1, led_type='led', sequence=False, framing='escape', delta=False, fec=False, credits=False, bus_speed=None, notify=False, rx_dma=False, backend='i2c', general_call=False, pipeline=False, on_descriptor=None, responder=None, printout=False):
         print("Uploading i2c_handler ...")
         print("i2c_address:", hex(i2c_id))
         
@@ -51,13 +79,98 @@ class I2CHandler:
         scl_pin = shared_variables.I2C0_SCL_PIN
         
         # instantiate the I2C responder
-        self.s_i2c = I2CResponder(rp = rp, i2c_device_id=0, sda_gpio=sda_pin, scl_gpio=scl_pin, responder_address=i2c_id)
+        if responder is not None:                      # case of a Responder object given (i.e. alloc_check simulator)
+            self.s_i2c = responder                     # the given object is used as Responder
+            backend = type(responder).__name__         # backend name for the feedback
+        elif backend == 'pio':                           # case the Responder runs on PIO state machines
+            if rx_dma:                                 # case DMA capture is requested
+                raise ValueError("rx_dma needs the I2C block backend")
+            from pio_responder import PIOResponder     # import the PIO Responder Class
+            self.s_i2c = PIOResponder(sm_id=0, sda_gpio=sda_pin, scl_gpio=scl_pin, responder_address=i2c_id, rp=rp,
+                                      general_call=general_call)
+        else:                                          # case the Responder runs on the I2C block
+            from i2c_responder import I2CResponder     # import the I2C block Responder Class
+            self.s_i2c = I2CResponder(rp = rp, i2c_device_id=0, sda_gpio=sda_pin, scl_gpio=scl_pin, responder_address=i2c_id,
+                                      bus_speed=bus_speed, general_call=general_call)
+        self.ready_ms = time.ticks_ms()                # time since reset, when the Responder can ACK
+        self.first_byte_ms = None                      # time since reset, of the first received (ACKed) byte
+        print(f"Responder backend: {backend}")         # feedback is printed to the terminal
+        print(f"General call (broadcast): {general_call}")  # feedback is printed to the terminal
         
-        # number of data fields per I2C exchange
-        self.df_fields = fields                        # number of (16bits) fields per dataframe (max 4)
-        print(f"Number of fields: {self.df_fields}") # feedback is printed to the terminal
-        self.max_buffer = 2 + 4 * self.df_fields       # max buffer size
-        self.raw_data = bytearray()                    # bytearray storing bytes arriving at the i2C
+        # source of the received bytes: the DMA ring (optional), or the I2C Rx FIFO
+        if rx_dma and responder is None:               # case the received bytes are captured via DMA
+            from i2c_rx_dma import I2CRxDma            # import the DMA capture Class
+            self.rx_dma = I2CRxDma(self.s_i2c, rp=rp)  # DMA channel streaming the Rx FIFO into a ring
+            self.rx = self.rx_dma                      # bytes are read from the ring
+        else:                                          # case the received bytes are read from the Rx FIFO
+            self.rx_dma = None                         # no DMA capture
+            self.rx = self.s_i2c                       # bytes are read from the Rx FIFO
+        print(f"Rx DMA capture: {self.rx_dma is not None}")  # feedback is printed to the terminal
+        
+        # optional two stages pipeline: core1 only drains the I2C into a ring, run() decodes on core0
+        self.pipeline = None                           # None when run() reads the Responder directly
+        if pipeline:                                   # case of decoding on core0
+            from core_pipeline import CorePipeline     # import the pipeline Class
+            self.pipeline = CorePipeline(self.s_i2c, self.rx, self.rx_dma)  # core1 runs self.pipeline.drain()
+            self.s_i2c = self.rx = self.pipeline       # run() reads the bytes and read requests from the ring
+            self.rx_dma = None                         # DMA channel re-armed by core1 (drain)
+        print(f"Core pipeline: {pipeline}")            # feedback is printed to the terminal
+        
+        # receive buffer: only the sources buffering the received bytes (PIO, DMA or pipeline ring) report their free
+        # bytes, and support the credits; the Rx FIFO is drained continuously, so its free bytes mean nothing
+        self.rx_buffer = getattr(self.rx, 'rx_buffer_size', 16)  # received bytes held by the Rx FIFO or the ring
+        self.rx_free = getattr(self.rx, 'rx_free', None)  # bound method returning the free bytes, None when not available
+        self.supported_modes = self.SUPPORTED_MODES    # mode bits reported as capabilities, for this source
+        if self.rx_free is None:                       # case of Rx FIFO: no credits
+            self.supported_modes &= ~MODE_CREDITS
+        if credits and not self._credits_usable(fields, sequence, framing, delta, fec):
+            print("Credits not supported by the receive buffer: disabled")  # feedback is printed to the terminal
+            credits = False
+        
+        # protocol: fields, sequence byte, framing and changed-fields dataframes (reconfigurable by the Controller)
+        self.status = INCOMPLETE                       # status of the last received byte (0, 1 or 2)
+        self.delta_mask = 0                            # bitmask of the last validated changed-fields dataframe
+        self.reconfigured = False                      # True after a configuration command, until run() reloads it
+        self._set_protocol(fields, sequence, framing, delta, fec, credits)  # decoder and fields buffer
+        print(f"Number of fields: {self.df_fields}")   # feedback is printed to the terminal
+        print(f"Sequence byte: {self.sequence}")       # feedback is printed to the terminal
+        print(f"Framing: {self.framing}")              # feedback is printed to the terminal
+        print(f"Changed-fields dataframes: {self.delta}")  # feedback is printed to the terminal
+        print(f"Forward error correction: {self.fec}")  # feedback is printed to the terminal
+        print(f"Credits in the status byte: {self.credits}")  # feedback is printed to the terminal
+        
+        # sequence tracking
+        self.rx_seq = 0                                # sequence byte of the last validated dataframe
+        self.seq_tracker = SequenceTracker()           # duplicates, gaps and reorders detection
+        
+        # frame-ready notifications to core0, via the SIO FIFO
+        self.fifo = CoreFifo() if notify else None    # None when core0 doesn't wait for notifications
+        if self.pipeline is not None:                  # case run() is on core0: descriptors go to a callback
+            from core_pipeline import LocalFifo        # import the callback Class
+            self.fifo = LocalFifo(on_descriptor) if notify and on_descriptor is not None else None
+        self.frames = 0                                # validated and applied dataframes counter
+        self.recoveries_base = 0                       # bus recoveries at the last OP_RESET (counted by the Responder)
+        
+        # bytes returned to the Controller: status, last sequence, duplicates, gaps, reorders, recoveries,
+        # then the capabilities: mark, protocol version, max fields, supported modes, fields, mode, Rx buffer, max payload
+        # and two reserved bytes (or the statistics page, at the read following OP_READ_STATS)
+        self.reply = bytearray(REPLY_LEN)              # reply buffer, one byte per read request
+        self.reply_idx = 0                             # index of the next reply byte to be returned
+        self.page_request = CAPS_MARK                  # page of the next read: capabilities (CAPS_MARK) or statistics (STATS_MARK)
+        self._caps_page()                              # capabilities written to the reply page
+        
+        # counters of the statistics page
+        self.checksum_errors = 0                       # dataframes with wrong checksum
+        self.length_errors = 0                         # dataframes with wrong length (or missing keyframe)
+        self.executed = 0                              # commands applied
+        self.corrections = 0                           # corrupted bytes corrected via the FEC parity bytes
+        
+        # command dispatch table: opcode -> (method, argument bytes), bound methods allocated once
+        self.commands = {OP_CONFIG: (self._op_config, COMMAND_ARGS[OP_CONFIG]),
+                         OP_SET_FIELDS: (self._op_set_fields, COMMAND_ARGS[OP_SET_FIELDS]),
+                         OP_READ_STATS: (self._op_read_stats, COMMAND_ARGS[OP_READ_STATS]),
+                         OP_RESET: (self._op_reset, COMMAND_ARGS[OP_RESET]),
+                         OP_BULK: (self._op_bulk, COMMAND_ARGS[OP_BULK])}
         
         # library import for the onboard led
         if led_type == 'rgb_led':                      # case led == 'rgb_led'
@@ -69,148 +182,306 @@ class I2CHandler:
         self.led = led                                 # instance variable of the led object
             
 
-        self.printout = printout                       # instance printout
-    
-    
-
-    def calculate_checksum(self, data):
-        """ Returns the checksum of the received data, as module of 256."""
-        return sum(data) & 0xFF
+        self.printout = printout                       # instance printout (init feedback only, events go to debug_log)
+        self.log = debug_log.log                       # bound method of the deferred debug log
     
     
     
-    def _process_received_data(self, df_fields, max_buffer):
+    def _set_protocol(self, fields, sequence, framing, delta, fec=False, credits=False):
         """
-        Analyze the raw_data and return the clean_data.
-        This means finding the STX header character (0x02) and the 
-        the ETX terminator character (0x03).
-        The \ escape character (0x5c) :
-        - is used in front of the stx, etx when these are part of the data.
-        - is usedin front of the escape character itself, when nreppresenting a value
-        - it must be removed for proper data interpretation and checksum calculation.
+        Sets the number of fields, the sequence byte usage, the framing, the changed-fields dataframes, the FEC
+        and the credits: the decoder and the fields buffer are allocated (at init, or after a configuration command).
         """
+        self.df_fields = fields                        # number of (16bits) fields per dataframe (max 4)
+        self.sequence = sequence                       # flag for dataframes carrying a sequence byte, placed right after STX
+        self.seq_bytes = 1 if sequence else 0          # number of bytes used by the sequence
+        self.payload_len = self.seq_bytes + 2 * fields # bytes between STX and checksum (escapes excluded)
+        self.framing = framing                         # dataframe framing ('escape' or 'cobs')
         
-        raw_data = self.raw_data                       # local variable from instance variable
+        # optional changed-fields dataframes: bitmask byte (after the sequence), then the changed fields only
+        self.delta = delta                             # flag for changed-fields dataframes
+        self.keyed = False                             # True once a keyframe (all fields) has been applied
+        min_payload = None                             # fixed payload length, without changed-fields dataframes
+        if delta:                                      # case of changed-fields dataframes
+            min_payload, self.payload_len = delta_payload_len(fields, sequence)  # payload length range
         
-        if len(raw_data) < 2 + 2 * df_fields:          # case to little data
-            return [], False                           # returns empty data and False checksum
+        # streaming decoder of the bytes arriving at the I2C, also recognizing the command dataframes
+        self.fec = fec                                 # flag for dataframes carrying the Reed-Solomon parity bytes
+        self.decoder = make_decoder(self.payload_len, framing, min_payload=min_payload, command_len=COMMAND_LEN, fec=fec)
+        self.data = [0] * fields                       # fields of the last validated dataframe
         
-        data = []                                      # empty list to store the arriving bits
-        checksum_result = False                        # checksum_result is initially set False
-        start = None                                   # start is the STX index in raw_data, initially set on None
-        i = 0                                          # iterator index
-        while i < len(raw_data):                       # iterating though the raw_data
-            byte = raw_data[i]                         # byte at the i index position
-            prev_byte = raw_data[i - 1] if i > 0 else None  # byte in previous index position
-            if byte == 0x02 and prev_byte != 0x5C:     # case the byte equals to stx and not escape in front
-                start = i                              # dataframe-start index (STX index location in raw_data)
-            elif byte == 0x03 and start is not None:   # case the byte equals to ETX and STX not None
-                is_escaped = prev_byte == 0x5C         # bool of previous byte being an escape character
-                double_escape = is_escaped and i > 1 and raw_data[i - 2] == 0x5C # bool of prev two bytes == escape character
-                
-                if not is_escaped or double_escape:    # case index i is not following 1 or 2 escapes
-                    stop = i                           # dataframe-end index (ETX index location in raw_data)
-                    if i == len(raw_data) - 2 and raw_data[i + 1] == 0x03: # case EXT is followed by a second ETX
-                        stop += 1                      # dataframe-end index takes the second ETX
-                    if stop > start + 2 * df_fields:   # case dataframe has enough data
-                        clean_data = self._escapes_removal(raw_data, start, stop) # removing escape characters
-                        data, checksum_result = self._validate_data(clean_data, df_fields)   # validating data
-                        break                          # end of the while loop
-            i += 1                                     # move to next byte index
-        return data, checksum_result                   # interpreted data and checksum result are returned
-    
-    
-    
-    
-    def _escapes_removal(self, raw_data, start, stop):
+        # optional credits: free dataframe slots in the status byte, a slot being the longest dataframe on the wire
+        self.credits = credits                         # flag for the free slots in the status byte
+        self.frame_bytes = slot_len(fields, sequence, framing, delta, fec)  # bytes of a slot
+        shared_variables.df_fields.write(fields)       # configuration shared with core0
+        shared_variables.mode.write(mode_bits(sequence, framing, delta, fec, credits))
+    
+    
+    
+    def _credits_usable(self, fields, sequence, framing, delta, fec):
+        """Returns True when the source reports its free bytes, and the receive buffer holds at least one slot."""
+        return bool(self.supported_modes & MODE_CREDITS) and self.rx_buffer >= slot_len(fields, sequence, framing,
+                                                                                          delta, fec)
+    
+    
+    
+    def _caps_config(self):
+        """Writes the current fields and mode bits to the capabilities of the reply page."""
+        self.reply[CAPS_IDX + 4] = self.df_fields      # fields per dataframe
+        self.reply[CAPS_IDX + 5] = mode_bits(self.sequence, self.framing, self.delta, self.fec, self.credits)  # mode bits
+    
+    
+    
+    def _caps_page(self):
+        """Writes the capabilities to the reply page, after the status and counters bytes."""
+        reply = self.reply                             # local variable from instance variable
+        rx_buffer = self.rx_buffer                     # received bytes held by the Rx FIFO or the ring
+        reply[CAPS_IDX:CAPS_IDX + 4] = bytes((CAPS_MARK, PROTOCOL_VERSION, MAX_FIELDS, self.supported_modes))
+        reply[CAPS_IDX + 6:REPLY_LEN] = bytes(((rx_buffer >> 8) & 0xFF, rx_buffer & 0xFF, self.decoder.max_payload, 0, 0, 0))
+        self._caps_config()                            # fields and mode bytes of the capabilities
+    
+    
+    
+    def _stats_page(self):
         """
-        Process data between STX and ETX, handling escape sequences.
-        The escape character is used in front of:
-            ETX (0x02, decimal 2)
-            STX (0x03, decimal 3)
-            Escape (0x5c, decimal 92).
-        """ 
-
-        clean_data = bytearray()                       # bytearray for dataframe purged from STX, ETX and escapes characters
-        escape_next = False                            # checksum_result is set False
-        
-        idx = start                                    # iteration start at the raw_data index where STX was found 
-        while idx <= stop:                             # iteration until raw_data index where ETX was found
-            byte = raw_data[idx]                       # byte at idx index location
-            if escape_next:                            # case escape_next is True
-                clean_data.append(byte)                # byte is appended to clean_data
-                escape_next = False                    # case escape_next is set False
-            
-            elif byte == 0x5C:                         # case of escape character at idx raw_data index location
-                if idx + 1 <= stop and raw_data[idx + 1] == 0x5C: # case escape is followed by another escape
-                    clean_data.append(0x5C)            # one escape is appended
-                    idx += 1                           # index is increased (to slip the second escape)
-                else:                                  # case escape is not followed by another escape
-                    escape_next = True                 # escape_next is set True (skip this escape)
-            else:                                      # case byte is not an escape
-                clean_data.append(byte)                # byte is appended to clean_data
-            idx += 1                                   # move to the next byte
-        return clean_data                              # return the clean_data
-        
+        Writes the statistics to the reply page: mark, frames (32 bits), checksum and length errors (16 bits),
+        commands (8 bits) and FEC corrections (16 bits).
+        """
+        reply = self.reply                             # local variable from instance variable
+        frames = self.frames                           # applied dataframes counter
+        reply[CAPS_IDX] = STATS_MARK                   # the statistics follow
+        reply[CAPS_IDX + 1] = (frames >> 24) & 0xFF
+        reply[CAPS_IDX + 2] = (frames >> 16) & 0xFF
+        reply[CAPS_IDX + 3] = (frames >> 8) & 0xFF
+        reply[CAPS_IDX + 4] = frames & 0xFF
+        reply[CAPS_IDX + 5] = (self.checksum_errors >> 8) & 0xFF
+        reply[CAPS_IDX + 6] = self.checksum_errors & 0xFF
+        reply[CAPS_IDX + 7] = (self.length_errors >> 8) & 0xFF
+        reply[CAPS_IDX + 8] = self.length_errors & 0xFF
+        reply[CAPS_IDX + 9] = self.executed & 0xFF
+        reply[CAPS_IDX + 10] = (self.corrections >> 8) & 0xFF
+        reply[CAPS_IDX + 11] = self.corrections & 0xFF
+    
     
     
-    def _validate_data(self, clean_data, df_fields):
+    def _command(self):
         """
-        The clean_data is a dataframe of bytes: STX + n * fields (2 bytes each) + checksum + ETX
-        The n fields are calculated from the relative bytes.
-        The checksum is retrieved from the clean_data.
-        The checksum is calculated (it refers to the STX + the n * fields, ETX is excluded).
-        The calculated checksum is confronted with the one received, and a boolean returned.
+        Executes the command dataframe in the decoder buffer: mark, opcode, arguments, zeros.
+        The opcode selects the method and the number of argument bytes at the dispatch table; the bytes
+        following the arguments must be zeros (an opcode unknown by this Responder is not executed).
+        Returns the status for the Controller: 1 when applied, 2 when not supported.
         """
-
-        data = []                                      # empty list storing interpreted data from dataframe
-        checksum_result = False                        # checksum_result is set False
-        
-        if len(clean_data) < 3 + 2 * df_fields:        # case clean_data has too little data
-            self.led.fast_flash_red(ticks=20)          # short flashing of red led
-            if self.printout:                          # case printout is True
-                print("Incomplete message:", list(self.raw_data), list(clean_data))  # feedback is printed to the terminal
-            return data, checksum_result               # return empty data and False checksum
-        
-        for i in range(0, 2 * df_fields, 2):           # iteration over the even byte 
-            value = (clean_data[i+1] << 8) | clean_data[i+2]  # generate a 16bit value out of 2 bytes
-            data.append(value)                         # interpreted value is appended
-        checksum = clean_data[-2]                      # received chacksum (8 bits) retrieved from clean_data
+        buf = self.decoder.buf                         # command payload: mark, opcode, arguments
+        opcode = buf[1]                                # command opcode
+        entry = self.commands.get(opcode)              # method and argument bytes, None when unknown
+        status = INCOMPLETE                            # status when the command is not supported
+        if entry is not None:                          # case of known opcode
+            method, args_len = entry
+            for i in range(2 + args_len, COMMAND_LEN): # bytes following the arguments
+                if buf[i]:                             # case of not zero byte (i.e. different command version)
+                    break
+            else:                                      # case the command has the expected length
+                status = method(buf)                   # command is executed
+        if status == OK:                               # case the command has been applied
+            self.executed += 1                         # commands counter is increased
+        if opcode != OP_CONFIG:                        # case of command other than configuration (logged by itself)
+            self.log(EV_COMMAND, status, opcode)       # event is logged (printed by core0)
+        return status
+    
+    
+    
+    def _op_config(self, buf):
+        """
+        OP_CONFIG: sets the fields and the mode bits (sequence, framing, delta, fec, credits).
+        The new configuration applies from the next dataframe: run() reloads it.
+        """
+        fields, mode = buf[2], buf[3]                  # arguments
+        status = INCOMPLETE                            # status when the configuration is not supported
+        sequence, framing, delta, fec, credits = parse_mode(mode)  # configuration out of the mode bits
+        if (1 <= fields <= MAX_FIELDS and not mode & ~self.supported_modes and
+                (not credits or self._credits_usable(fields, sequence, framing, delta, fec))):
+            self._set_protocol(fields, sequence, framing, delta, fec, credits)  # decoder and fields buffer
+            self.seq_tracker = SequenceTracker()       # sequence tracking restarts
+            self._caps_config()                        # capabilities updated
+            self.reconfigured = True                   # run() reloads its local variables
+            status = OK                                # command applied
+        self.log(EV_CONFIG, status, fields, mode)      # event is logged (printed by core0)
+        return status
+    
+    
+    
+    def _op_set_fields(self, buf):
+        """
+        OP_SET_FIELDS: sets count fields, starting from the first one, keeping the others.
+        The fields are shared with core0 as for a dataframe (changed-fields dataframes build on them).
+        """
+        first, count = buf[2], buf[3]                  # arguments, followed by the 16bits values
+        df_fields = self.df_fields                     # fields per dataframe
+        if count < 1 or first + count > df_fields:     # case of fields out of the dataframe ones
+            return INCOMPLETE
+        data = self.data                               # fields of the last validated dataframe
+        for i in range(count):
+            data[first + i] = (buf[4 + 2 * i] << 8) | buf[5 + 2 * i]
+        shared_variables.fields_lock.write(shared_variables.fields, data, df_fields)  # fields updated as a set
+        self.frames += 1                               # applied dataframes counter is increased
+        if self.fifo is not None:                      # case core0 waits for notifications
+            self.fifo.push(make_descriptor(EV_FRAME, df_fields, self.rx_seq, self.frames))  # core0 is notified
+        self.log(EV_DATA, df_fields, *data)            # event is logged
+        return OK
+    
+    
+    
+    def _op_read_stats(self, buf):
+        """OP_READ_STATS: the next read returns the statistics page, in place of the capabilities."""
+        self.page_request = STATS_MARK                 # page written at the next read request
+        return OK
+    
+    
+    
+    def _op_reset(self, buf):
+        """OP_RESET: the sequence tracking and the counters (shared ones included) restart from zero."""
+        self.seq_tracker = SequenceTracker()           # duplicates, gaps and reorders counters restart
+        self.rx_seq = 0                                # any sequence is accepted next
+        self.recoveries_base = self.s_i2c.recoveries   # bus recoveries counter restarts (owned by the Responder, or core1)
+        self.frames = 0                                # applied dataframes counter
+        self.checksum_errors = 0                       # statistics page counters
+        self.length_errors = 0
+        self.executed = 0
+        self.corrections = 0
+        for slot in (shared_variables.duplicates, shared_variables.gaps, shared_variables.reorders,
+                     shared_variables.recoveries):
+            slot.write(0)                              # counters shared with core0
+        return OK
+    
+    
+    
+    def _op_bulk(self, buf):
+        """OP_BULK: shares up to BULK_LEN bytes of a logical stream with core0 (notified via EV_BULK)."""
+        stream, count = buf[2], buf[3]                 # arguments, followed by the bytes
+        if count > BULK_LEN:                           # case of too many bytes
+            return INCOMPLETE
+        shared_variables.write_bulk(stream, buf[4:4 + count])  # bytes shared with core0
+        if self.fifo is not None:                      # case core0 waits for notifications
+            self.fifo.push(make_descriptor(EV_BULK, count, stream, self.executed))  # core0 is notified
+        return OK
+    
+    
+    
+    def _validate_data(self, status):
+        """
+        Called when the decoder completes a dataframe: STX + (sequence) + n * fields (2 bytes each) + checksum + ETX
+        The decoder has already removed the escape characters, and compared the checksum
+        (it refers to the STX + sequence + the n * fields, ETX is excluded).
+        In case of correct checksum, the n fields are calculated from the relative bytes,
+        the sequence byte (when used) is stored at self.rx_seq, and True is returned.
+        With changed-fields dataframes, the bitmask is checked against the length and stored (the fields are
+        applied after the sequence check); a dataframe other than a keyframe can't be applied before a keyframe.
+        """
+        if status == OK and self.delta:                # case of changed-fields dataframe, with correct checksum
+            decoder = self.decoder                     # local variable from instance variable
+            mask = decoder.delta_mask(self.seq_bytes, self.df_fields)  # bitmask, -1 when not matching the length
+            if mask < 0 or not (mask & KEYFRAME or self.keyed):  # case of wrong length, or of missing keyframe
+                self.status = INCOMPLETE               # the Controller sends the dataframe again, as keyframe
+                status = INCOMPLETE                    # handled as a dataframe with wrong length
+            else:                                      # case the dataframe can be applied
+                self.delta_mask = mask                 # bitmask stored, for the fields update
         
-        # case the checksum calculated on received (and interpreted) data equals the one received
-        if self.calculate_checksum(clean_data[:-2]) == checksum:
-            checksum_result = True                     # local flag is set True
+        if status == OK:                               # case the checksum is correct
+            decoder = self.decoder                     # local variable from instance variable
+            if not self.delta:                         # case of dataframe with all the fields
+                decoder.fields(self.data, self.seq_bytes, self.df_fields)  # 16bit values out of 2 bytes each
+            if self.sequence:                          # case dataframes carry the sequence byte
+                self.rx_seq = decoder.buf[0]           # sequence byte is stored
             self.led.fast_flash_blue(ticks=10)         # very short flashing of blue led
-         
-        # case the calculated checksum differs from the one received                                
-        else:
-            if self.printout:                          # case printout is True
-                print("Checksum error")                # feedback is printed to the terminal
-            self.led.fast_flash_red(ticks=20)          # short flashing of red led
+            return True                                # fields are ready to be applied
         
-        return data, checksum_result
+        if status == INCOMPLETE:                       # case the dataframe has the wrong length
+            self.length_errors += 1                    # statistics page counter
+            self.log(EV_INCOMPLETE, self.decoder.n)    # event is logged (printed by core0)
+        else:                                          # case the calculated checksum differs from the one received
+            self.checksum_errors += 1                  # statistics page counter
+            self.log(EV_CHECKSUM_ERROR)                # event is logged (printed by core0)
+        self.led.fast_flash_red(ticks=20)              # short flashing of red led
+        return False
     
     
     
-    def _read_i2c_data(self, byte, df_fields, max_buffer):
+    def _read_i2c_data(self, byte):
         """
-        Receives one byte at the time, and feeds the raw_data list.
-        For every byte received, it calls the function that checks if a complete dataframe is formed.
-        In case a correct dataframe is found, the led is shortly turned on/off.
+        Receives one byte at the time, and feeds the decoder.
+        The status is 2 (no data) until the byte completes a dataframe, then 1 or 0 (checksum result).
+        Returns True when a dataframe with correct checksum is completed.
         """
-        raw_data = self.raw_data                       # local variable from instace variable
-        data = []                                      # list to store the interpreted data
-        
-        raw_data.append(byte)                          # the recived byte is appended to the raw_data list
-        data, checksum_result = self._process_received_data(df_fields, max_buffer) # checks if a complete dataframe
-        
-        if checksum_result:                            # case of correct checksum
-            self.raw_data = bytearray()                # self.raw_data is 'cleaned'
-        else:                                          # case of incorrect checksum
-            if len(raw_data) > max_buffer:             # case of local raw_data is longher than max_buffer
-                self.raw_data = raw_data[1:]           # older byte sliced out, remaining assigned to instance variable
-        
-        return data, checksum_result                   # data and checksum fals are returned
+        status = self.decoder.feed(byte)               # byte is fed to the decoder
+        if status is None:                             # case the dataframe isn't complete
+            self.status = INCOMPLETE                   # no data (yet)
+            return False
+        if self.decoder.corrected >= 0 and (status == OK or status == COMMAND):  # case of byte corrected via FEC
+            self.corrections += 1                      # statistics page counter
+            self.log(EV_FEC, self.decoder.corrected)   # event is logged (printed by core0)
+        if status == COMMAND:                          # case of command dataframe (i.e. configuration)
+            self.status = self._command()              # command is executed
+            return False
+        self.status = status                           # status of the completed dataframe
+        return self._validate_data(status)             # dataframe is validated
+    
+    
+    
+    def _check_sequence(self, seq):
+        """
+        Compares the sequence byte of a validated dataframe with the last applied one (see SequenceTracker).
+        Returns True when the dataframe has to be applied, False when it has to be dropped.
+        Counters are shared with core0 when they change.
+        """
+        tracker = self.seq_tracker                     # local variable from instance variable
+        gaps = tracker.gaps                            # gaps before the check
+        apply = tracker.check(seq)                     # sequence is checked
+        if not apply:                                  # case of duplicate or late dataframe
+            shared_variables.duplicates.write(tracker.duplicates & 0xFFFF)
+            shared_variables.reorders.write(tracker.reorders & 0xFFFF)
+        elif tracker.gaps != gaps:                     # case of missing sequences
+            shared_variables.gaps.write(tracker.gaps & 0xFFFF)
+        return apply
+    
+    
+    
+    def _prepare_reply(self):
+        """
+        Fills the reply buffer at the first read request after a data arrival.
+        The first byte is the status (0, 1 or 2), with the free dataframe slots in the upper nibble when
+        credits are enabled; the following ones are the last sequence and the (8 bits, wrapping) sequence
+        counters, then the capabilities (or the statistics, at the read following OP_READ_STATS).
+        """
+        reply = self.reply                             # local variable from instance variable
+        tracker = self.seq_tracker                     # local variable from instance variable
+        reply[0] = self.status                         # 1 checksum ok, 0 checksum not correct, 2 no data or data too short
+        if self.credits:                               # case the status byte carries the free slots
+            slots = self.rx_free() // self.frame_bytes           # dataframes the Controller can write before the buffer is full
+            reply[0] |= (slots if slots < MAX_CREDITS else MAX_CREDITS) << CREDITS_SHIFT
+        reply[1] = self.rx_seq & 0xFF                  # sequence of the last validated dataframe
+        reply[2] = tracker.duplicates & 0xFF           # duplicates counter
+        reply[3] = tracker.gaps & 0xFF                 # gaps counter
+        reply[4] = tracker.reorders & 0xFF             # reorders counter
+        reply[5] = (self.s_i2c.recoveries - self.recoveries_base) & 0xFF  # bus recoveries counter
+        if self.page_request == STATS_MARK:            # case of statistics page (read following OP_READ_STATS)
+            self.page_request = CAPS_MARK              # following reads return the capabilities
+            self._stats_page()                         # current statistics written to the reply page
+        elif reply[CAPS_IDX] != CAPS_MARK:             # case the statistics page has been returned
+            self._caps_page()                          # capabilities written back to the reply page
+    
+    
+    
+    def _reset_decoder(self):
+        """
+        Resets the decoder state, after the I2C block has been re-initialized.
+        The bytes received so far belong to an interrupted transfer, and are discarded.
+        """
+        self.decoder.reset()                           # partial dataframe is discarded
+        if self.rx_dma is not None:                    # case of DMA capture
+            self.rx_dma.flush()                        # bytes in the ring belong to the interrupted transfer
+        self.status = INCOMPLETE                       # no dataframe since the recovery
+        self.reply_idx = 0                             # next read request starts from the status byte
+        shared_variables.recoveries.write((self.s_i2c.recoveries - self.recoveries_base) & 0xFFFF)  # counter is shared
     
     
     
@@ -223,15 +494,26 @@ class I2CHandler:
             0 if the last received data completed a dataframe with not correct checksum
             1 if the last received data completed a dataframe with correct checksum
             2 if there is no data received yet or data is too short
+        With credits, the upper nibble of the status byte carries the free dataframe slots of the receive buffer.
+        Further bytes requested within the same read return the last sequence,
+        the duplicates, the gaps, the reorders and the bus recoveries counters, then the capabilities.
+        When there is neither data arrival nor request, the bus watchdog is periodically called.
+        After a configuration command, the configuration local variables are reloaded.
         """
         s_i2c = self.s_i2c                             # local object of the i2c instance  
+        rx = self.rx                                   # local object of the received bytes source (Rx FIFO or DMA ring)
+        rx_dma = self.rx_dma                           # local object of the DMA capture (None when not used)
         df_fields = self.df_fields                     # local variable from instace variable of number of fields in dataframe
-        max_buffer = self.max_buffer                   # local variable from instace variable of max bytes in buffer
         fields = shared_variables.fields               # local variable of fields
-        printout = self.printout                       # local variable to print some data to the terminal (only for debug purpose)
-    
-        data = []                                      # empty list to be populated with data received at i2c
-        check_ok = False                               # flag for coherent i2c data receival is initially set False
+        fields_lock = shared_variables.fields_lock     # local variable of the fields sequence lock
+        log = self.log                                 # local variable of the deferred debug log (printed by core0)
+        fifo = self.fifo                               # local variable of the inter-core FIFO (None when not used)
+        sequence = self.sequence                       # local variable of the sequence byte usage
+        delta = self.delta                             # local variable of the changed-fields dataframes usage
+        reply = self.reply                             # local variable of the reply buffer
+        data = self.data                               # local variable of the fields of the last validated dataframe
+        idle_loops = 0                                 # loops without data arrival or request
+        first_byte = True                              # flag for the boot-to-first-ACK timing
        
         
         while True:                                    # infinite loop
@@ -240,27 +522,57 @@ class I2CHandler:
                 print("shared_variables.halt.read() at i2c_handler.run():", shared_variables.halt.read())
                 break                                  # infinite loop is interrupted
             
-            if s_i2c.write_data_is_available():        # case there is data at the i2c arrival buffer
-                data, check_ok = self._read_i2c_data(s_i2c.get_write_data()[0], df_fields, max_buffer)  # byte is read and analyzed
-                
-                if check_ok and len(data) > 0:         # case the received data reppresent a complete dataframe
-                    if printout:                       # case printout is set True
-                        print("Received data:", data)  # feedbaclk is printed to the terminal
+            byte = rx.get_write_byte()                 # received byte, -1 when none (no list allocated)
+            if byte >= 0:                              # case there is data at the i2c arrival buffer (or DMA ring)
+                if first_byte:                         # case of the first byte since boot
+                    first_byte = False                 # timing is logged once
+                    self.first_byte_ms = time.ticks_ms()  # boot-to-first-ACK time
+                    log(EV_BOOT, 0, min(self.ready_ms, 0xFFFF), min(self.first_byte_ms, 0xFFFF))
+                self.reply_idx = 0                     # next read request starts from the status byte
+                if self._read_i2c_data(byte):          # case the byte completes a valid dataframe
+                    if self.reconfigured:              # case of a configuration command, since the last dataframe
+                        self.reconfigured = False      # configuration is reloaded once
+                        df_fields, sequence, delta, data = self.df_fields, self.sequence, self.delta, self.data
+                    if sequence and not self._check_sequence(self.rx_seq):  # case of duplicated or late dataframe
+                        log(EV_DROPPED_SEQ, self.rx_seq)  # event is logged
+                        continue                       # fields are not updated (dataframe was ok, status stays 1)
+                    if delta:                          # case of changed-fields dataframe
+                        self.decoder.delta_fields(data, self.seq_bytes, self.delta_mask, df_fields)  # changed fields applied to the last ones
+                        self.keyed = True              # following changed-fields dataframes can be applied
                     
-                    for i in range(df_fields):         # iteration over the number of fields
-                        fields[i].write(data[i])       # updated value at the specific data sharing memory location  
+                    fields_lock.write(fields, data, df_fields)  # fields updated as a set, at the data sharing memory locations
+                    self.frames += 1                   # applied dataframes counter is increased
+                    if fifo is not None:               # case core0 waits for notifications
+                        fifo.push(make_descriptor(EV_FRAME, df_fields, self.rx_seq, self.frames))  # core0 is notified
+                    
+                    if df_fields == 1:                 # case of one field
+                        log(EV_DATA, 1, data[0])       # event is logged
+                    elif df_fields == 2:               # case of two fields
+                        log(EV_DATA, 2, data[0], data[1])
+                    elif df_fields == 3:               # case of three fields
+                        log(EV_DATA, 3, data[0], data[1], data[2])
+                    else:                              # case of four fields
+                        log(EV_DATA, 4, data[0], data[1], data[2], data[3])
 
 
             elif s_i2c.read_is_pending():                   # case there is i2c data request    
-                if len(data)>0:                             # case there is data from previous i2c data arrival
-                    if check_ok:                            # case the check_ok is True (checksum ok on received data)
-                        self.s_i2c.put_read_data(1 & 0xff)  # 1 is returned to I2C (1 means checksum is ok)
-                    else:                                   # case the check_ok is False (checksum not ok on received data)
-                        self.s_i2c.put_read_data(0 & 0xff)  # 0 is returned to I2C (0 means checksum is not correct)
-                        if printout:                        # case printout is set True
-                            print("Checksum error")         # feedback is printed to the terminal
-                else:                                       # case there is no data from previous i2c data arrival
-                    self.s_i2c.put_read_data(2 & 0xff)      # 2 is returned to I2C (no data received yet) 
-                    if printout:                            # case printout is set True
-                        print("Uncomplete data:", data)     # feedback is printed to the terminal
+                if s_i2c.read_is_done():                    # case a previous read has been completed by the Controller
+                    self.reply_idx = 0                      # this read starts again from the status byte
+                idx = self.reply_idx                        # index of the reply byte to be returned
+                if idx == 0:                                # case of status byte
+                    self._prepare_reply()                   # reply buffer is filled
+                    if reply[0] & STATUS_MASK == INCOMPLETE:  # case of no data
+                        log(EV_NO_DATA)                     # event is logged
+                self.s_i2c.put_read_data(reply[idx])        # reply byte is returned to I2C
+                self.reply_idx = (idx + 1) % len(reply)     # next reply byte, restarting after the last one
+            
+            else:                                           # case the bus is idle
+                idle_loops += 1                             # idle loops counter is increased
+                if idle_loops >= self.WATCHDOG_LOOPS:       # case it's time for the bus watchdog
+                    idle_loops = 0                          # idle loops counter is reset
+                    if rx_dma is not None:                  # case of DMA capture
+                        rx_dma.check()                      # DMA channel is re-armed, when needed
+                    if s_i2c.check_bus():                   # case the I2C block (or PIO) has been re-initialized
+                        self._reset_decoder()               # decoder state is reset
+                        log(EV_RECOVERY, 0, s_i2c.recoveries - self.recoveries_base)  # event is logged
 
@@ -11,8 +11,12 @@ This Class:
 - each dataframe includes STX, 16bits field(s), escape characters, checksum and ETX.
 - the 16bits field(s) is a randome 16bits integer.
 - after sendig a dataframe, it inquires the device if dataframe is correctly received.
+- optionally, it calibrates the bus speed (100k, 400k, 1M) and applies the fastest reliable one.
 - it sends a predefined number of dataframes and stops. 
 
+Notes:
+- the dataframe handling is done by the i2c_controller library (copy it to the Pico too).
+
 
 
 MIT License
@@ -39,88 +43,69 @@ SOFTWARE.
 """
 
 
-from machine import I2C, Pin
-import time, struct, random
-import random
+
+from i2c_controller import I2CController, MachineI2CTransport
+import time, random
 
 
 # variable to be manually set
 df_fields = 2      # number of 16-bit fields in dataframe, max 4
 runs = 1000        # limit the test to a number of runs
 timeout_mins = 3   # timeout in minutes
+use_sequence = False  # flag to add a sequence byte to the dataframes (set same value at the Responders)
+framing = 'escape'    # dataframe framing: 'escape' (STX/ETX) or 'cobs' (set same value at the Responders)
+use_delta = False     # flag to send only the fields changed since the last acknowledged dataframe (set delta at the Responders)
+use_fec = False       # flag to append the Reed-Solomon parity bytes, the Responders correcting a corrupted byte (set fec at the Responders)
+use_credits = False   # flag for the free dataframe slots in the status byte, pacing the writes (set credits at the Responders)
+negotiate = False     # flag to read the Responders capabilities, and configure them (fields, framing, delta, fec, credits) at runtime
+max_retries = 0       # re-sending attempts of a dataframe not correctly received
+bus_speed = 100000    # I2C bus speed in Hz (Responders need bus_speed set for 1000000)
+calibrate = False     # flag to calibrate the bus speed before the test
+calib_speeds = (100000, 400000, 1000000)  # bus speeds tried by the calibration
+calib_frames = 200    # dataframes per device sent at each calibration speed
+calib_max_error_rate = 0.01  # max error rate for a bus speed to be considered reliable
+use_broadcast = False # flag to send each dataframe once to all devices via general call (set general_call at the Responders)
 
 
 # Define I2C parameters (use I2C0 or I2C1 based on your wiring)
-i2c = I2C(0, scl=Pin(1), sda=Pin(0), freq =100000)
+transport = MachineI2CTransport(0, scl=1, sda=0, freq=bus_speed)
+controller = I2CController(transport, fields=df_fields, sequence=use_sequence, max_retries=max_retries, framing=framing,
+                           delta=use_delta, fec=use_fec, credits=use_credits)
 
 print("Scanning for I2C devices...")
-devs = i2c.scan()  # Scan for devices
-
-devices = {}
-device_labels = 'ABCDEFGHIJKLMNO'
-if devs:
-    print("I2C devices found:")
-    for i, addr in enumerate(devs):
-        devices[device_labels[i]] = addr
-        print(f"  0x{addr:02X}")  # Print address in hexadecimal format
-else:
+devices = controller.scan()  # Scan for devices
+if not devices:
     print("No I2C devices found.")
 
 # manual entering of the device(s) and related address(es)
-# devices = {'A': 0x42}  # RP2040-devices and related I2C addresses
-
-# number of devices is assigned to number_of_devs variable
-number_of_devs = len(devices)
+# controller.devices = {}
+# controller.add_device('A', 0x42)  # RP2040-devices and related I2C addresses
 
+if negotiate:         # case the Responders are configured by the Controller
+    controller.negotiate()  # fields and sequence as set here, fastest framing and delta supported by each device
 
-def calculate_checksum(dataframe):
-    return sum(dataframe) & 0xFF
-
-def escape_data(dataframe):
-    escaped_data = []
-    for byte in dataframe:
-        if byte in [0x02, 0x03, 0x5C]:  # STX, ETX, and backslash
-            escaped_data.append(0x5C)   # Escape character
-        escaped_data.append(byte)
-    return escaped_data
-
-def send_data(dataframe, dev, adr):
-    data_frame = [stx]
-    for value in dataframe:
-        field_bytes = value.to_bytes(2, 'big')
-        data_frame.extend(field_bytes)
-    
-    checksum = calculate_checksum(data_frame)
-    data_frame.append(checksum)
-    escaped_data_frame = escape_data(data_frame)[1:] + [etx]
-    
-    try:
-        i2c.writeto(adr, bytes(escaped_data_frame))
-    except OSError as e:
-        print(f"I2C write error on device {dev}: {e}")
-        escaped_data_frame = []
-    return escaped_data_frame
-
-def read_data(dev, adr):
-    try:
-        return i2c.readfrom(adr, 1)[0]  # Read 1 byte
-    except OSError as e:
-        print(f"I2C read error on device {dev}: {e}")
-        return -1
+# number of devices is assigned to number_of_devs variable
+number_of_devs = len(controller.devices)
 
 
 # other variables
 stop_test = False  # stop flag
-stx = 0x02                       # start of Text
-etx = 0x03                       # end of Text
 ok_runs = 0                      # successful transmissions counter is zeroed
 errors = 0                       # errors counter is zeroed
+busy_returns = 0                 # counter of the devices still busy after the status polls (not errors)
 timeout_s = 60 * timeout_mins    # calculated timeout in seconds
 t_start_s = time.time()          # time reference for seconds
 t_start_ms = time.ticks_ms()     # time reference for milliseconds                 
 
 
 try:
+    if calibrate and devices:                             # case the bus speed has to be calibrated
+        print("Calibrating the bus speed ...")
+        bus_speed, calib_results = controller.calibrate(calib_speeds, calib_frames, calib_max_error_rate)
+        print(f"Bus speed set to {bus_speed} Hz\n")
+        t_start_s = time.time()                           # time references reset after the calibration
+        t_start_ms = time.ticks_ms()
+    
     while time.time() - t_start_s < timeout_s:            # while loop until timeout
         if stop_test:                                     # case all the target runs are made
             break                                         # while loop is interrupted
@@ -128,10 +113,12 @@ try:
         data = [random.randint(0, 65535) for _ in range(df_fields)] # list with random 16bits values
         device_reply = 0                                  # 0 (= bad data trasmission) is assigned to device_reply 
         
-        for device, address in devices.items():           # iteration over the devices
-            data_sent = send_data(data, device, address)  # (the same) data is sent
-            device_return = read_data(device, address)    # device is inquired
-            
+        if use_broadcast:                                 # case of broadcast dataframes
+            controller.broadcast(data)                    # data is sent once, to all devices (general call)
+            device_returns = controller.collect_acks()    # devices inquired, data sent again to the ones that missed it
+        else:                                             # case of dataframes sent to each device
+            device_returns = controller.send(data)        # (the same) data is sent to all devices, and devices inquired
+        for device, device_return in device_returns.items():  # iteration over the devices return
             if device_return == 1:                        # case positive data receival from Responder
                 device_reply += 1                         # device_reply counter is increased by 1
             elif device_return == 0:                      # case of wrong checksum at Responder
@@ -140,7 +127,13 @@ try:
             elif device_return == 2:                      # case of uncomplete data at Responder
                 errors += 1                               # errors counter is increased by 1
                 print(device, "dataframe length error")   # feedback is printed to the Terminal
-            
+            elif device_return == 3:                      # case of busy Responder (dataframe not decoded yet)
+                busy_returns += 1                         # busy counter is increased by 1 (not an error)
+                print(device, "busy, dataframe not decoded yet")  # feedback is printed to the Terminal
+            else:                                         # case of I2C error
+                errors += 1                               # errors counter is increased by 1
+                print(device, "I2C error")                # feedback is printed to the Terminal
+        
         if device_reply == number_of_devs:                # case positive data receival by all devices
             ok_runs += 1                                  # ok_runs counter is increased by 1
         
@@ -148,7 +141,16 @@ try:
             elapsed = time.ticks_diff(time.ticks_ms(), t_start_ms) / 1000
             print(f"\nTotal {ok_runs} positive datasets sent in {elapsed:.3f} secs")
             print(f"Total errors: {errors}")
+            print(f"Busy returns: {busy_returns}")
             print(f"Data sharing frequency: {int(runs / elapsed)} Hz\n")
+            for device, stats in controller.stats().items():
+                print(f"Device {device} stats: {stats}")
+            if use_sequence:                              # case of dataframes with sequence byte
+                for device in controller.devices:
+                    print(f"Device {device} counters: {controller.read_stats(device)}")
+            if negotiate:                                 # case the Responders support the commands (protocol version 2)
+                for device in controller.devices:
+                    print(f"Device {device} Responder statistics: {controller.read_counters(device)}")
             stop_test = True
 
 except KeyboardInterrupt:
@@ -156,4 +158,4 @@ except KeyboardInterrupt:
 except Exception as e:
     print(f"\nAn error occurred: {e}")
 finally:
-    del(i2c)
\ No newline at end of file
+    controller.stop()
@@ -1,4 +1,5 @@
-from machine import mem32, Pin
+from machine import mem32, Pin, freq
+import time
 
 class I2CResponder:
     """Implementation of a (polled) Raspberry Pico I2C Responder.
@@ -33,11 +34,21 @@ class I2CResponder:
     IC_TX_TL = 0x3C
     IC_CLR_INTR = 0x40
     IC_CLR_RD_REQ = 0x50
+    IC_CLR_RX_DONE = 0x58
     IC_CLR_TX_ABRT = 0x54
+    IC_CLR_RX_OVER = 0x48
+    IC_CLR_STOP_DET = 0x60
+    IC_CLR_START_DET = 0x64
+    IC_CLR_GEN_CALL = 0x68
     IC_ENABLE = 0x6C
     IC_STATUS = 0x70
     IC_RXFLR = 0x78
+    IC_SDA_HOLD = 0x7C
     IC_TX_ABRT_SOURCE = 0x80
+    IC_SDA_SETUP = 0x94
+    IC_ENABLE_STATUS = 0x9C
+    IC_ACK_GENERAL_CALL = 0x98
+    IC_FS_SPKLEN = 0xA0
 
     # GPIO Register block size (i.e.) per GPIO
     GPIO_REGISTER_BLOCK_SIZE = 8
@@ -47,15 +58,28 @@ class I2CResponder:
 
     # Register bit definitions
     IC_STATUS__RFNE = 0x08  # Receive FIFO Not Empty
+    IC_STATUS__SLV_ACTIVITY = 0x40  # Responder not idle (a transfer addressed to it is in progress)
+    IC_DATA_CMD__FIRST_DATA_BYTE = 0x800  # first byte after the address phase
     IC_RXFLR__RXFLR = 0x1f  # Receive FIFO Level
     IC_ENABLE__DISABLE = 0x0
     IC_ENABLE__ENABLE = 0x01
+    IC_ENABLE_STATUS__IC_EN = 0x01
     IC_SAR__IC_SAR = 0x1FF  # Responder address
     IC_CLR_TX_ABRT__CLR_TX_ABRT = 0x01
+    IC_RAW_INTR_STAT__RX_OVER = 0x02
     IC_RAW_INTR_STAT__RD_REQ = 0x20
+    IC_RAW_INTR_STAT__TX_ABRT = 0x40
+    IC_RAW_INTR_STAT__RX_DONE = 0x80
+    IC_RAW_INTR_STAT__STOP_DET = 0x200
+    IC_RAW_INTR_STAT__START_DET = 0x400
+    IC_RAW_INTR_STAT__GEN_CALL = 0x800
+    IC_ACK_GENERAL_CALL__ACK_GEN_CALL = 0x01
     IC_CON__CONTROLLER_MODE = 0x01
     IC_CON__IC_10BITADDR_RESPONDER = 0x08
     IC_CON__IC_RESPONDER_DISABLE = 0x40
+    IC_CON__SPEED = 0x06
+    IC_CON__SPEED_STANDARD = 0x02
+    IC_CON__SPEED_FAST = 0x04   # fast mode, and fast mode plus
     GPIOxCTRL__FUNCSEL = 0x1F
     GPIOxCTRL__FUNCSEL__I2C = 0x03
 
@@ -71,7 +95,8 @@ class I2CResponder:
         """Clear bits in Pico register."""
         self.write_reg(register_offset, data, method=self.REG_ACCESS_METHOD_CLR)
 
-    def __init__(self, i2c_device_id=0, sda_gpio=0, scl_gpio=1, responder_address=0x41, rp='RP2040'):
+    def __init__(self, i2c_device_id=0, sda_gpio=0, scl_gpio=1, responder_address=0x41, rp='RP2040',
+                 stuck_timeout_ms=25, bus_speed=None, general_call=False):
         """Initialize.
 
         Args:
@@ -80,6 +105,14 @@ class I2CResponder:
             scl_gpio (int, optional): The gpio number of the pin to use for SCL.
             responder_address (int, optional): The I2C address to assign to this Responder.
             rp (string, optional): Microcontroller core architectur ('2040' or '2350').
+            stuck_timeout_ms (int, optional): Time after which a transfer without STOP, or
+                an idle bus with SDA low, is considered stuck by check_bus().
+            bus_speed (int, optional): The I2C bus speed (Hz) set at the Controller, used for the
+                spike filter and SDA timings: required for Fast-mode Plus (1000000). When None, the
+                I2C block reset values are kept.
+            general_call (bool, optional): When True, the writes to the general call address (0x00)
+                are ACKed and received as the ones to responder_address (broadcast dataframes),
+                without their first byte (the general call command byte).
         """
         
         print("Uploading i2c_responder ...")
@@ -105,6 +138,27 @@ class I2CResponder:
         self.i2c_device_id = i2c_device_id
         self.i2c_base = self.I2C0_BASE if i2c_device_id == 0 else self.I2C1_BASE
         
+        # register addresses used at every byte, computed once: the base is above the MicroPython
+        # small int range, so "base | offset" would allocate a long int at every access
+        self.status_adr = self.i2c_base | self.IC_STATUS
+        self.data_cmd_adr = self.i2c_base | self.IC_DATA_CMD
+        self.raw_intr_stat_adr = self.i2c_base | self.IC_RAW_INTR_STAT
+        self.clr_rd_req_adr = self.i2c_base | self.IC_CLR_RD_REQ
+        self.clr_rx_done_adr = self.i2c_base | self.IC_CLR_RX_DONE
+        self.rxflr_adr = self.i2c_base | self.IC_RXFLR
+        self.tx_abrt_source_adr = self.i2c_base | self.IC_TX_ABRT_SOURCE
+        self.clr_tx_abrt_adr = self.i2c_base | self.IC_CLR_TX_ABRT
+        
+        # register addresses used by the bus watchdog (check_bus and recover), called in the core1 idle loop
+        self.clr_start_det_adr = self.i2c_base | self.IC_CLR_START_DET
+        self.clr_stop_det_adr = self.i2c_base | self.IC_CLR_STOP_DET
+        self.clr_gen_call_adr = self.i2c_base | self.IC_CLR_GEN_CALL
+        self.clr_rx_over_adr = self.i2c_base | self.IC_CLR_RX_OVER
+        self.clr_intr_adr = self.i2c_base | self.IC_CLR_INTR
+        self.enable_adr = self.i2c_base | self.IC_ENABLE
+        self.enable_set_adr = self.i2c_base | self.REG_ACCESS_METHOD_SET | self.IC_ENABLE
+        self.enable_status_adr = self.i2c_base | self.IC_ENABLE_STATUS
+        
         # disable I2C engine while initializing it
         self.write_reg(self.IC_ENABLE, self.IC_ENABLE__DISABLE)
         
@@ -126,6 +180,14 @@ class I2CResponder:
             ),
         )
         
+        # general call acceptance (the reset value ACKs it, so it's always written)
+        self.general_call = general_call
+        self.write_reg(self.IC_ACK_GENERAL_CALL, self.IC_ACK_GENERAL_CALL__ACK_GEN_CALL if general_call else 0)
+        
+        # spike filter and SDA timings
+        if bus_speed is not None:
+            self.set_bus_timing(bus_speed)
+        
         # configure SDA and SCL for I2C function
         mem32[self.IO_BANK0_BASE | self.GPIOxCTRL | (sda_gpio * 8)] = self.GPIOxCTRL__FUNCSEL__I2C
         mem32[self.IO_BANK0_BASE | self.GPIOxCTRL | (scl_gpio * 8)] = self.GPIOxCTRL__FUNCSEL__I2C
@@ -133,7 +195,57 @@ class I2CResponder:
         # enable i2c engine
         self.set_reg(self.IC_ENABLE, self.IC_ENABLE__ENABLE)
         
+        # bus watchdog state and counters
+        self.stuck_timeout_ms = stuck_timeout_ms
+        self.in_transfer = False        # True from a START to the following STOP
+        self.transfer_start_ms = 0      # ticks_ms at the START of the current transfer (see check_bus)
+        self.first_byte_ms = None       # ticks_ms of the first data byte of a write, since the last check_bus
+        self.sda_low_ms = None          # ticks_ms since SDA is low on an idle bus
+        self.last_stop_ms = time.ticks_ms()  # ticks_ms of the last STOP
+        self.recoveries = 0             # number of I2C block re-initializations
+        self.rx_overflows = 0           # number of Rx FIFO overflows
+        self.tx_aborts = 0              # number of TX aborts found at read requests
+        self.last_abort_source = 0      # IC_TX_ABRT_SOURCE of the last TX abort
+        self.general_calls = 0          # number of general call (broadcast) writes
+        self.rx_buffer_size = 16        # received bytes held by the Rx FIFO (capabilities)
+        
     
+    def set_bus_timing(self, bus_speed):
+        """Set the spike filter and the SDA hold/setup times for the bus speed.
+
+        The values follow the Pico SDK (i2c_set_baudrate), plus the SDA setup time
+        used when responding to a READ: its reset value (100 ic_clk cycles) exceeds
+        the SCL low time at Fast-mode Plus.
+        Must be called while the I2C block is disabled.
+
+        Args:
+            bus_speed (int): The I2C bus speed in Hz (i.e. 100000, 400000, 1000000).
+        """
+        freq_in = freq()                          # ic_clk is clk_sys
+        period = (freq_in + bus_speed // 2) // bus_speed
+        lcnt = period * 3 // 5
+        spklen = 1 if lcnt < 16 else lcnt // 16
+        if bus_speed < 1000000:
+            sda_tx_hold = (freq_in * 3) // 10000000 + 1    # 300ns
+        else:
+            sda_tx_hold = (freq_in * 3) // 25000000 + 1    # 120ns
+        if bus_speed <= 100000:
+            t_su_dat_ns = 250
+        elif bus_speed <= 400000:
+            t_su_dat_ns = 100
+        else:
+            t_su_dat_ns = 50
+        sda_setup = (t_su_dat_ns * (freq_in // 1000000) + 999) // 1000 + 1
+
+        speed = self.IC_CON__SPEED_STANDARD if bus_speed <= 100000 else self.IC_CON__SPEED_FAST
+        self.clr_reg(self.IC_CON, self.IC_CON__SPEED)
+        self.set_reg(self.IC_CON, speed)
+        self.write_reg(self.IC_FS_SPKLEN, spklen)
+        self.write_reg(self.IC_SDA_HOLD, sda_tx_hold)
+        self.write_reg(self.IC_SDA_SETUP, sda_setup)
+        self.bus_speed = bus_speed
+
+
     def read_is_pending(self):
         """Return True if the Controller has issued an I2C READ command.
 
@@ -141,7 +253,7 @@ class I2CResponder:
         I2C READ, which means that its I2C engine is currently blocking
         waiting for us to respond with the requested I2C READ data.
         """
-        status = mem32[self.i2c_base | self.IC_RAW_INTR_STAT] & self.IC_RAW_INTR_STAT__RD_REQ
+        status = mem32[self.raw_intr_stat_adr] & self.IC_RAW_INTR_STAT__RD_REQ
         return bool(status)
 
     
@@ -154,10 +266,29 @@ class I2CResponder:
         Args:
             data (int): A byte value to send.
         """
-        # reset flag
-        self.clr_reg(self.IC_CLR_TX_ABRT, self.IC_CLR_TX_ABRT__CLR_TX_ABRT)
-        status = mem32[self.i2c_base | self.IC_CLR_RD_REQ]
-        mem32[self.i2c_base | self.IC_DATA_CMD] = data & 0xFF
+        # a TX abort flushes the Tx FIFO, and holds it until the flag is cleared
+        if mem32[self.raw_intr_stat_adr] & self.IC_RAW_INTR_STAT__TX_ABRT:
+            self.last_abort_source = mem32[self.tx_abrt_source_adr]
+            self.tx_aborts += 1
+            # reading the register clears the flag (and the abort source)
+            mem32[self.clr_tx_abrt_adr]
+        # reading the register clears the flag
+        mem32[self.clr_rd_req_adr]
+        mem32[self.data_cmd_adr] = data & 0xFF
+
+
+    def read_is_done(self):
+        """Return True if the Controller has completed an I2C READ, and clear the flag.
+
+        The Controller NACKs the last byte it wants to read: this ends the
+        READ transaction, and allows a multi-byte reply to restart from
+        its first byte at the next READ.
+        """
+        status = mem32[self.raw_intr_stat_adr] & self.IC_RAW_INTR_STAT__RX_DONE
+        if status:
+            # reading the register clears the flag
+            mem32[self.clr_rx_done_adr]
+        return bool(status)
 
 
     def write_data_is_available(self):
@@ -167,7 +298,7 @@ class I2CResponder:
             True if data is available, False otherwise.
         """
         # get IC_STATUS
-        status = mem32[self.i2c_base | self.IC_STATUS]
+        status = mem32[self.status_adr]
         # check RFNE (Receive FIFO not empty)
         if status & self.IC_STATUS__RFNE:
             # There is data in the Zx FIFO
@@ -183,7 +314,7 @@ class I2CResponder:
             Number of bytes (at least) that can be read without blocking.
         """
         # check RXFLR (Receive FIFO level register)
-        status = mem32[self.i2c_base | self.IC_RXFLR]
+        status = mem32[self.rxflr_adr]
         return int(status & self.IC_RXFLR__RXFLR)
 
 
@@ -199,6 +330,128 @@ class I2CResponder:
         """
         data = []
         while len(data) < max_size and self.write_data_is_available():
-            data.append(mem32[self.i2c_base | self.IC_DATA_CMD] & 0xFF)
+            data.append(mem32[self.data_cmd_adr] & 0xFF)
         return data
 
+
+    def get_write_byte(self):
+        """Get one incoming (I2C WRITE) byte, without heap allocations.
+
+        The general call command byte (the first byte of a general call write) is dropped, as it
+        isn't part of the dataframe: with COBS framing it would be taken as a code byte.
+
+        Returns:
+            The byte value, or -1 if the Rx FIFO is empty.
+        """
+        if mem32[self.status_adr] & self.IC_STATUS__RFNE:
+            data = mem32[self.data_cmd_adr]
+            if data & self.IC_DATA_CMD__FIRST_DATA_BYTE:
+                # case of first byte after the address: the transfer start, for the bus watchdog
+                self.first_byte_ms = time.ticks_ms()
+                if self.general_call_byte():
+                    # case of general call command byte: the next byte is returned
+                    if not mem32[self.status_adr] & self.IC_STATUS__RFNE:
+                        return -1
+                    data = mem32[self.data_cmd_adr]
+            return data & 0xFF
+        return -1
+
+
+    def general_call_byte(self):
+        """Tell whether the first data byte of a write is the general call command byte.
+
+        To be called at the first data byte (FIRST_DATA_BYTE flag): the general call flag is raised
+        at the address phase, and it's cleared here.
+
+        Returns:
+            True if the write is a general call (broadcast), False otherwise.
+        """
+        if self.general_call and mem32[self.raw_intr_stat_adr] & self.IC_RAW_INTR_STAT__GEN_CALL:
+            mem32[self.clr_gen_call_adr]
+            self.general_calls += 1
+            return True
+        return False
+
+
+    def check_bus(self):
+        """Bus watchdog, to be called periodically while not serving the bus.
+
+        It tracks START and STOP conditions, and re-initializes the I2C block when:
+            - the Rx FIFO has overflowed (received bytes have been lost).
+            - a transfer has lasted more than stuck_timeout_ms without a STOP.
+            - SDA has been held low, on an idle bus, for more than stuck_timeout_ms.
+
+        The transfer start is the first data byte of a write (stamped by get_write_byte), otherwise
+        the check finding the START (reads, DMA capture, START found with a STOP): up to one check
+        period late.
+
+        Returns:
+            True if the I2C block has been re-initialized (the caller should reset its
+            decoder state, as the bytes received so far are incomplete), False otherwise.
+        """
+        now = time.ticks_ms()
+        raw = mem32[self.raw_intr_stat_adr]
+        first_byte_ms = self.first_byte_ms
+        self.first_byte_ms = None
+
+        if raw & self.IC_RAW_INTR_STAT__STOP_DET:
+            mem32[self.clr_stop_det_adr]
+            self.in_transfer = False
+            self.last_stop_ms = now
+        if raw & self.IC_RAW_INTR_STAT__START_DET:
+            # checked after the STOP: with both found, either a new transfer has started after
+            # the STOP (the Responder is active), or it has completed in between two checks
+            mem32[self.clr_start_det_adr]
+            if not raw & self.IC_RAW_INTR_STAT__STOP_DET:
+                if not self.in_transfer:
+                    self.in_transfer = True
+                    self.transfer_start_ms = now if first_byte_ms is None else first_byte_ms
+            elif mem32[self.status_adr] & self.IC_STATUS__SLV_ACTIVITY:
+                # the first byte (if any) may belong to the completed transfer: the check time is kept
+                self.in_transfer = True
+                self.transfer_start_ms = now
+        if raw & self.IC_RAW_INTR_STAT__GEN_CALL and raw & self.IC_RAW_INTR_STAT__STOP_DET \
+                and not mem32[self.status_adr] & self.IC_STATUS__RFNE:
+            # general call without data bytes (the flag is otherwise cleared by general_call_byte)
+            mem32[self.clr_gen_call_adr]
+            self.general_calls += 1
+
+        if raw & self.IC_RAW_INTR_STAT__RX_OVER:
+            mem32[self.clr_rx_over_adr]
+            self.rx_overflows += 1
+            return self.recover()
+
+        if self.in_transfer:
+            if time.ticks_diff(now, self.transfer_start_ms) > self.stuck_timeout_ms:
+                return self.recover()
+        elif self.sda_pin.value() == 0:
+            if self.sda_low_ms is None:
+                self.sda_low_ms = now
+            elif time.ticks_diff(now, self.sda_low_ms) > self.stuck_timeout_ms:
+                return self.recover()
+        else:
+            self.sda_low_ms = None
+        return False
+
+
+    def recover(self):
+        """Disable and re-enable the I2C block, releasing SDA and flushing the FIFOs.
+
+        Returns:
+            True, as the I2C block has been re-initialized.
+        """
+        mem32[self.enable_adr] = self.IC_ENABLE__DISABLE
+        # the block disables itself once the current byte (if any) is completed
+        for _ in range(1000):
+            if not mem32[self.enable_status_adr] & self.IC_ENABLE_STATUS__IC_EN:
+                break
+        # reading the register clears all the interrupt flags
+        mem32[self.clr_intr_adr]
+        mem32[self.enable_set_adr] = self.IC_ENABLE__ENABLE
+
+        self.recoveries += 1
+        self.in_transfer = False
+        self.first_byte_ms = None
+        self.sda_low_ms = None
+        self.last_stop_ms = time.ticks_ms()
+        return True
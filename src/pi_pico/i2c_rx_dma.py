@@ -0,0 +1,385 @@
+"""
+Andrea Favero
+
+Micropython Class for Raspberry Pi Pico (RP2040 and RP2350).
+Optional DMA capture of the I2C received bytes, into a circular buffer.
+
+This Class:
+- configures a DMA channel, paced by the I2C RX DREQ, reading IC_DATA_CMD into a ring buffer.
+- the Rx FIFO is emptied by the DMA as soon as a byte arrives, also while core1 decodes (no Rx FIFO overflow).
+- each transfer is a halfword, keeping the FIRST_DATA_BYTE flag (bit 11) next to the received byte.
+- the decoder consumes the ring by tracking the DMA write pointer.
+- it offers the write_data_is_available() and get_write_data() methods of I2CResponder.
+- the general call command byte (first byte of a broadcast) is dropped by get_write_byte(), as by I2CResponder.
+- SimI2CBlock and SimDma are a register-level simulator of the I2C Rx FIFO and of the DMA channel, for the host.
+
+Notes:
+- the ring is aligned to its size (DMA ring wrapping): a buffer twice the size is allocated.
+- the DMA transfer count is re-armed by check(), called by the bus watchdog while idle.
+- bytes are lost only if the decoder falls behind by a whole ring (256 bytes by default).
+- rp2.DMA is available since MicroPython 1.21.
+
+
+
+MIT License
+
+Copyright (c) 2025 Andrea Favero
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+
+try:
+    import rp2, uctypes
+except ImportError:                             # case of host side (only the simulator can be used)
+    rp2 = uctypes = None
+
+
+
+class I2CRxDma:
+    
+    # I2C register offsets
+    IC_DATA_CMD = 0x10
+    IC_DMA_CR = 0x88
+    IC_DMA_RDLR = 0x90
+    
+    # Register bit definitions
+    IC_DMA_CR__RDMAE = 0x01                     # receive DMA enable
+    IC_DATA_CMD__FIRST_DATA_BYTE = 0x800        # first byte after the address (bit 11)
+    
+    # DREQ of the I2C Rx FIFOs (I2C0, I2C1)
+    DREQ_I2C_RX = {'RP2040': (33, 35), 'RP2350': (45, 47)}
+    
+    # transfers before the channel has to be re-armed
+    TRANS_COUNT = {'RP2040': 0xFFFFFFFF, 'RP2350': 0x0FFFFFFF}  # RP2350 uses the upper 4 bits for the mode
+    
+    def __init__(self, responder, rp='RP2040', ring_bits=8, dma=None, addressof=None):
+        """Initialize.
+
+        Args:
+            responder (I2CResponder): The I2C Responder, already initialized.
+            rp (string, optional): Microcontroller ('RP2040' or 'RP2350').
+            ring_bits (int, optional): The ring holds 2**ring_bits received bytes (halfwords).
+            dma (optional): DMA channel object, rp2.DMA() when None (SimDma on the host).
+            addressof (optional): Function returning a buffer address, uctypes.addressof when None.
+        """
+        print("Uploading i2c_rx_dma ...")
+        
+        self.responder = responder
+        self.general_call = getattr(responder, 'general_call', False)  # the general call command byte is dropped
+        self.rp = rp
+        self.dma = rp2.DMA() if dma is None else dma
+        addressof = uctypes.addressof if addressof is None else addressof
+        
+        # ring buffer of halfwords, aligned to its size in bytes
+        ring_size = 2 << ring_bits                  # ring size in bytes
+        self.mask = ring_size - 1                   # mask of the ring index in bytes
+        self._raw = bytearray(2 * ring_size)        # room for the alignment
+        raw_addr = addressof(self._raw)
+        offset = (-raw_addr) & self.mask            # bytes up to the next aligned address
+        self.ring = memoryview(self._raw)[offset:offset + ring_size]
+        self.ring_addr = raw_addr + offset          # ring address
+        self.rd = 0                                 # read index (bytes) of the next halfword
+        self.first_data_byte = False                # FIRST_DATA_BYTE flag of the last returned byte
+        self.rearms = 0                             # number of DMA re-arms
+        self.rx_buffer_size = 1 << ring_bits        # received bytes held by the ring (capabilities)
+        
+        # DMA channel: IC_DATA_CMD (fixed) to the ring (incremented, wrapping), paced by the I2C RX DREQ
+        dreq = self.DREQ_I2C_RX[rp][responder.i2c_device_id]
+        self.ctrl = self.dma.pack_ctrl(size=1, inc_read=False, inc_write=True,
+                                       ring_size=ring_bits + 1, ring_sel=True, treq_sel=dreq)
+        
+        # DMA request as soon as one byte is in the Rx FIFO
+        responder.write_reg(self.IC_DMA_RDLR, 0)
+        responder.write_reg(self.IC_DMA_CR, self.IC_DMA_CR__RDMAE)
+        
+        self.dma.config(read=responder.i2c_base | self.IC_DATA_CMD, write=self.ring_addr,
+                        count=self.TRANS_COUNT[rp], ctrl=self.ctrl, trigger=True)
+    
+    
+    def _write_index(self):
+        """Return the ring index (bytes) the DMA will write next."""
+        return (self.dma.write - self.ring_addr) & self.mask
+    
+    
+    def available(self):
+        """Return the number of received bytes not consumed yet."""
+        return ((self._write_index() - self.rd) & self.mask) >> 1
+    
+    
+    def rx_free(self):
+        """Return the number of bytes the ring can still receive (credits reported to the Controller)."""
+        return self.rx_buffer_size - self.available()
+    
+    
+    def write_data_is_available(self):
+        """Check whether received data is available in the ring.
+
+        Returns:
+            True if data is available, False otherwise.
+        """
+        return self._write_index() != self.rd
+    
+    
+    def get_write_data(self, max_size=1):
+        """Get received data from the ring.
+
+        Args:
+            max_size (int): The maximum number of bytes to fetch.
+        Returns:
+            A list containing 0 to max_size bytes.
+        """
+        data = []
+        ring = self.ring
+        mask = self.mask
+        wr = self._write_index()
+        rd = self.rd
+        while len(data) < max_size and rd != wr:
+            data.append(ring[rd])
+            self.first_data_byte = bool(ring[rd + 1] & 0x08)  # bit 11 of the halfword
+            rd = (rd + 2) & mask
+        self.rd = rd
+        return data
+    
+    
+    def get_write_byte(self):
+        """Get one received byte from the ring, without heap allocations.
+
+        Returns:
+            The byte value, or -1 if the ring is empty.
+        """
+        rd = self.rd
+        if self._write_index() == rd:
+            return -1
+        ring = self.ring
+        byte = ring[rd]
+        self.first_data_byte = bool(ring[rd + 1] & 0x08)  # bit 11 of the halfword
+        self.rd = (rd + 2) & self.mask
+        if self.first_data_byte and self.general_call and self.responder.general_call_byte():
+            return self.get_write_byte()            # case of general call command byte: the next byte is returned
+        return byte
+    
+    
+    def flush(self):
+        """Discard the received data not consumed yet (i.e. after an I2C block recovery)."""
+        self.rd = self._write_index()
+    
+    
+    def check(self):
+        """Re-arm the DMA channel when the transfer count is exhausted (to be called while idle).
+
+        Returns:
+            True if the channel has been re-armed, False otherwise.
+        """
+        if self.dma.active():
+            return False
+        self.dma.count = self.TRANS_COUNT[self.rp]  # the write address continues from where it stopped
+        self.dma.active(1)
+        self.rearms += 1
+        return True
+    
+    
+    def close(self):
+        """Stop the DMA channel and disable the I2C receive DMA requests."""
+        self.dma.active(0)
+        self.responder.write_reg(self.IC_DMA_CR, 0)
+        self.dma.close()
+
+
+
+class SimI2CBlock:
+    """Register-level simulator of the I2C block receive path: 16 bytes Rx FIFO, IC_DATA_CMD, IC_DMA_CR, DREQ, GEN_CALL."""
+    
+    RX_FIFO_DEPTH = 16
+    
+    def __init__(self, i2c_device_id=0, general_call=False):
+        self.i2c_device_id = i2c_device_id
+        self.general_call = general_call
+        self.gen_call = False                       # GEN_CALL raw interrupt flag
+        self.general_calls = 0
+        self.i2c_base = 0x40044000 if i2c_device_id == 0 else 0x40048000
+        self.regs = {}
+        self.rx_fifo = []
+        self.rx_overflows = 0
+        self.dma = None                             # SimDma paced by this block
+    
+    def write_reg(self, register_offset, data, method=0):
+        self.regs[register_offset] = data
+    
+    def controller_write(self, data, general_call=False):
+        """The Controller writes data (one transfer): bytes enter the Rx FIFO, the DMA (if any) runs."""
+        if general_call:
+            self.gen_call = True                    # raised at the address phase
+        first = True
+        for byte in data:
+            if len(self.rx_fifo) >= self.RX_FIFO_DEPTH:
+                self.rx_overflows += 1              # byte is lost (RX_OVER)
+            else:
+                self.rx_fifo.append((I2CRxDma.IC_DATA_CMD__FIRST_DATA_BYTE if first else 0) | byte)
+            first = False
+            if self.dma is not None:
+                self.dma.step()
+    
+    def dreq(self):
+        """RX DREQ: receive DMA enabled and Rx FIFO level above IC_DMA_RDLR."""
+        return bool(self.regs.get(I2CRxDma.IC_DMA_CR, 0) & I2CRxDma.IC_DMA_CR__RDMAE) and \
+            len(self.rx_fifo) > self.regs.get(I2CRxDma.IC_DMA_RDLR, 0)
+    
+    def read_data_cmd(self):
+        """Pops IC_DATA_CMD (0 when the Rx FIFO is empty)."""
+        return self.rx_fifo.pop(0) if self.rx_fifo else 0
+    
+    def general_call_byte(self):
+        """As I2CResponder.general_call_byte(): clears the GEN_CALL flag, returning whether it was raised."""
+        if self.general_call and self.gen_call:
+            self.gen_call = False
+            self.general_calls += 1
+            return True
+        return False
+
+
+
+class SimDma:
+    """Simulator of the rp2.DMA methods used by I2CRxDma, moving halfwords from a SimI2CBlock into a ring."""
+    
+    def __init__(self, block, base_address=0x20010004):
+        self.block = block
+        block.dma = self
+        self.base_address = base_address            # fake address of the buffer (misaligned on purpose)
+        self.buffer = None
+        self.read = self.write = self.count = 0
+        self.ring_mask = 0
+        self._active = False
+    
+    def addressof(self, buf):
+        self.buffer = buf
+        return self.base_address
+    
+    def pack_ctrl(self, size=2, inc_read=True, inc_write=True, ring_size=0, ring_sel=False, treq_sel=0x3F, **kwargs):
+        return {'size': size, 'inc_read': inc_read, 'inc_write': inc_write,
+                'ring_size': ring_size, 'ring_sel': ring_sel, 'treq_sel': treq_sel}
+    
+    def config(self, read=0, write=0, count=0, ctrl=None, trigger=False):
+        assert ctrl['size'] == 1 and ctrl['ring_sel'] and not ctrl['inc_read']
+        self.read, self.write, self.count = read, write, count
+        self.ring_mask = (1 << ctrl['ring_size']) - 1
+        assert write & self.ring_mask == 0, "ring not aligned"
+        if trigger:
+            self._active = True
+            self.step()
+    
+    def active(self, value=None):
+        if value is None:
+            return self._active and self.count > 0
+        self._active = bool(value)
+        self.step()
+    
+    def step(self):
+        """Transfers while the DREQ is asserted."""
+        while self._active and self.count > 0 and self.block.dreq():
+            value = self.block.read_data_cmd()
+            i = self.write - self.base_address
+            self.buffer[i] = value & 0xFF
+            self.buffer[i + 1] = value >> 8
+            self.write = (self.write & ~self.ring_mask) | ((self.write + 2) & self.ring_mask)
+            self.count -= 1
+        if self.count == 0:
+            self._active = False
+    
+    def close(self):
+        self._active = False
+
+
+
+def simulate(frames=2000, fields=4, burst=8, printout=True):
+    """
+    Host check: the Controller writes bursts of back-to-back dataframes while core1 is busy (decoding).
+    Without DMA the 16 bytes Rx FIFO overflows, with DMA all the dataframes are decoded.
+    Broadcast dataframes (COBS framing) are then interleaved with the addressed ones: the general call command
+    byte is dropped from the ring, and all of them are decoded.
+    Returns (frames decoded via DMA, frames decoded via the FIFO, FIFO overflows).
+    """
+    import random
+    from frame_codec import encode_frame, make_decoder, FrameDecoder, OK, COBS_FRAMING
+    
+    def run(use_dma):
+        block = SimI2CBlock()
+        decoder = FrameDecoder(2 * fields)
+        rx = None
+        if use_dma:
+            dma = SimDma(block)
+            rx = I2CRxDma(block, 'RP2040', ring_bits=8, dma=dma, addressof=dma.addressof)
+        ok = 0
+        for i in range(0, frames, burst):
+            if use_dma:
+                rx.check()                          # bus watchdog, while idle
+            for _ in range(min(burst, frames - i)):  # core1 busy: frames pile up
+                block.controller_write(encode_frame([random.getrandbits(16) for _ in range(fields)]))
+            if use_dma:
+                while rx.write_data_is_available():
+                    if decoder.feed(rx.get_write_data()[0]) == OK:
+                        ok += 1
+                if i % 256 == 0:                    # transfer count exhausted, to exercise the re-arm
+                    dma.count = 0
+                    dma.step()
+            else:
+                while block.rx_fifo:
+                    if decoder.feed(block.read_data_cmd() & 0xFF) == OK:
+                        ok += 1
+        return ok, block.rx_overflows, rx
+    
+    def run_broadcast():
+        block = SimI2CBlock(general_call=True)
+        dma = SimDma(block)
+        rx = I2CRxDma(block, 'RP2040', ring_bits=8, dma=dma, addressof=dma.addressof)
+        decoder = make_decoder(2 * fields, COBS_FRAMING)
+        ok = errors = 0
+        for i in range(frames):
+            frame = encode_frame([random.getrandbits(16) for _ in range(fields)], framing=COBS_FRAMING)
+            if i & 1:                               # case of broadcast: the general call command byte comes first
+                block.controller_write(bytes((0x10,)) + frame, general_call=True)
+            else:
+                block.controller_write(frame)
+            while True:
+                byte = rx.get_write_byte()
+                if byte < 0:
+                    break
+                status = decoder.feed(byte)
+                if status == OK:
+                    ok += 1
+                elif status is not None:
+                    errors += 1
+        return ok, errors, block.general_calls
+    
+    ok_dma, overflows_dma, rx = run(True)
+    ok_fifo, overflows_fifo, _ = run(False)
+    ok_broadcast, errors_broadcast, general_calls = run_broadcast()
+    assert ok_dma == frames and overflows_dma == 0, (ok_dma, overflows_dma)
+    assert ok_broadcast == frames and errors_broadcast == 0, (ok_broadcast, errors_broadcast)
+    if printout:
+        print(f"DMA ring: {ok_dma}/{frames} dataframes, {overflows_dma} overflows, {rx.rearms} re-arms")
+        print(f"Rx FIFO:  {ok_fifo}/{frames} dataframes, {overflows_fifo} overflows")
+        print(f"DMA ring, COBS: {ok_broadcast}/{frames} dataframes ({general_calls} broadcast), {errors_broadcast} errors")
+    return ok_dma, ok_fifo, overflows_fifo
+
+
+
+if __name__ == '__main__':
+    simulate()
@@ -42,14 +42,32 @@ SOFTWARE.
 """
 
 
+import time                                        # micropython modules
+t_main_ms = time.ticks_ms()                        # time since reset, when main.py starts (boot timing)
 from machine import Timer, Pin                     # RP specific modules
-import _thread, time                               # micropython modules
+import _thread                                     # micropython modules
 
 # variables to manually set, on each Responder
 rgb_led = False                                    # flag to set True is the omboard led is rgb
-printout = True                                    # flag to enable the prints to the Shell
+printout = True                                    # flag to enable the prints to the Shell (debug log flushed by core0)
+log_file = None                                    # file at the Pico flash for the debug log (i.e. 'debug.log'), None prints it to the Shell
 i2c_id = 0x41                                      # I2C address for this board
-df_fields = 2                                      # number of data fields per I2C transaction (note: max 4. Set same value at i2c Master)
+df_fields = 2                                      # number of data fields per I2C transaction (note: max 4. Set same value at i2c Master, or let it negotiate)
+sequence = False                                   # flag for dataframes with sequence byte (set same value at i2c Master)
+framing = 'escape'                                 # dataframe framing: 'escape' (STX/ETX) or 'cobs' (set same value at i2c Master)
+delta = False                                      # flag for dataframes carrying the changed fields only (set same value at i2c Master)
+fec = False                                        # flag for dataframes carrying the Reed-Solomon parity bytes, correcting a corrupted byte (set same value at i2c Master)
+credits = False                                    # flag for the status byte carrying the free dataframe slots, pacing the Controller (set same value at i2c Master)
+bus_speed = None                                   # I2C bus speed in Hz (None keeps the defaults, 1000000 is needed for Fast-mode Plus)
+notify = False                                     # flag for core1 to notify core0 of each new dataframe (SIO FIFO)
+rx_dma = False                                     # flag to capture the received bytes via DMA, into a ring buffer (MicroPython >= 1.21)
+backend = 'i2c'                                    # Responder backend: 'i2c' (I2C block) or 'pio' (PIO state machines, SCL = SDA + 1)
+general_call = False                               # flag to accept the broadcast dataframes (general call, address 0x00)
+pipeline = False                                   # flag for core1 to only drain the I2C into a ring, core0 decoding (core_pipeline)
+fast_boot = False                                  # flag to skip the heart-beat waiting period at boot (production, i.e. after a brownout)
+escape_ms = 300                                    # fast boot: time window to stop the code via Ctrl+C (i.e. Thonny connecting)
+escape_gpio = None                                 # fast boot: GPIO that, held low at boot, stops the code (None to disable)
+vbus_gpio = None                                   # fast boot: GPIO sensing the USB power (24 at Pico and Pico 2), keeping the heart-beat when on USB
 
 
 def print_title():
@@ -63,42 +81,115 @@ def print_title():
 
 
 
+def escape_window():
+    """
+    Fast boot: short time window to stop the code, instead of the heart-beat period.
+    Ctrl+C (i.e. Thonny connecting) raises KeyboardInterrupt within the window, as usual.
+    Returns True when the escape GPIO is held low (the code has to be stopped).
+    """
+    pin = Pin(escape_gpio, Pin.IN, Pin.PULL_UP) if escape_gpio is not None else None
+    t_ref = time.ticks_ms()                        # time reference for the window
+    while time.ticks_diff(time.ticks_ms(), t_ref) < escape_ms:  # case the window is open
+        if pin is not None and not pin.value():    # case the escape GPIO is held low
+            return True                            # the code has to be stopped
+        time.sleep_ms(10)                          # sleep some little time
+    return False                                   # the code continues
+
+
+
+def usb_powered():
+    """Returns True when the VBUS sensing GPIO is set, and the board is powered via USB."""
+    return vbus_gpio is not None and Pin(vbus_gpio, Pin.IN).value() == 1
+
+
+
 def import_libraries(rgb_led=False):
     """
     Function to import libraries, after an initial 'wasting' period.
     The blinking led entertains during this 'waiting' period; This alows enough
     time for Thonny to connect and for the user to interrupt the code.
-    Remaing libraries are then imported.
+    With fast_boot (and not powered via USB), the heart-beat is replaced by a short escape window.
+    Remaing libraries are then imported (core_fifo only when notify is used).
     """
-    print("Waiting time to eventually stop the code before further imports ...\n")
-    
-    led_ret = False                                # led_ret is set False
-    if rgb_led:                                    # case rgb_led is True
-        from rgb_led import rgb_led as led         # singleton for RGB led handling
-    else:                                          # case rgb_led is False
-        from led import led                        # singleton for led handling
-    
-    # wasting time, allowing Thonny to connect and eventually stopping the RP2040 / RP2350
-    led_ret = led.heart_beat(n=10, delay=1)        # led flashes (10 x color if RGB) 
-    while not led_ret:                             # case led_ret is False
-        time. sleep(0.1)                           # sleep some little time
+    if fast_boot and not usb_powered():            # case of fast boot
+        print(f"Fast boot: {escape_ms}ms to stop the code ...\n")
+        if escape_window():                        # case the escape GPIO is held low
+            print("Escape GPIO held low")          # feedback is printed to the terminal
+            raise KeyboardInterrupt                # the code is stopped, as per Ctrl+C
+    else:                                          # case of normal boot
+        print("Waiting time to eventually stop the code before further imports ...\n")
+        
+        led_ret = False                            # led_ret is set False
+        if rgb_led:                                # case rgb_led is True
+            from rgb_led import rgb_led as led     # singleton for RGB led handling
+        else:                                      # case rgb_led is False
+            from led import led                    # singleton for led handling
+        
+        # wasting time, allowing Thonny to connect and eventually stopping the RP2040 / RP2350
+        led_ret = led.heart_beat(n=10, delay=1)    # led flashes (10 x color if RGB) 
+        while not led_ret:                         # case led_ret is False
+            time. sleep(0.1)                       # sleep some little time
     
     from shared_variables import shared_variables  # Singleton for global variables
     from i2c_handler import I2CHandler             # Class with the i2c data handling
+    from debug_log import debug_log                # Singleton for the deferred debug log
+    CoreFifo = None                                # Class for the frame-ready notifications from core1
+    if notify:                                     # case core1 notifies the new dataframes
+        from core_fifo import CoreFifo             # imported only when used
     
-    return shared_variables, I2CHandler            # return the libraries
+    return shared_variables, I2CHandler, debug_log, CoreFifo # return the libraries
+
+
+
+def new_handler(rp, i2c_id, rgb_led, on_descriptor=None):
+    """Returns the I2CHandler instance, with the settings of this file."""
+    led = 'rgb_led' if rgb_led else 'led'          # local led type to pass to the i2c Class
+    return I2CHandler(rp = rp, i2c_id = i2c_id, fields = df_fields, led_type = led, sequence = sequence, framing = framing, delta = delta, fec = fec, credits = credits, bus_speed = bus_speed, notify = notify, rx_dma = rx_dma, backend = backend, general_call = general_call, pipeline = pipeline, on_descriptor = on_descriptor, printout = printout)
 
 
 
 def core1(rp, i2c_id, fields, rgb_led):
     """ Funtion with imports and function for core1."""
     # create the singleton instance of the I2CHandler class
-    led = 'rgb_led' if rgb_led else 'led'          # local led type to pass to the i2c Class
-    i2c = I2CHandler(rp = rp, i2c_id = i2c_id, fields = df_fields, led_type = led, printout = printout)
+    i2c = new_handler(rp, i2c_id, rgb_led)         # I2CHandler instance
     i2c.run()                                      # calls the I2C infinite loop
 
 
 
+def on_frame(descriptor, data):
+    """
+    Application code, called by core0 right after core1 has applied a new dataframe (notify = True).
+    The descriptor holds the event, number of fields, sequence and frame counter (core_fifo.parse_descriptor),
+    data holds the fields of that dataframe (consistent set).
+    """
+    pass
+
+
+
+def on_bulk(descriptor, stream, payload):
+    """
+    Application code, called by core0 after core1 has received a bulk command (OP_BULK, notify = True).
+    stream is the logical stream id set by the Controller, payload holds its bytes (max 8).
+    """
+    pass
+
+
+
+def handle_descriptor(descriptor):
+    """Calls the application code for a descriptor of core1 (or of the core0 decoder, with pipeline)."""
+    global data                                    # fields of the last notified dataframe
+    if (descriptor >> 24) & 0x3F == EV_BULK:       # case of bulk command, instead of dataframe
+        stream, payload = shared_variables.read_bulk()  # stream id and bytes
+        on_bulk(descriptor, stream, payload)       # application code is called
+        return
+    n_fields = shared_variables.df_fields.read()   # fields per dataframe (the Controller can reconfigure it)
+    if len(data) != n_fields:                      # case the number of fields has been reconfigured
+        data = [0] * n_fields                      # fields of the last notified dataframe
+    shared_variables.read_fields(data, n_fields)   # fields of the last dataframe
+    on_frame(descriptor, data)                     # application code is called
+
+
+
 def stop_code():
     """Function to stop core1 and interrupts."""
     if 'shared_variables' in locals():             # case shared_variables has been imported
@@ -113,12 +204,37 @@ def stop_code():
 
 try:
     print_title()                                  # print the title to the Shell                     
-    shared_variables, I2CHandler = import_libraries(rgb_led)  # import libraries, while setting the onboard led type 
+    shared_variables, I2CHandler, debug_log, CoreFifo = import_libraries(rgb_led)  # import libraries, while setting the onboard led type 
     rp_type = shared_variables.rp                  # the microprocessor RP type is retrieved from the shared_variables
-    _thread.start_new_thread(core1, (rp_type, i2c_id, df_fields, rgb_led,)) # new thread with callback to core1 function
-
-    while True:                                    # infinite loop
-        time.sleep(0.1)                            # sleep for another little while
+    data = [0] * df_fields                         # fields of the last notified dataframe
+    if notify:                                     # case core1 notifies the new dataframes
+        from core_fifo import EV_BULK              # event id of the bulk command descriptors
+
+    if pipeline:                                   # case core1 only drains the I2C, and core0 decodes
+        i2c = new_handler(rp_type, i2c_id, rgb_led, handle_descriptor)  # I2CHandler instance, on core0
+        if printout:                               # case printout is set True
+            i2c.pipeline.idle = lambda: debug_log.flush(log_file)  # events are printed while the bus is idle
+        print(f"Boot: main.py started at {t_main_ms}ms, core1 started at {time.ticks_ms()}ms (since reset)")
+        _thread.start_new_thread(i2c.pipeline.drain, (shared_variables.halt,))  # core1 drains the I2C into the ring
+        i2c.run()                                  # core0 decodes and publishes, until halt
+    
+    else:                                          # case core1 does it all
+        if notify:                                 # case core1 notifies the new dataframes
+            fifo = CoreFifo()                      # core0 side of the inter-core FIFO
+            fifo.drain()                           # FIFO is emptied, before core1 starts
+        print(f"Boot: main.py started at {t_main_ms}ms, core1 started at {time.ticks_ms()}ms (since reset)")
+        _thread.start_new_thread(core1, (rp_type, i2c_id, df_fields, rgb_led,)) # new thread with callback to core1 function
+
+        while True:                                # infinite loop
+            if notify:                             # case core1 notifies the new dataframes
+                descriptor = fifo.wait(100)        # waits for a new dataframe (up to 100ms)
+                while descriptor is not None:      # case of new dataframe(s)
+                    handle_descriptor(descriptor)  # application code is called
+                    descriptor = fifo.pop()        # further descriptors, if any
+            else:                                  # case core1 doesn't notify
+                time.sleep(0.1)                    # sleep for another little while
+            if printout:                           # case printout is set True
+                debug_log.flush(log_file)          # core1 events are formatted and printed (or saved)
 
 except KeyboardInterrupt:                          # keyboard interrupts
     print("\n\nCtrl+C detected!")                  # feedback is printed to the terminal
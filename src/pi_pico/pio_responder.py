@@ -0,0 +1,404 @@
+"""
+Andrea Favero
+
+Micropython Class for Raspberry Pi Pico (RP2040 and RP2350).
+I2C Responder built on two PIO state machines, alternative to the I2C block (I2CResponder).
+
+This Class:
+- offers the same methods of I2CResponder used by I2CHandler: write_data_is_available(), get_write_data(),
+  read_is_pending(), put_read_data(), read_is_done(), check_bus() and recover().
+- a condition detector state machine holds SCL low after each START, until core1 has re-synchronized
+  the byte engine (STOP and repeated START are both handled by the following START).
+- a byte engine state machine shifts the received bytes into the PIO Rx FIFO, and holds SCL low
+  while waiting for the ACK decision or the byte to transmit.
+- the address is matched by core1, at the first byte after START: other addresses are NACKed and the
+  byte engine is paused until the next START.
+- during a write transfer, the ACK decisions are prefetched in the PIO Tx FIFO: bytes are ACKed without
+  waiting for core1, unless core1 falls behind by four bytes (then SCL is held low, no data is lost).
+- it runs on any pair of GPIOs with SCL = SDA + 1, on any PIO block (several Responders per chip).
+
+Notes:
+- both programs fill the 32 instructions of a PIO block: each Responder takes a PIO block (two state machines).
+- the byte engine is driven by the Controller clock: bus_speed isn't needed, Fast-mode Plus included.
+- a decision word has the ACK bit (bit 31) and the byte engine address to continue from (bits 30..26).
+- the byte to transmit is inverted and shifted out MSB first (a pin direction of 1 drives SDA low),
+  followed by a 0 bit releasing SDA for the Controller ACK.
+- each START holds SCL low until core1 polls this Class (tens of us): clock stretching must be supported
+  by the Controller. The BCM2835 family I2C controller of the Raspberry Pi (Pi Zero included) has a known
+  clock stretching bug (a stretch ending close to an SCL edge corrupts the transfer): with this backend,
+  lower the bus speed (i.e. 10-50 kHz) or use the bit-banged i2c-gpio overlay, which handles the stretching.
+
+
+
+MIT License
+
+Copyright (c) 2025 Andrea Favero
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+
+from machine import Pin, mem32
+import rp2, time
+
+
+@rp2.asm_pio(set_init=rp2.PIO.IN_LOW)
+def _condition_detector():
+    # in_base = SDA (pin 0), SCL = pin 1; set_base = SCL; jmp_pin = SCL
+    label("start")
+    wait(0, pin, 1)             # Controller pulls SCL low, after the START
+    set(pindirs, 1)             # SCL held low
+    pull(block)                 # until core1 has re-synchronized the byte engine (and released SCL)
+    wrap_target()
+    label("top")                # entry point
+    wait(1, pin, 0)             # SDA high
+    wait(0, pin, 0)             # SDA falling edge
+    jmp(pin, "start")           # SCL high: START (or repeated START)
+    wrap()
+
+
+@rp2.asm_pio(out_init=rp2.PIO.IN_LOW, set_init=rp2.PIO.IN_LOW,
+             in_shiftdir=rp2.PIO.SHIFT_LEFT, out_shiftdir=rp2.PIO.SHIFT_LEFT, pull_thresh=8)
+def _byte_engine():
+    # in_base = out_base = SDA (pin 0), SCL = pin 1; set_base = SCL; jmp_pin = SDA
+    label("wr")                 # entry point, after each START
+    mov(pindirs, null)          # SDA released (end of the ACK)
+    label("byte")
+    set(x, 7)
+    label("bit")
+    wait(0, pin, 1)
+    wait(1, pin, 1)             # SCL rising edge
+    in_(pins, 1)                # SDA sampled
+    jmp(x_dec, "bit")
+    wait(0, pin, 1)
+    set(pindirs, 1)             # SCL held low
+    push(block)                 # received byte to core1
+    pull(block)                 # ACK decision from core1 (or prefetched)
+    out(pindirs, 1) [31]        # ACK (SDA low) or NACK (SDA released), with data setup time
+    set(pindirs, 0)             # SCL released
+    wait(1, pin, 1)             # ACK clock
+    wait(0, pin, 1)
+    out(pc, 5)                  # continues to "wr" (write) or to "req" (read)
+    wrap_target()
+    label("req")
+    wait(0, pin, 1)
+    set(pindirs, 1)             # SCL held low: read request
+    pull(block)                 # byte to transmit, from core1 (inverted)
+    label("tbit")
+    out(pindirs, 1) [31]        # bit on SDA, while SCL is low, with data setup time
+    set(pindirs, 0)             # SCL released
+    wait(1, pin, 1)
+    wait(0, pin, 1)
+    jmp(not_osre, "tbit")
+    out(pindirs, 1)             # SDA released, for the Controller ACK
+    wait(1, pin, 1)
+    jmp(pin, "wr")              # SDA high: NACK, the read is completed
+    wrap()                      # ACK: another byte is requested
+
+
+
+class PIOResponder:
+    
+    # PIO register offsets and block addresses (same on RP2040 and RP2350)
+    PIO_BASE = (0x50200000, 0x50300000, 0x50400000)
+    SM0_ADDR = 0xD4             # current instruction address of SM0
+    SM_STRIDE = 0x18            # register block size per state machine
+    
+    # instruction positions in the programs
+    DETECTOR_PULL = 2           # detector waiting for core1 (SCL held low)
+    DETECTOR_TOP = 3            # detector entry point
+    ENGINE_WR = 0               # byte engine: continue with a write (entry point after START)
+    ENGINE_REQ = 15             # byte engine: continue with a read
+    ENGINE_REQ_PULL = 17        # byte engine waiting for the byte to transmit (SCL held low)
+    
+    # decision words (shifted by 26 bits when pushed): bit 5 ACK, bits 4..0 byte engine address
+    PREFETCH = 4                # Tx FIFO depth
+    
+    # transfer phases
+    IDLE = 0
+    ADDRESS = 1
+    WRITE = 2
+    READ = 3
+    GENERAL_CALL = 4                    # general call write, until its command byte
+    
+    def __init__(self, sm_id=0, sda_gpio=0, scl_gpio=1, responder_address=0x41, rp='RP2040',
+                 stuck_timeout_ms=25, bus_speed=None, general_call=False):
+        """Initialize.
+
+        Args:
+            sm_id (int, optional): The first of the two state machines to use (0, 4 or 8: a whole PIO block).
+            sda_gpio (int, optional): The gpio number of the pin to use for SDA.
+            scl_gpio (int, optional): The gpio number of the pin to use for SCL (must be sda_gpio + 1).
+            responder_address (int, optional): The I2C address to assign to this Responder.
+            rp (string, optional): Microcontroller core architectur ('RP2040' or 'RP2350').
+            stuck_timeout_ms (int, optional): Time after which SDA or SCL held low is considered
+                stuck by check_bus().
+            bus_speed (int, optional): Not used, as the PIO follows the Controller clock.
+            general_call (bool, optional): When True, the writes to the general call address (0x00)
+                are ACKed and received as the ones to responder_address (broadcast dataframes),
+                without their first byte (the general call command byte).
+        """
+        print("Uploading pio_responder ...")
+        
+        if scl_gpio != sda_gpio + 1:
+            raise ValueError("The PIO Responder needs SCL = SDA + 1")
+        if sm_id % 4:
+            raise ValueError("The PIO Responder needs the state machines 0 and 1 of a PIO block")
+        
+        self.responder_address = responder_address
+        self.general_call = general_call
+        self.i2c_device_id = None       # not an I2C block
+        self.stuck_timeout_ms = stuck_timeout_ms
+        
+        # GPIO with pull-up setting (external pull-up resistors are anyway needed)
+        self.sda_pin = Pin(sda_gpio, Pin.IN, Pin.PULL_UP)
+        self.scl_pin = Pin(scl_gpio, Pin.IN, Pin.PULL_UP)
+        
+        # state machines, at full system clock
+        self.detector = rp2.StateMachine(sm_id, _condition_detector, in_base=self.sda_pin,
+                                         set_base=self.scl_pin, jmp_pin=self.scl_pin)
+        self.engine = rp2.StateMachine(sm_id + 1, _byte_engine, in_base=self.sda_pin, out_base=self.sda_pin,
+                                       set_base=self.scl_pin, jmp_pin=self.sda_pin)
+        
+        # program counter registers, and program offsets (the PC is at the program start after init)
+        pio_base = self.PIO_BASE[sm_id // 4]
+        self.detector_pc = pio_base + self.SM0_ADDR + self.SM_STRIDE * (sm_id % 4)
+        self.engine_pc = pio_base + self.SM0_ADDR + self.SM_STRIDE * (sm_id % 4 + 1)
+        self.detector_offset = mem32[self.detector_pc]
+        self.engine_offset = mem32[self.engine_pc]
+        
+        # instructions executed by core1 (encoded once)
+        self.JMP_DETECTOR_TOP = self.detector_offset + self.DETECTOR_TOP  # jmp (always) is opcode 0
+        self.JMP_ENGINE_WR = self.engine_offset + self.ENGINE_WR
+        self.SET_PINDIRS_0 = rp2.asm_pio_encode("set(pindirs, 0)", 0)
+        self.MOV_PINDIRS_NULL = rp2.asm_pio_encode("mov(pindirs, null)", 0)
+        self.PULL_NOBLOCK = rp2.asm_pio_encode("pull(noblock)", 0)
+        
+        # decision words (6 bits, pushed with a 26 bits shift)
+        self.ack_write = 0x20 | (self.engine_offset + self.ENGINE_WR)
+        self.ack_read = 0x20 | (self.engine_offset + self.ENGINE_REQ)
+        self.nack = self.engine_offset + self.ENGINE_WR
+        self.detector_pull = self.detector_offset + self.DETECTOR_PULL
+        self.engine_req_pull = self.engine_offset + self.ENGINE_REQ_PULL
+        
+        # received bytes, moved from the PIO Rx FIFO (preallocated ring)
+        self.rx_buf = bytearray(32)
+        self.rx_head = 0
+        self.rx_tail = 0
+        self.rx_buffer_size = len(self.rx_buf) - 1  # received bytes held by the ring (capabilities)
+        
+        # transfer state and counters
+        self.phase = self.IDLE
+        self.read_started = False       # True when a read transfer has been ACKed (read_is_done)
+        self.transfer_start_ms = 0      # ticks_ms of the last START
+        self.low_ms = None              # ticks_ms since SDA or SCL is low
+        self.recoveries = 0             # number of state machines re-initializations
+        self.rx_overflows = 0           # received bytes dropped as the ring was full
+        self.tx_aborts = 0              # kept for compatibility with I2CResponder
+        self.last_abort_source = 0
+        self.starts = 0                 # number of START conditions
+        self.nacks = 0                  # number of NACKed addresses (other Responders)
+        self.general_calls = 0          # number of general call (broadcast) writes
+        
+        self.detector.exec(self.JMP_DETECTOR_TOP)
+        self.engine.active(1)
+        self.detector.active(1)
+    
+    
+    def _put_decision(self, decision):
+        """Push a decision word to the byte engine."""
+        self.engine.put(decision, 26)
+    
+    
+    def _start(self):
+        """Re-synchronize the byte engine after a START, then release SCL."""
+        engine = self.engine
+        engine.active(0)
+        while engine.tx_fifo():                 # prefetched decisions of the previous transfer are discarded
+            engine.exec(self.PULL_NOBLOCK)
+        engine.restart()
+        engine.exec(self.JMP_ENGINE_WR)         # the engine releases SDA and waits for the address
+        engine.active(1)
+        self.detector.exec(self.SET_PINDIRS_0)  # SCL released
+        self.detector.put(0)                    # detector waits for the next START
+        self.phase = self.ADDRESS
+        self.transfer_start_ms = time.ticks_ms()
+        self.starts += 1
+    
+    
+    def _poll(self):
+        """Move the received bytes to the ring, answer the address, and handle a START."""
+        engine = self.engine
+        while engine.rx_fifo():
+            byte = engine.get() & 0xFF
+            phase = self.phase
+            if phase == self.WRITE:
+                nxt = (self.rx_head + 1) & 31
+                if nxt == self.rx_tail:         # case the ring is full
+                    self.rx_overflows += 1
+                else:
+                    self.rx_buf[self.rx_head] = byte
+                    self.rx_head = nxt
+                if engine.tx_fifo() < self.PREFETCH:
+                    self._put_decision(self.ack_write)  # decisions are kept prefetched
+            elif phase == self.GENERAL_CALL:    # case of general call command byte (not part of the dataframe)
+                self.phase = self.WRITE
+                if engine.tx_fifo() < self.PREFETCH:
+                    self._put_decision(self.ack_write)
+            elif phase == self.ADDRESS:
+                if byte == 0 and self.general_call:  # case of general call (always a write)
+                    self.phase = self.GENERAL_CALL
+                    self.general_calls += 1
+                    for _ in range(self.PREFETCH):
+                        self._put_decision(self.ack_write)
+                elif byte >> 1 == self.responder_address:
+                    if byte & 1:                # case of read transfer
+                        self.phase = self.READ
+                        self.read_started = True
+                        self._put_decision(self.ack_read)
+                    else:                       # case of write transfer
+                        self.phase = self.WRITE
+                        for _ in range(self.PREFETCH):
+                            self._put_decision(self.ack_write)
+                else:                           # case of another Responder
+                    self._put_decision(self.nack)
+                    while engine.tx_fifo():     # until the engine has taken the decision
+                        pass
+                    time.sleep_us(2)            # NACK executed, SCL released
+                    engine.active(0)            # engine paused until the next START
+                    self.phase = self.IDLE
+                    self.nacks += 1
+        
+        if mem32[self.detector_pc] == self.detector_pull and not self.detector.tx_fifo():
+            self._start()
+    
+    
+    def read_is_pending(self):
+        """Return True if the Controller has issued an I2C READ command (SCL is held low meanwhile)."""
+        self._poll()
+        return self.phase == self.READ and mem32[self.engine_pc] == self.engine_req_pull \
+            and not self.engine.tx_fifo()
+    
+    
+    def put_read_data(self, data):
+        """Issue requested I2C READ data to the requesting Controller.
+
+        Args:
+            data (int): A byte value to send.
+        """
+        self.engine.put((~data) & 0xFF, 24)     # inverted, MSB first
+    
+    
+    def read_is_done(self):
+        """Return True once, after a new READ transfer has been addressed to this Responder."""
+        if self.read_started:
+            self.read_started = False
+            return True
+        return False
+    
+    
+    def write_data_is_available(self):
+        """Check whether incoming (I2C WRITE) data is available.
+
+        Returns:
+            True if data is available, False otherwise.
+        """
+        self._poll()
+        return self.rx_head != self.rx_tail
+    
+    
+    def write_data_bytes_available(self):
+        """Determine number of bytes received."""
+        self._poll()
+        return (self.rx_head - self.rx_tail) & 31
+    
+    
+    def rx_free(self):
+        """Determine number of bytes the ring can still receive (credits reported to the Controller)."""
+        return self.rx_buffer_size - self.write_data_bytes_available()
+    
+    
+    def get_write_data(self, max_size=1):
+        """Get incoming (I2C WRITE) data.
+
+        Args:
+            max_size (int): The maximum number of bytes to fetch.
+        Returns:
+            A list containing 0 to max_size bytes.
+        """
+        data = []
+        while len(data) < max_size and self.rx_head != self.rx_tail:
+            data.append(self.rx_buf[self.rx_tail])
+            self.rx_tail = (self.rx_tail + 1) & 31
+        return data
+    
+    
+    def get_write_byte(self):
+        """Get one incoming (I2C WRITE) byte, without heap allocations.
+
+        Returns:
+            The byte value, or -1 if no data is available.
+        """
+        self._poll()
+        tail = self.rx_tail
+        if self.rx_head == tail:
+            return -1
+        self.rx_tail = (tail + 1) & 31
+        return self.rx_buf[tail]
+    
+    
+    def check_bus(self):
+        """Bus watchdog, to be called periodically while not serving the bus.
+
+        Returns:
+            True if the state machines have been re-initialized, False otherwise.
+        """
+        now = time.ticks_ms()
+        if self.sda_pin.value() and self.scl_pin.value():
+            self.low_ms = None
+        elif self.low_ms is None:
+            self.low_ms = now
+        elif time.ticks_diff(now, self.low_ms) > self.stuck_timeout_ms:
+            return self.recover()
+        return False
+    
+    
+    def recover(self):
+        """Re-initialize both state machines, releasing SDA and SCL.
+
+        Returns:
+            True, as the state machines have been re-initialized.
+        """
+        for sm in (self.engine, self.detector):
+            sm.active(0)
+            while sm.tx_fifo():
+                sm.exec(self.PULL_NOBLOCK)
+            sm.restart()
+        self.engine.exec(self.MOV_PINDIRS_NULL)  # SDA released
+        self.engine.exec(self.SET_PINDIRS_0)     # SCL released
+        self.engine.exec(self.JMP_ENGINE_WR)
+        self.detector.exec(self.JMP_DETECTOR_TOP)
+        self.engine.active(0)                    # engine waits for the next START
+        self.detector.active(1)
+        
+        self.phase = self.IDLE
+        self.recoveries += 1
+        self.low_ms = None
+        return True
@@ -1,49 +0,0 @@
-"""
-Andrea Favero 08/03/2025
-
-Micropython Class for Raspberry Pi Pico (RP2040 and RP2350).
-This code is used to prevent the same mem16 address from being accessed
-by different Pico's cores at the same time.
-
-
-
-MIT License
-
-Copyright (c) 2025 Andrea Favero
-
-Permission is hereby granted, free of charge, to any person obtaining a copy
-of this software and associated documentation files (the "Software"), to deal
-in the Software without restriction, including without limitation the rights
-to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
-copies of the Software, and to permit persons to whom the Software is
-furnished to do so, subject to the following conditions:
-
-The above copyright notice and this permission notice shall be included in all
-copies or substantial portions of the Software.
-
-THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
-IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
-FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
-AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
-LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
-OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
-SOFTWARE.
-"""
-
-
-from machine import mem16
-import _thread
-
-class SharedMemory:
-    def __init__(self, address):
-        self.address = address
-        self._lock = _thread.allocate_lock()
-    
-    def read(self):
-        with self._lock:
-            return mem16[self.address]
-    
-    def write(self, value):
-        with self._lock:
-            mem16[self.address] = value
-
@@ -0,0 +1,263 @@
+"""
+Andrea Favero
+
+Micropython Class for Raspberry Pi Pico (RP2040 and RP2350).
+Registry of named and typed shared variables, allocated from a reserved arena at the end of the SRAM.
+
+This Class:
+- allocates slots of type u8, u16, u32, f32 and bytes (n bytes), in registration order.
+- each slot is aligned to its size (bytes slots to 4), and must fit the arena (ValueError otherwise).
+- u8, u16 and u32 slots are read and written with a single bus access (atomic, no locks needed).
+- a SeqLock (u16 slot) allows core1 to update several slots at once, and core0 to read a consistent set.
+- bytes slots give a direct view of the arena (no copies).
+- reports the layout, with the addresses at both RP2040 and RP2350.
+
+Notes:
+- slots keep the read() and write() methods of SharedMemory.
+- SeqLock assumes a single writer (core1); readers retry while an update is in progress.
+- the arena ends at the SRAM end used by this project since the beginning (last 32 bytes, by default):
+  a bigger arena moves the base address down.
+- the extension (extension bytes, below the arena) takes the slots not fitting the arena, growing downward:
+  the addresses of the arena slots stay fixed (code using the former mem16 addresses keeps working).
+
+
+
+MIT License
+
+Copyright (c) 2025 Andrea Favero
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+
+from machine import mem8, mem16, mem32
+import struct, uctypes
+
+# SRAM end of the arena, and SRAM limits, per microprocessor
+SRAM_END = {'RP2040': 0x20042000, 'RP2350': 0x20080000}
+
+
+
+class Slot:
+    """Base Class of the typed slots."""
+    size = 0
+    kind = ''
+    
+    def __init__(self, name, address, offset):
+        self.name = name                        # slot name
+        self.address = address                  # absolute address
+        self.offset = offset                    # offset from the arena base
+
+
+class U8Slot(Slot):
+    size = 1
+    kind = 'u8'
+    
+    def read(self):
+        return mem8[self.address]
+    
+    def write(self, value):
+        mem8[self.address] = value
+
+
+class U16Slot(Slot):
+    size = 2
+    kind = 'u16'
+    
+    def read(self):
+        return mem16[self.address]
+    
+    def write(self, value):
+        mem16[self.address] = value
+
+
+class U32Slot(Slot):
+    size = 4
+    kind = 'u32'
+    
+    def read(self):
+        return mem32[self.address] & 0xFFFFFFFF  # mem32 returns a signed value
+    
+    def write(self, value):
+        mem32[self.address] = value
+
+
+class F32Slot(Slot):
+    size = 4
+    kind = 'f32'
+    
+    def __init__(self, name, address, offset):
+        super().__init__(name, address, offset)
+        self.mem = uctypes.bytearray_at(address, 4)  # view of the slot memory
+    
+    def read(self):
+        return struct.unpack('<f', self.mem)[0]
+    
+    def write(self, value):
+        struct.pack_into('<f', self.mem, 0, value)
+
+
+class BytesSlot(Slot):
+    kind = 'bytes'
+    
+    def __init__(self, name, address, offset, size):
+        super().__init__(name, address, offset)
+        self.size = size                        # slot length, in bytes
+        self.mem = uctypes.bytearray_at(address, size)  # view of the slot memory
+    
+    def read(self):
+        """Returns a copy of the slot bytes (use view() to avoid the copy)."""
+        return bytes(self.mem)
+    
+    def view(self):
+        """Returns the slot memory itself, as bytearray."""
+        return self.mem
+    
+    def write(self, value):
+        n = len(value)
+        if n > self.size:
+            raise ValueError("{} bytes don't fit the slot {} ({} bytes)".format(n, self.name, self.size))
+        self.mem[:n] = value
+
+
+SLOT_TYPES = {'u8': U8Slot, 'u16': U16Slot, 'u32': U32Slot, 'f32': F32Slot}
+
+
+
+class SeqLock:
+    """
+    Sequence lock for batched updates: the writer makes the counter odd while updating the slots,
+    and even when done; readers retry when the counter is odd or changed while reading.
+    """
+    
+    def __init__(self, slot):
+        self.slot = slot                        # u16 slot with the counter
+        self.address = slot.address
+        mem16[self.address] = 0                 # even: no update in progress
+    
+    def write(self, slots, values, count=None):
+        """Writes values[i] to slots[i] (first count ones), as a single update."""
+        address = self.address
+        seq = mem16[address]
+        mem16[address] = seq + 1                # odd: update in progress
+        for i in range(len(slots) if count is None else count):
+            slots[i].write(values[i])
+        mem16[address] = seq + 2                # even: update completed
+    
+    def read(self, slots, out, count=None):
+        """Fills out[i] with slots[i] (first count ones), from a single update. Returns out."""
+        address = self.address
+        n = len(slots) if count is None else count
+        while True:
+            seq = mem16[address]
+            if seq & 1:                         # case of update in progress
+                continue
+            for i in range(n):
+                out[i] = slots[i].read()
+            if mem16[address] == seq:           # case no update in the meantime
+                return out
+
+
+
+class SharedRegistry:
+    """Allocator of the named typed slots, from the arena at the SRAM end."""
+    
+    def __init__(self, rp='RP2040', arena_size=32, extension=0):
+        if rp not in SRAM_END:
+            raise ValueError("Unknown microcontroller: {}".format(rp))
+        if arena_size <= 0 or arena_size % 4 or extension < 0 or extension % 4:
+            raise ValueError("The arena and extension sizes must be multiples of 4 (arena positive)")
+        self.rp = rp
+        self.arena_size = arena_size            # bytes reserved for the shared variables
+        self.extension = extension              # bytes reserved below the arena, for the slots not fitting it
+        self.base = SRAM_END[rp] - arena_size   # arena base address
+        self.used = 0                           # bytes allocated (padding included)
+        self.ext_used = 0                       # bytes allocated in the extension, from the arena base downward
+        self.slots = {}                         # slots by name, in registration order
+        self.order = []                         # slot names, in registration order
+    
+    
+    def add(self, name, kind, size=None, value=0):
+        """
+        Allocates a slot of kind 'u8', 'u16', 'u32', 'f32' or 'bytes' (size bytes), aligned to its size.
+        A slot not fitting the arena goes to the extension below it (negative offset from the arena base).
+        The slot is initialized with value (bytes slots are zeroed). Returns the slot.
+        """
+        if name in self.slots:
+            raise ValueError("Slot {} already allocated".format(name))
+        if kind == 'bytes':
+            if not size or size <= 0:
+                raise ValueError("Bytes slot {} needs a positive size".format(name))
+            align = 4
+        elif kind in SLOT_TYPES:
+            size = SLOT_TYPES[kind].size
+            align = size
+        else:
+            raise ValueError("Unknown slot type: {}".format(kind))
+        
+        offset = (self.used + align - 1) & ~(align - 1)   # aligned offset
+        in_arena = offset + size <= self.arena_size
+        if not in_arena:                        # case of slot in the extension, below the arena base
+            ext_offset = (self.ext_used + size + align - 1) & ~(align - 1)
+            if ext_offset > self.extension:
+                raise ValueError("Slot {} ({} bytes) exceeds the arena ({} of {} bytes used) and the extension "
+                                 "({} of {} bytes used)".format(name, size, self.used, self.arena_size,
+                                                                self.ext_used, self.extension))
+            offset = -ext_offset
+        address = self.base + offset
+        if kind == 'bytes':
+            slot = BytesSlot(name, address, offset, size)
+            slot.write(bytes(size))
+        else:
+            slot = SLOT_TYPES[kind](name, address, offset)
+            slot.write(value)
+        if in_arena:
+            self.used = offset + size
+        else:
+            self.ext_used = -offset
+        self.slots[name] = slot
+        self.order.append(name)
+        return slot
+    
+    
+    def seqlock(self, name):
+        """Allocates a u16 slot for a SeqLock, and returns the SeqLock."""
+        return SeqLock(self.add(name, 'u16'))
+    
+    
+    def __getitem__(self, name):
+        return self.slots[name]
+    
+    
+    def layout(self):
+        """Returns a list of (name, kind, offset, size) for the allocated slots."""
+        return [(name, self.slots[name].kind, self.slots[name].offset, self.slots[name].size) for name in self.order]
+    
+    
+    def report(self):
+        """Prints the layout, with the slot addresses at RP2040 and RP2350."""
+        print("Shared variables: {} of {} bytes used, extension {} of {} bytes used".format(
+            self.used, self.arena_size, self.ext_used, self.extension))
+        print("{:<14} {:<6} {:>6} {:>5}   {:<10}   {:<10}".format('name', 'type', 'offset', 'size', 'RP2040', 'RP2350'))
+        for name, kind, offset, size in self.layout():
+            print("{:<14} {:<6} {:>6} {:>5}   {:<10}   {:<10}".format(
+                name, kind, offset, size,
+                hex(SRAM_END['RP2040'] - self.arena_size + offset),
+                hex(SRAM_END['RP2350'] - self.arena_size + offset)))
@@ -5,12 +5,22 @@ Micropython Class for Raspberry Pi Pico (RP2040 and RP2350).
 
 This Class:
 - determines if running on RP2040 or RP2350, and stores it in a instance variable.
-- it stores a list with four mem16 addresses for the I2C data fields.
-- it stores a mem16 address for a halt flag, used by core0 to stop core1.
+- it allocates the shared variables as typed slots of a registry (shared_registry), at the SRAM end.
+- it stores a list with four u16 slots for the I2C data fields, updated together via a SeqLock.
+- it stores a u16 slot for a halt flag, used by core0 to stop core1.
+- it stores three u16 slots for the dataframe sequence counters (duplicates, gaps, reorders).
+- it stores a u16 slot for the I2C bus recoveries counter.
+- it stores two u8 slots for the protocol configuration (fields per dataframe and mode bits), set by core1.
+- it stores the slots of the last bulk command (stream, length and up to 8 bytes), updated together via a SeqLock.
+- further slots (u8, u16, u32, f32, bytes) can be added to the registry by the application.
 
 Notes:
-- mem16 DMA is used for inter-cores communication.
-- used mem16 addresses are at very end of the SRAM.
+- mem8/mem16/mem32 DMA is used for inter-cores communication.
+- used addresses are at very end of the SRAM (arena of ARENA_SIZE bytes, same addresses as the former mem16 ones):
+  the slots added later (bulk command) go to the extension below the arena, not moving the former addresses.
+- the extension grows downward into the top of the SRAM, where the core0 stack lives (on RP2040 the stack starts at
+  the SRAM end, in the SCRATCH_Y bank, growing downward): it can't be reserved from here (MicroPython linker script),
+  so EXTENSION_SIZE is kept to the 8 bytes needed, on top of the 32 bytes used since the beginning.
 - RP2040 and RP2350 differ in SRAM size.
 
 
@@ -38,10 +48,14 @@ SOFTWARE.
 """
 
 
-from shared_memory import SharedMemory
+from shared_registry import SharedRegistry
 import uos
 
 class SharedVariables:
+    
+    ARENA_SIZE = 32                     # bytes reserved at the SRAM end (multiple of 4), as the former mem16 layout
+    EXTENSION_SIZE = 8                  # bytes reserved below the arena, for the slots not fitting it (multiple of 4)
+    
     _instance = None
 
     def __new__(cls, *args, **kwargs):
@@ -53,31 +67,66 @@ class SharedVariables:
     
     def _init(self):
         print("Uploading shared_variables ...")
-
         self.rp = self._check_micro()
-        if self.rp == "RP2040":
-            base_address = 0x20041FE0   # RP2040 SRAM upper memory
-        elif self.rp == "RP2350":
-            base_address = 0x2007FFE0   # RP2350 SRAM upper memory
+        
+        # registry of the shared variables, at the SRAM upper memory (RP2040 0x20041FE0, RP2350 0x2007FFE0),
+        # with the extension right below (RP2040 from 0x20041FD8, RP2350 from 0x2007FFD8)
+        self.registry = SharedRegistry(self.rp, self.ARENA_SIZE, self.EXTENSION_SIZE)
+        registry = self.registry
 
         # pins used at RP2040-ZERO / RP2350-ZERO
         self.I2C0_SDA_PIN = 0           # I2C0 SDA pin
         self.I2C0_SCL_PIN = 1           # I2C0 SCL pin
         
-        # define fixed memory locations for dataframe fields (max 4 fields)
-        self.HALT_FLAG_ADR = base_address
-        self.FIELD_ADRS = [base_address + i * 2 for i in range(1, 5)]  # create a list with fields mem16 adressed
-
         # flag used to stop core1 task
-        self.halt = SharedMemory(self.HALT_FLAG_ADR)
-        self.halt.write(0)              # 0 = run, 1 = halt
-
-        # create SharedMemory objects for the data fields
-        self.fields = [SharedMemory(addr) for addr in self.FIELD_ADRS]
-
-        # initialize memory locations for the data fields
-        for field in self.fields:
-            field.write(0)              # Set initial value to 0
+        self.halt = registry.add('halt', 'u16', value=0)  # 0 = run, 1 = halt
+        self.HALT_FLAG_ADR = self.halt.address
+        
+        # slots for the dataframe fields (max 4 fields), initially set to 0
+        self.fields = [registry.add('field' + str(i), 'u16') for i in range(4)]
+        self.FIELD_ADRS = [field.address for field in self.fields]
+        
+        # slots for the dataframe sequence counters, initially set to 0
+        self.duplicates = registry.add('duplicates', 'u16')
+        self.gaps = registry.add('gaps', 'u16')
+        self.reorders = registry.add('reorders', 'u16')
+        self.DUPLICATES_ADR = self.duplicates.address
+        self.GAPS_ADR = self.gaps.address
+        self.REORDERS_ADR = self.reorders.address
+        
+        # slot for the I2C bus recoveries counter, initially set to 0
+        self.recoveries = registry.add('recoveries', 'u16')
+        self.RECOVERIES_ADR = self.recoveries.address
+        
+        # slots for the protocol configuration, as set at boot or by the Controller (capability handshake)
+        self.df_fields = registry.add('df_fields', 'u8')
+        self.mode = registry.add('mode', 'u8')
+        
+        # sequence lock, for the fields of a dataframe to be read by core0 as a consistent set
+        self.fields_lock = registry.seqlock('fields_seq')
+        
+        # slots for the last bulk command (OP_BULK): stream and length (8 bits each), up to 8 bytes
+        self.bulk_info = registry.add('bulk_info', 'u16')
+        self.bulk = registry.add('bulk', 'bytes', size=8)
+        self.bulk_slots = (self.bulk_info, self.bulk)
+        self.bulk_lock = registry.seqlock('bulk_seq')
+    
+    
+    def read_fields(self, out, count=4):
+        """Fills out with the fields of the same dataframe (core0 side). Returns out."""
+        return self.fields_lock.read(self.fields, out, count)
+    
+    
+    def write_bulk(self, stream, payload):
+        """Writes the bytes of a logical stream (core1 side), as a single update."""
+        self.bulk_lock.write(self.bulk_slots, ((stream << 8) | len(payload), payload))
+    
+    
+    def read_bulk(self):
+        """Returns the (stream, bytes) of the last bulk command, from a single update (core0 side)."""
+        out = [0, b'']
+        self.bulk_lock.read(self.bulk_slots, out)
+        return out[0] >> 8, out[1][:out[0] & 0xFF]
     
     
     def _check_micro(self):